@@ -1,42 +1,141 @@
-import asyncio
+from datetime import timedelta
+import multiprocessing
 import os
 
 from aiohttp import web
 import aiohttp_cors
-import oci
 
 from basicauth import basic_auth_middleware
+from compression import compression_middleware, precompress_static
 from db import create_session
-from objectstore import ObjectStore
-from view import FeedView, FilesView
+from jobs import JobQueue
+from mediacache import MediaCache
+from metrics import metrics, metrics_middleware
+from objectstore import OCI_CREATE_PAR, OCI_DELETE_OBJECT, YT_DLP, ObjectStore
+from view import (
+    BOOK_JOB, PURGE_JOB, SYNC_JOB, YOUTUBE_JOB, FeedCache, FeedView, FilesView
+)
+from ytdlppool import YtDlpPool
 
 UI_HOST_URL = "https://stethoscope.lbogdanov.dev"
+API_HOST_URL = "https://api-stethoscope.lbogdanov.dev"
 
 
 async def healthcheck(_: web.Request) -> web.Response:
+    # liveness: the event loop is serving requests
     return web.Response(text="OK")
 
 
+def readiness_check(object_store: ObjectStore):
+    async def check(_: web.Request) -> web.Response:
+        if not object_store.ready:
+            raise web.HTTPServiceUnavailable(text="Object storage not ready")
+        return web.Response(text="OK")
+
+    return check
+
+
 async def build_app():
     db_session = await create_session(os.getenv("DB_FILE"))
-    oci_config = await asyncio.to_thread(
-        oci.config.from_file, os.getenv("OCI_CONFIG_FILE")
-    )
     user, password = os.getenv("BASIC_AUTH").split(":", 1)
 
     app = web.Application(
         middlewares=[
-            basic_auth_middleware(["/files"], {user: password})
+            metrics_middleware(),
+            compression_middleware(
+                min_size=int(os.getenv("MIN_COMPRESS_SIZE", "1024"))
+            ),
+            basic_auth_middleware(["/files", "/metrics"], {user: password})
         ]
     )
-    object_store = ObjectStore(oci_config)
-    feed_view = FeedView(UI_HOST_URL, db_session, object_store)
-    files_view = FilesView(db_session, object_store)
+    yt_dlp_pool = None
+    # keeps yt-dlp loaded in worker processes, 0 runs the CLI per download
+    if yt_dlp_workers := int(os.getenv("YT_DLP_WORKERS", "2")):
+        yt_dlp_pool = YtDlpPool(
+            # the total, shared out between the server processes
+            -(-yt_dlp_workers // _server_processes()),
+            extractor=os.getenv("YT_DLP_EXTRACTOR"),
+            max_jobs=int(os.getenv("YT_DLP_WORKER_JOBS", "50")),
+            max_rss_mb=int(os.getenv("YT_DLP_WORKER_RSS_MB", "512"))
+        )
+        app.on_startup.append(yt_dlp_pool.start)
+        app.on_cleanup.append(yt_dlp_pool.close)
+    object_store = ObjectStore(
+        os.getenv("OCI_CONFIG_FILE"),
+        url_cache_size=int(os.getenv("PAR_CACHE_SIZE", "1024")),
+        url_safety_margin=timedelta(
+            seconds=int(os.getenv("PAR_SAFETY_MARGIN", "3600"))
+        ),
+        stream_uploads=os.getenv("STREAM_UPLOADS", "false") == "true",
+        http_connections=int(os.getenv("HTTP_CONNECTIONS", "32")),
+        oci_concurrency={
+            OCI_CREATE_PAR: int(os.getenv("OCI_PAR_CONCURRENCY", "8")),
+            OCI_DELETE_OBJECT: int(os.getenv("OCI_DELETE_CONCURRENCY", "4"))
+        },
+        oci_endpoint=os.getenv("OCI_ENDPOINT"),
+        yt_dlp=os.getenv("YT_DLP", YT_DLP),
+        yt_dlp_pool=yt_dlp_pool
+    )
+    feed_cache = FeedCache(
+        db_session, max_size=int(os.getenv("FEED_CACHE_SIZE", "256"))
+    )
+    media_cache = None
+    # proxies media through a local disk cache instead of redirecting
+    if media_cache_dir := os.getenv("MEDIA_CACHE_DIR"):
+        media_cache = MediaCache(
+            media_cache_dir,
+            object_store,
+            max_size=int(os.getenv("MEDIA_CACHE_SIZE_MB", "10240")) * 1024 * 1024,
+            max_idle=timedelta(
+                days=int(os.getenv("MEDIA_CACHE_MAX_IDLE_DAYS", "0"))
+            ) or None
+        )
+        app.on_startup.append(media_cache.start)
+        app.on_cleanup.append(media_cache.close)
+    job_queue = JobQueue(
+        db_session,
+        concurrency={
+            # limits across all server processes
+            YOUTUBE_JOB: int(os.getenv("YOUTUBE_JOBS", "2")),
+            BOOK_JOB: int(os.getenv("BOOK_JOBS", "1")),
+            PURGE_JOB: int(os.getenv("PURGE_JOBS", "1")),
+            SYNC_JOB: int(os.getenv("SYNC_JOBS", "1"))
+        },
+        max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+    )
+    feed_view = FeedView(
+        UI_HOST_URL,
+        os.getenv("API_HOST_URL", API_HOST_URL),
+        db_session,
+        object_store,
+        feed_cache,
+        youtube_feed_limit=int(os.getenv("YOUTUBE_FEED_LIMIT", "100")),
+        media_cache=media_cache
+    )
+    files_view = FilesView(
+        db_session,
+        object_store,
+        feed_cache,
+        job_queue,
+        probe_concurrency=int(os.getenv("TAG_CONCURRENCY", "8")),
+        sync_interval=timedelta(
+            minutes=int(os.getenv("YOUTUBE_SYNC_INTERVAL_MINUTES", "60"))
+        )
+    )
+    app.on_startup.append(object_store.start)
+    app.on_startup.append(feed_cache.start)
+    # resumes jobs left pending or with an expired lease by a previous run
+    app.on_startup.append(job_queue.start)
+    app.on_cleanup.append(job_queue.stop)
+    app.on_cleanup.append(feed_cache.stop)
+    app.on_cleanup.append(object_store.close)
 
     app.router.add_get("/youtube/feed", feed_view.get_youtube_feed)
     app.router.add_get("/book/{book_id}/feed", feed_view.get_audiobook_feed)
     app.router.add_get("/media/{episode_id}", feed_view.get_media_url)
     app.router.add_get("/health", healthcheck)
+    app.router.add_get("/health/ready", readiness_check(object_store))
+    app.router.add_get("/metrics", metrics)
 
     cors_opts = {
         UI_HOST_URL: aiohttp_cors.ResourceOptions(
@@ -58,6 +157,17 @@ async def build_app():
         app.router.add_post("/files/youtube/add", files_view.add_youtube),
         cors_opts
     )
+    cors.add(
+        app.router.add_post("/files/youtube/playlist", files_view.add_youtube_playlist),
+        cors_opts
+    )
+    cors.add(
+        app.router.add_delete(
+            "/files/youtube/subscriptions/{subscription_id}",
+            files_view.delete_subscription
+        ),
+        cors_opts
+    )
     cors.add(
         app.router.add_post("/files/book/add", files_view.start_book_upload),
         cors_opts
@@ -66,16 +176,53 @@ async def build_app():
         app.router.add_post("/files/book/{book_id}/add_chapter", files_view.upload_book_chapter),
         cors_opts
     )
+    cors.add(
+        app.router.add_post("/files/book/{book_id}/add_chapters", files_view.upload_book_chapters),
+        cors_opts
+    )
+    cors.add(
+        app.router.add_post("/files/blobs/check", files_view.check_blobs),
+        cors_opts
+    )
     cors.add(
         app.router.add_post("/files/book/{book_id}/complete", files_view.complete_book_upload),
         cors_opts
     )
+    cors.add(
+        app.router.add_get("/files/jobs/{job_id}", files_view.get_job),
+        cors_opts
+    )
+    cors.add(
+        app.router.add_get("/files/jobs/{job_id}/events", files_view.get_job_events),
+        cors_opts
+    )
 
     if ui_dir := os.getenv("UI_PATH"):
         app.router.add_static("/", ui_dir)
+        app.on_startup.append(lambda _: precompress_static(ui_dir))
 
     return app
 
 
+def _server_processes() -> int:
+    # WORKERS for app.py, WEB_CONCURRENCY for gunicorn
+    return int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+
+
+def serve(reuse_port: bool = False) -> None:
+    web.run_app(build_app(), reuse_port=reuse_port)
+
+
 if __name__ == "__main__":
-    web.run_app(build_app())
+    # workers share the port and the database, jobs are leased through it
+    if (workers := int(os.getenv("WORKERS", "1"))) > 1:
+        processes = [
+            multiprocessing.Process(target=serve, args=(True,))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        serve()
@@ -1 +1,2 @@
 from .middleware import basic_auth_middleware
+from .passwords import hash_password, verify_password
@@ -1,26 +1,59 @@
 from aiohttp import hdrs, web, BasicAuth
+import asyncio
+from datetime import timedelta
+import hashlib
+import os
+import re
 from typing import Callable, Dict, Iterable
 
+from cache import ExpiringLRUCache
+from .passwords import verify_password
+
 
 def basic_auth_middleware(
         urls: Iterable[str],
         auth_dict: Dict[str, str],
-        hash_strategy: Callable[[str], str] = lambda x: x
+        hash_strategy: Callable[[str], str] = lambda x: x,
+        cache_size: int = 1024,
+        cache_ttl: timedelta = timedelta(minutes=5),
+        verify_concurrency: int = 2
 ):
+    # an empty pattern would match every path
+    protected_urls = re.compile(
+        "|".join(re.escape(url) for url in urls) or r"(?!)"
+    )
+    # verified headers are kept as keyed digests, never as credentials
+    digest_key = os.urandom(32)
+    verified_headers = ExpiringLRUCache[bool](cache_size)
+    # bounds the CPU spent on KDFs, e.g. under password guessing
+    verifications = asyncio.Semaphore(verify_concurrency)
+
     @web.middleware
     async def middleware(request: web.Request, handler) -> web.StreamResponse:
-        if request.method != hdrs.METH_OPTIONS:
-            for url in urls:
-                if not request.path.startswith(url):
-                    continue
-
-                auth_header = request.headers.get(hdrs.AUTHORIZATION, "")
-                if _check_access(auth_dict, auth_header, hash_strategy):
-                    return await handler(request)
-                else:
-                    raise web.HTTPUnauthorized(
-                        headers={hdrs.WWW_AUTHENTICATE: "Basic"}
-                    )
+        if (
+            request.method != hdrs.METH_OPTIONS
+            and protected_urls.match(request.path)
+        ):
+            auth_header = request.headers.get(hdrs.AUTHORIZATION, "")
+            header_digest = hashlib.blake2b(
+                auth_header.encode(), key=digest_key
+            ).digest()
+            if verified_headers.get(header_digest):
+                return await handler(request)
+
+            async with verifications:
+                verified = await asyncio.to_thread(
+                    _check_access, auth_dict, auth_header, hash_strategy
+                )
+            if verified:
+                verified_headers.put(
+                    header_digest, True, cache_ttl.total_seconds()
+                )
+                return await handler(request)
+            else:
+                raise web.HTTPUnauthorized(
+                    headers={hdrs.WWW_AUTHENTICATE: "Basic"}
+                )
 
         return await handler(request)
 
@@ -37,7 +70,7 @@ def _check_access(
     except ValueError:
         return False
 
-    hashed_stored_password = auth_dict.get(creds.login)
-    hashed_request_password = hash_strategy(creds.password)
+    if (stored_password := auth_dict.get(creds.login)) is None:
+        return False
 
-    return hashed_stored_password == hashed_request_password
+    return verify_password(creds.password, stored_password, hash_strategy)
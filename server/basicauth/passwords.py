@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import hmac
+import os
+import sys
+from typing import Callable
+
+
+SCRYPT = "scrypt"
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+
+def hash_password(
+        password: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P
+) -> str:
+    salt = os.urandom(SALT_SIZE)
+    key = _scrypt(password, salt, n, r, p)
+    return "$".join([SCRYPT, str(n), str(r), str(p), _b64(salt), _b64(key)])
+
+
+def verify_password(
+        password: str,
+        stored_password: str,
+        hash_strategy: Callable[[str], str] = lambda x: x
+) -> bool:
+    # slow by design, keep off the event loop
+    if stored_password.startswith(f"{SCRYPT}$"):
+        _, n, r, p, salt, key = stored_password.split("$")
+        return hmac.compare_digest(
+            _scrypt(password, _unb64(salt), int(n), int(r), int(p)),
+            _unb64(key)
+        )
+    # constant time, so response times don't leak how much of it matched
+    return hmac.compare_digest(
+        hash_strategy(password).encode(), stored_password.encode()
+    )
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * n * r,
+        dklen=KEY_SIZE
+    )
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+if __name__ == "__main__":
+    # python -m basicauth.passwords <password>, for BASIC_AUTH=user:<hash>
+    print(hash_password(sys.argv[1]))
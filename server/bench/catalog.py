@@ -0,0 +1,90 @@
+# synthetic catalog: videos and books with chapters written straight to the
+# database, and tagged MP3 chapters for the book tagging scenario
+from datetime import datetime, timedelta
+import io
+from typing import List, Tuple
+
+from mutagen.easyid3 import EasyID3
+import nanoid
+from sqlalchemy import insert
+
+from db import Catalog, CatalogKind, SessionFactory
+
+
+# MPEG-1 layer III, 128 kbps, 44.1 kHz, 26 ms of silence per frame
+MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+async def generate_catalog(
+        db_session: SessionFactory,
+        videos: int,
+        books: int,
+        chapters: int
+) -> Tuple[List[str], List[str]]:
+    started = datetime(2020, 1, 1)
+    video_rows = [
+        {
+            "id": nanoid.generate(size=11),
+            "filename": f"video-{i}",
+            "title": f"Video {i}",
+            "description": f"Synthetic video {i} " * 10,
+            "created": started + timedelta(minutes=i),
+            "published": started + timedelta(minutes=i),
+            "duration": 600 + i % 3600,
+            "thumbnail_url": f"https://i.ytimg.com/vi/{i}/hqdefault.jpg",
+            "audio_size": 8 * 1024 * 1024,
+            "audio_type": "audio/mp4",
+            "kind": CatalogKind.YOUTUBE,
+            "ready": True
+        }
+        for i in range(videos)
+    ]
+    book_rows, chapter_rows = [], []
+    for i in range(books):
+        book_id = nanoid.generate(size=11)
+        book_rows.append(
+            {
+                "id": book_id,
+                "filename": book_id,
+                "title": f"Book {i}",
+                "description": f"Author {i}",
+                "created": started + timedelta(minutes=videos + i),
+                "duration": chapters * 1800,
+                "thumbnail_url": "audiobook.jpg",
+                "kind": CatalogKind.AUDIOBOOK,
+                "child_count": chapters,
+                "ready": True
+            }
+        )
+        chapter_rows += [
+            {
+                "id": nanoid.generate(size=11),
+                "parent_id": book_id,
+                "filename": f"{c:04d}.mp3",
+                "title": f"Chapter {c}",
+                "description": f"Author {i}. Book {i}",
+                "duration": 1800,
+                "audio_size": 30 * 1024 * 1024,
+                "audio_type": "audio/mpeg",
+                "kind": CatalogKind.CHAPTER,
+                "ready": True
+            }
+            for c in range(chapters)
+        ]
+
+    async with db_session.begin() as db:
+        for rows in (video_rows, book_rows, chapter_rows):
+            if rows:
+                await db.execute(insert(Catalog), rows)
+
+    return [r["id"] for r in video_rows], [r["id"] for r in book_rows]
+
+
+def synthetic_mp3(title: str, album: str, artist: str, frames: int) -> bytes:
+    mp3 = io.BytesIO(MP3_FRAME * frames)
+    tags = EasyID3()
+    tags["title"] = title
+    tags["album"] = album
+    tags["artist"] = artist
+    tags.save(mp3)
+    return mp3.getvalue()
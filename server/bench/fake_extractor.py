@@ -0,0 +1,42 @@
+# stub yt-dlp extractor for YT_DLP_EXTRACTOR: the fake yt-dlp's video info
+# and playlists, the audio comes from FAKE_YT_DLP_URL, see fake_oci
+import os
+
+from yt_dlp.extractor.common import InfoExtractor
+
+from .fake_yt_dlp import playlist_video_ids, video_info
+
+
+class FakeYoutubeIE(InfoExtractor):
+    IE_NAME = "fake:youtube"
+    _VALID_URL = (
+        r"https?://(?:youtu\.be/|(?:www\.)?youtube\.com/watch\?v=)"
+        r"(?P<id>[0-9A-Za-z_-]{11})"
+        r"|https?://(?:www\.)?youtube\.com/(?:playlist\?list=|@)(?P<list>[^/?&]+)"
+    )
+
+    def _real_extract(self, url):
+        if list_id := self._match_valid_url(url).group("list"):
+            return self.playlist_result(
+                [
+                    self.url_result(
+                        f"https://youtu.be/{video_id}", FakeYoutubeIE, video_id
+                    )
+                    for video_id in playlist_video_ids(url)
+                ],
+                list_id
+            )
+
+        video_id = self._match_id(url)
+        return {
+            **video_info(video_id),
+            "formats": [
+                {
+                    "format_id": "140",
+                    "url": f"{os.environ['FAKE_YT_DLP_URL']}/audio/{video_id}",
+                    "ext": "m4a",
+                    "acodec": "mp4a.40.2",
+                    "vcodec": "none"
+                }
+            ]
+        }
@@ -0,0 +1,150 @@
+# in-memory stand-in for OCI Object Storage: namespace, PAR minting, PUT
+# (plain and multipart), ranged GET and DELETE, authentication is ignored.
+# Also serves the synthetic audio of the stub yt-dlp extractor
+# python -m bench.fake_oci [port]
+from datetime import datetime, timedelta, UTC
+import json
+import os
+import sys
+from typing import Dict
+
+from aiohttp import hdrs, web
+import nanoid
+
+from .fake_yt_dlp import synthetic_m4a
+
+
+NAMESPACE = "bench"
+MAX_PART_SIZE = 64 * 1024 * 1024
+
+
+class FakeObjectStorage:
+    def __init__(self):
+        self.objects: Dict[str, bytes] = {}
+        self._pars: Dict[str, str] = {}
+        self._uploads: Dict[str, Dict[int, bytes]] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=MAX_PART_SIZE)
+        app.router.add_get("/n", self.get_namespace)
+        app.router.add_get("/n/", self.get_namespace)
+        app.router.add_post("/n/{namespace}/b/{bucket}/p", self.create_par)
+        app.router.add_delete(
+            "/n/{namespace}/b/{bucket}/o/{object:.+}", self.delete_object
+        )
+        app.router.add_put(
+            "/p/{par}/n/{namespace}/b/{bucket}/o/{object:.+}", self.put_object
+        )
+        app.router.add_get(
+            "/p/{par}/n/{namespace}/b/{bucket}/o/{object:.+}", self.get_object
+        )
+        app.router.add_put("/u/{upload}/{part_num:\\d+}", self.put_part)
+        app.router.add_post("/u/{upload}/", self.commit_upload)
+        app.router.add_delete("/u/{upload}/", self.abort_upload)
+        app.router.add_get("/audio/{video_id}", self.get_audio)
+        return app
+
+    async def get_namespace(self, _: web.Request) -> web.Response:
+        return web.json_response(NAMESPACE)
+
+    async def create_par(self, request: web.Request) -> web.Response:
+        details = await request.json()
+        par = nanoid.generate(size=32)
+        object_name = details["objectName"]
+        self._pars[par] = object_name
+        access_uri = (
+            f"/p/{par}/n/{request.match_info['namespace']}"
+            f"/b/{request.match_info['bucket']}/o/{object_name}"
+        )
+        now = datetime.now(UTC)
+        return web.json_response(
+            {
+                "id": par,
+                "name": details["name"],
+                "accessUri": access_uri,
+                "fullPath": f"{request.url.origin()}{access_uri}",
+                "objectName": object_name,
+                "accessType": details["accessType"],
+                "timeCreated": now.isoformat(),
+                "timeExpires": details.get(
+                    "timeExpires", (now + timedelta(days=1)).isoformat()
+                )
+            }
+        )
+
+    async def delete_object(self, request: web.Request) -> web.Response:
+        if self.objects.pop(request.match_info["object"], None) is None:
+            raise web.HTTPNotFound(
+                text=json.dumps({"code": "ObjectNotFound", "message": "No object"}),
+                content_type="application/json"
+            )
+        return web.Response(status=204)
+
+    async def put_object(self, request: web.Request) -> web.Response:
+        object_name = self._par_object(request)
+        if request.headers.get("opc-multipart") == "true":
+            upload = nanoid.generate(size=32)
+            self._uploads[upload] = {}
+            self._pars[upload] = object_name
+            return web.json_response({"accessUri": f"/u/{upload}/"})
+        self.objects[object_name] = await request.read()
+        return web.Response()
+
+    async def get_object(self, request: web.Request) -> web.Response:
+        data = self.objects.get(self._par_object(request))
+        if data is None:
+            raise web.HTTPNotFound()
+        if not (ranges := request.http_range) or ranges.start is None:
+            return web.Response(body=data)
+        start = ranges.start
+        end = min(ranges.stop or len(data), len(data))
+        return web.Response(
+            status=206,
+            body=data[start:end],
+            headers={hdrs.CONTENT_RANGE: f"bytes {start}-{end - 1}/{len(data)}"}
+        )
+
+    async def put_part(self, request: web.Request) -> web.Response:
+        parts = self._upload(request)
+        parts[int(request.match_info["part_num"])] = await request.read()
+        return web.Response()
+
+    async def commit_upload(self, request: web.Request) -> web.Response:
+        upload = request.match_info["upload"]
+        parts = self._upload(request)
+        self.objects[self._pars.pop(upload)] = b"".join(
+            parts[part_num] for part_num in sorted(parts)
+        )
+        del self._uploads[upload]
+        return web.Response()
+
+    async def abort_upload(self, request: web.Request) -> web.Response:
+        self._upload(request)
+        upload = request.match_info["upload"]
+        del self._uploads[upload]
+        del self._pars[upload]
+        return web.Response(status=204)
+
+    async def get_audio(self, _: web.Request) -> web.Response:
+        size = int(os.getenv("FAKE_YT_DLP_SIZE", str(8 * 1024 * 1024)))
+        return web.Response(body=synthetic_m4a(size), content_type="audio/mp4")
+
+    def _par_object(self, request: web.Request) -> str:
+        object_name = self._pars.get(request.match_info["par"])
+        if object_name != request.match_info["object"]:
+            raise web.HTTPNotFound()
+        return object_name
+
+    def _upload(self, request: web.Request) -> Dict[int, bytes]:
+        if (parts := self._uploads.get(request.match_info["upload"])) is None:
+            raise web.HTTPNotFound()
+        return parts
+
+
+if __name__ == "__main__":
+    web.run_app(
+        FakeObjectStorage().app(),
+        host="127.0.0.1",
+        port=int(sys.argv[1]) if len(sys.argv) > 1 else 8081,
+        print=None
+    )
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# stand-in for yt-dlp: --dump-json prints video info, --flat-playlist the
+# ids of FAKE_YT_DLP_PLAYLIST_SIZE videos, otherwise a synthetic m4a of
+# FAKE_YT_DLP_SIZE bytes goes to --output, "-" being stdout. The --print and
+# --progress-template prefixes are kept, the fields are fixed
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+
+CHUNK_SIZE = 1024 * 1024
+FTYP = b"\x00\x00\x00\x18ftypM4A \x00\x00\x02\x00isomM4A "
+
+
+def video_id(url):
+    return re.search(r"(?:v=|/)([0-9A-Za-z_-]{11})", url)[1]
+
+
+def playlist_video_ids(url):
+    # the same playlist always lists the same videos
+    size = int(os.getenv("FAKE_YT_DLP_PLAYLIST_SIZE", "50"))
+    return [
+        hashlib.sha256(f"{url}/{i}".encode()).hexdigest()[:11]
+        for i in range(size)
+    ]
+
+
+def video_info(vid):
+    return {
+        "id": vid,
+        "title": f"Video {vid}",
+        "description": f"Synthetic video {vid}",
+        "duration": 600,
+        "epoch": int(time.time()),
+        "thumbnail": f"https://i.ytimg.com/vi/{vid}/hqdefault.jpg"
+    }
+
+
+def template_prefix(args, option):
+    # e.g. "download:prefix %(progress)j" gives "prefix "
+    if option not in args:
+        return None
+    template = args[args.index(option) + 1]
+    return template.partition(":")[2].partition("%(")[0]
+
+
+def synthetic_m4a(size):
+    return FTYP + (size - len(FTYP)).to_bytes(4, "big") + b"mdat" + bytes(
+        size - len(FTYP) - 8
+    )
+
+
+def write_audio(out, size, bytes_per_sec, report):
+    # an ftyp box then an mdat box filled with silence
+    out.write(FTYP)
+    out.write((size - len(FTYP)).to_bytes(4, "big") + b"mdat")
+    left = size - len(FTYP) - 8
+    chunk = bytes(CHUNK_SIZE)
+    while left > 0:
+        written = min(left, CHUNK_SIZE)
+        out.write(chunk[:written])
+        left -= written
+        report({"downloaded_bytes": size - left, "total_bytes": size})
+        if bytes_per_sec:
+            time.sleep(written / bytes_per_sec)
+
+
+def main(args):
+    if "--flat-playlist" in args:
+        # --print "%(ie_key)s %(id)s"
+        print("\n".join(f"Youtube {vid}" for vid in playlist_video_ids(args[-1])))
+        return
+
+    vid = video_id(args[-1])
+    if "--dump-json" in args:
+        print(json.dumps(video_info(vid)))
+        return
+
+    size = int(os.getenv("FAKE_YT_DLP_SIZE", str(8 * 1024 * 1024)))
+    bytes_per_sec = int(os.getenv("FAKE_YT_DLP_RATE", "0"))
+    output = args[args.index("--output") + 1]
+    # like yt-dlp, reports go to stderr while the audio goes to stdout
+    reports = sys.stderr if output == "-" else sys.stdout
+
+    def print_report(prefix, fields):
+        if prefix is not None:
+            print(f"{prefix}{json.dumps(fields)}", file=reports, flush=True)
+
+    print_report(template_prefix(args, "--print"), video_info(vid))
+    progress_prefix = template_prefix(args, "--progress-template")
+
+    def report(progress):
+        print_report(progress_prefix, progress)
+
+    if output == "-":
+        write_audio(sys.stdout.buffer, size, bytes_per_sec, report)
+    else:
+        with open(output, "wb") as out:
+            write_audio(out, size, bytes_per_sec, report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
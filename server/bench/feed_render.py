@@ -0,0 +1,102 @@
+# compares feedgen with the streaming RSS writer, run from the server
+# directory: python -m bench.feed_render [items]
+from datetime import datetime, timedelta, UTC
+import json
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from feedgen.feed import FeedGenerator
+
+from view.rss import rss_channel, rss_end, rss_item
+
+
+WEBSITE = "https://stethoscope.example"
+
+
+def make_items(count):
+    published = datetime(2024, 1, 1, tzinfo=UTC)
+    return [
+        SimpleNamespace(
+            id=f"{i:011d}",
+            title=f"Episode {i} & friends",
+            description="Lorem <ipsum> dolor sit amet " * 20,
+            published=published + timedelta(hours=i),
+            audio_size=40_000_000 + i,
+            audio_type="audio/mp4",
+            duration=3600 + i
+        )
+        for i in range(count)
+    ]
+
+
+def render_feedgen(items):
+    podcast = FeedGenerator()
+    podcast.load_extension("podcast")
+    podcast.link(href=WEBSITE, rel="self")
+    podcast.title("Leonid's Stethoscope")
+    podcast.description("Turns Youtube videos into podcast")
+    podcast.logo(f"{WEBSITE}/logo.jpg")
+    for i in reversed(items):
+        episode = podcast.add_entry()
+        episode.id(i.id)
+        episode.title(i.title)
+        episode.description(i.description)
+        episode.published(i.published)
+        episode.enclosure(
+            url=f"{WEBSITE}/media/{i.id}", length=i.audio_size, type=i.audio_type
+        )
+        episode.podcast.itunes_duration(i.duration)
+    return [podcast.rss_str()]
+
+
+def render_streaming(items):
+    # chunks are handed to the response as they come, keep only the sizes
+    sizes = [
+        len(rss_channel(
+            title="Leonid's Stethoscope",
+            description="Turns Youtube videos into podcast",
+            link=WEBSITE,
+            logo=f"{WEBSITE}/logo.jpg"
+        ))
+    ]
+    for i in items:
+        sizes.append(len(rss_item(
+            guid=i.id,
+            title=i.title,
+            description=i.description,
+            published=i.published,
+            media_link=f"{WEBSITE}/media/{i.id}",
+            media_size=i.audio_size,
+            media_type=i.audio_type,
+            duration=i.duration
+        )))
+    sizes.append(len(rss_end()))
+    return sizes
+
+
+def measure(render, items):
+    tracemalloc.start()
+    started = time.perf_counter()
+    render(items)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(elapsed, 4), "peak_bytes": peak}
+
+
+def main():
+    items = make_items(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
+    print(json.dumps(
+        {
+            "items": len(items),
+            "feedgen": measure(render_feedgen, items),
+            "streaming": measure(render_streaming, items)
+        },
+        indent=2
+    ))
+
+
+if __name__ == "__main__":
+    main()
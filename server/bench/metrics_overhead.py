@@ -0,0 +1,65 @@
+# measures what metrics collection adds to the hot path, run from the server
+# directory: python -m bench.metrics_overhead [iterations]
+import asyncio
+import json
+import sys
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from metrics import Histogram, metrics_middleware, timed
+
+
+BENCH_SECONDS = Histogram("bench_duration_seconds", "Benchmark", ["method"])
+
+
+async def handler(_: web.Request) -> web.Response:
+    return web.Response()
+
+
+@timed(BENCH_SECONDS)
+async def timed_handler(request: web.Request) -> web.Response:
+    return await handler(request)
+
+
+async def per_call_ns(call, iterations):
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        await call()
+    return (time.perf_counter_ns() - started) / iterations
+
+
+async def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    app = web.Application()
+    app.router.add_get("/files/{file_id}", handler)
+    request = make_mocked_request("GET", "/files/abc", app=app)
+    request._match_info = await app.router.resolve(request)
+    middleware = metrics_middleware()
+
+    baseline = await per_call_ns(lambda: handler(request), iterations)
+    with_middleware = await per_call_ns(
+        lambda: middleware(request, handler), iterations
+    )
+    with_timer = await per_call_ns(lambda: timed_handler(request), iterations)
+
+    started = time.perf_counter_ns()
+    for i in range(iterations):
+        BENCH_SECONDS.observe(i / iterations, "observe")
+    observe = (time.perf_counter_ns() - started) / iterations
+
+    print(json.dumps(
+        {
+            "iterations": iterations,
+            "handler_ns": round(baseline),
+            "middleware_overhead_ns": round(with_middleware - baseline),
+            "timed_overhead_ns": round(with_timer - baseline),
+            "histogram_observe_ns": round(observe)
+        },
+        indent=2
+    ))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
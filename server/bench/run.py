@@ -0,0 +1,352 @@
+# offline load scenarios against build_app with fake OCI and yt-dlp, prints
+# JSON so runs can be compared between commits
+# python -m bench.run [--videos N] [--books N] [--chapters N] [scenario ...]
+import argparse
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from aiohttp import BasicAuth, ClientSession
+from aiohttp.test_utils import TestClient, TestServer
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+import nanoid
+
+from app import build_app
+from db import Catalog, create_session
+from view.paging import encode_cursor
+from .catalog import generate_catalog, synthetic_mp3
+
+
+BENCH_DIR = Path(__file__).parent
+AUTH = BasicAuth("bench", "bench")
+JOB_POLL_INTERVAL = 0.05
+OCI_CONFIG = """[DEFAULT]
+user=ocid1.user.oc1..bench
+fingerprint=00:11:22:33:44:55:66:77:88:99:aa:bb:cc:dd:ee:ff
+tenancy=ocid1.tenancy.oc1..bench
+region=us-ashburn-1
+key_file={key_file}
+"""
+
+
+@dataclass
+class Bench:
+    client: TestClient
+    video_ids: List[str]
+    book_ids: List[str]
+    tag_chapters: int
+
+
+Call = Callable[[Bench, int], Awaitable[None]]
+
+
+async def youtube_feed(bench: Bench, _: int) -> None:
+    await _get(bench.client, "/youtube/feed")
+
+
+async def youtube_feed_cold(bench: Bench, i: int) -> None:
+    # the feed cache is keyed by the cursor, one past every item is a miss
+    cursor = encode_cursor(Catalog(id=f"{i:011d}", created=datetime.max))
+    await _get(bench.client, f"/youtube/feed?cursor={cursor}")
+
+
+async def book_feed(bench: Bench, i: int) -> None:
+    book_id = bench.book_ids[i % len(bench.book_ids)]
+    await _get(bench.client, f"/book/{book_id}/feed")
+
+
+async def media(bench: Bench, i: int) -> None:
+    video_id = bench.video_ids[i % len(bench.video_ids)]
+    async with bench.client.get(
+        f"/media/{video_id}", allow_redirects=False
+    ) as response:
+        if response.status != 308:
+            raise IOError(f"Got {response.status}")
+
+
+async def files(bench: Bench, _: int) -> None:
+    await _get(bench.client, "/files?limit=100", auth=AUTH)
+
+
+async def ingest(bench: Bench, _: int) -> None:
+    async with bench.client.post(
+        "/files/youtube/add",
+        json={"url": f"https://youtu.be/{nanoid.generate(size=11)}"},
+        auth=AUTH
+    ) as response:
+        response.raise_for_status()
+        job_id = (await response.json())["job"]
+    await _wait_job(bench.client, job_id)
+
+
+async def tag_book(bench: Bench, i: int) -> None:
+    book_id = await _start_book(bench.client)
+    async with ClientSession() as uploads:
+        for c in range(bench.tag_chapters):
+            async with bench.client.post(
+                f"/files/book/{book_id}/add_chapter",
+                json={"filename": f"{c:04d}.mp3"},
+                auth=AUTH
+            ) as response:
+                response.raise_for_status()
+                upload_url = (await response.json())["url"]
+            await _upload_chapter(uploads, upload_url, i, c)
+    await _complete_book(bench.client, book_id)
+
+
+async def tag_book_batch(bench: Bench, i: int) -> None:
+    book_id = await _start_book(bench.client)
+    async with bench.client.post(
+        f"/files/book/{book_id}/add_chapters",
+        json={
+            "filenames": [f"{c:04d}.mp3" for c in range(bench.tag_chapters)]
+        },
+        auth=AUTH
+    ) as response:
+        response.raise_for_status()
+        chapters = (await response.json())["chapters"]
+    async with ClientSession() as uploads:
+        for c, chapter in enumerate(chapters):
+            await _upload_chapter(uploads, chapter["url"], i, c)
+    await _complete_book(bench.client, book_id)
+
+
+SCENARIOS: Dict[str, Call] = {
+    "youtube_feed": youtube_feed,
+    "youtube_feed_cold": youtube_feed_cold,
+    "book_feed": book_feed,
+    "media": media,
+    "files": files,
+    "ingest": ingest,
+    "tag_book": tag_book,
+    "tag_book_batch": tag_book_batch
+}
+
+
+async def load(
+        bench: Bench, call: Call, requests: int, concurrency: int
+) -> Dict:
+    latencies: List[float] = []
+    errors: List[str] = []
+    calls = iter(range(requests))
+
+    async def worker():
+        for i in calls:
+            started = time.perf_counter()
+            try:
+                await call(bench, i)
+            except Exception as e:
+                errors.append(repr(e))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": round(elapsed, 3),
+        "throughput": round(requests / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        # the app runs in this process, the fakes in child processes
+        "peak_rss_mb": round(_peak_rss(), 1)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS))
+    parser.add_argument("--videos", type=int, default=5000)
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--chapters", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ingest-videos", type=int, default=20)
+    parser.add_argument("--tag-books", type=int, default=2)
+    parser.add_argument("--tag-chapters", type=int, default=50)
+    # 0 runs the fake yt-dlp CLI, otherwise the pool with the stub extractor
+    parser.add_argument("--yt-dlp-workers", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    requests = {
+        "ingest": args.ingest_videos,
+        "tag_book": args.tag_books,
+        "tag_book_batch": args.tag_books
+    }
+    concurrency = {"tag_book": 1, "tag_book_batch": 1}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        port = _free_port()
+        fake_oci = subprocess.Popen(
+            [sys.executable, "-m", "bench.fake_oci", str(port)],
+            cwd=BENCH_DIR.parent
+        )
+        try:
+            await _wait_port(port)
+            os.environ.update(
+                DB_FILE=str(tmp_dir / "bench.sqlite"),
+                OCI_CONFIG_FILE=_oci_config(tmp_dir),
+                OCI_ENDPOINT=f"http://127.0.0.1:{port}",
+                BASIC_AUTH=f"{AUTH.login}:{AUTH.password}",
+                YT_DLP=str(BENCH_DIR / "fake_yt_dlp.py"),
+                YT_DLP_WORKERS=str(args.yt_dlp_workers),
+                YT_DLP_EXTRACTOR="bench.fake_extractor:FakeYoutubeIE",
+                FAKE_YT_DLP_URL=f"http://127.0.0.1:{port}"
+            )
+
+            video_ids, book_ids = await generate_catalog(
+                await create_session(os.environ["DB_FILE"]),
+                args.videos,
+                args.books,
+                args.chapters
+            )
+            results = {}
+            async with TestClient(TestServer(await build_app())) as client:
+                bench = Bench(client, video_ids, book_ids, args.tag_chapters)
+                for name in args.scenarios:
+                    results[name] = await load(
+                        bench,
+                        SCENARIOS[name],
+                        requests.get(name, args.requests),
+                        concurrency.get(name, args.concurrency)
+                    )
+        finally:
+            fake_oci.terminate()
+            fake_oci.wait()
+
+    report = json.dumps(
+        {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "catalog": {
+                "videos": args.videos,
+                "books": args.books,
+                "chapters": args.chapters
+            },
+            "scenarios": results,
+            "peak_rss_mb": round(_peak_rss(), 1)
+        },
+        indent=2
+    )
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
+
+
+async def _get(client: TestClient, url: str, **kwargs) -> None:
+    async with client.get(url, **kwargs) as response:
+        response.raise_for_status()
+        await response.read()
+
+
+async def _wait_job(client: TestClient, job_id: str) -> None:
+    while True:
+        async with client.get(f"/files/jobs/{job_id}", auth=AUTH) as response:
+            job = await response.json()
+        if job["status"] == "done":
+            return
+        if job["status"] == "failed":
+            raise IOError(job["error"])
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+async def _start_book(client: TestClient) -> str:
+    async with client.post("/files/book/add", auth=AUTH) as response:
+        response.raise_for_status()
+        return (await response.json())["id"]
+
+
+async def _upload_chapter(
+        uploads: ClientSession, upload_url: str, book: int, chapter: int
+) -> None:
+    mp3 = synthetic_mp3(
+        f"Chapter {chapter}", f"Book {book}", f"Author {book}", 200
+    )
+    async with uploads.put(upload_url, data=mp3) as response:
+        response.raise_for_status()
+
+
+async def _complete_book(client: TestClient, book_id: str) -> None:
+    async with client.post(
+        f"/files/book/{book_id}/complete", auth=AUTH
+    ) as response:
+        response.raise_for_status()
+        job_id = (await response.json())["job"]
+    await _wait_job(client, job_id)
+
+
+def _oci_config(tmp_dir: Path) -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    key_file = tmp_dir / "oci.pem"
+    key_file.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+    )
+    config_file = tmp_dir / "oci.config"
+    config_file.write_text(OCI_CONFIG.format(key_file=key_file))
+    return str(config_file)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_port(port: int) -> None:
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise IOError(f"Fake OCI didn't start on port {port}")
+
+
+def _percentile(latencies: List[float], percentile: float) -> float:
+    return latencies[round(percentile * (len(latencies) - 1))]
+
+
+def _peak_rss() -> float:
+    # Linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
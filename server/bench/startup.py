@@ -0,0 +1,116 @@
+# import-time and startup budget check, exits non-zero when a budget is blown
+# python -m bench.startup [--import-budget-ms N] [--startup-budget-ms N]
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+from app import build_app
+from .run import AUTH, BENCH_DIR, _free_port, _oci_config, _wait_port
+
+
+# heavy modules only needed once the server is up
+LAZY_IMPORTS = {"oci", "yt_dlp", "feedgen"}
+READY_POLL_INTERVAL = 0.01
+
+
+def import_times() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=BENCH_DIR.parent,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    # "import time: self [us] | cumulative | imported package"
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, total, module = line.split("|")
+        cumulative[module.strip()] = int(total)
+    return cumulative
+
+
+async def startup_times() -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        oci_port = _free_port()
+        fake_oci = subprocess.Popen(
+            [sys.executable, "-m", "bench.fake_oci", str(oci_port)],
+            cwd=BENCH_DIR.parent
+        )
+        try:
+            await _wait_port(oci_port)
+            os.environ.update(
+                DB_FILE=str(tmp_dir / "bench.sqlite"),
+                OCI_CONFIG_FILE=_oci_config(tmp_dir),
+                OCI_ENDPOINT=f"http://127.0.0.1:{oci_port}",
+                BASIC_AUTH=f"{AUTH.login}:{AUTH.password}"
+            )
+
+            port = _free_port()
+            started = time.perf_counter()
+            runner = web.AppRunner(await build_app())
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+            async with ClientSession(f"http://127.0.0.1:{port}") as http:
+                async with http.get("/health") as response:
+                    response.raise_for_status()
+                live = time.perf_counter() - started
+                while True:
+                    async with http.get("/health/ready") as response:
+                        if response.ok:
+                            break
+                    await asyncio.sleep(READY_POLL_INTERVAL)
+                ready = time.perf_counter() - started
+            await runner.cleanup()
+        finally:
+            fake_oci.terminate()
+            fake_oci.wait()
+    return {"live_ms": round(live * 1000, 1), "ready_ms": round(ready * 1000, 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--import-budget-ms", type=float, default=1000)
+    parser.add_argument("--startup-budget-ms", type=float, default=1000)
+    args = parser.parse_args()
+
+    imports = import_times()
+    startup = await startup_times()
+    eager_imports = sorted(LAZY_IMPORTS & imports.keys())
+    import_ms = imports["app"] / 1000
+    report = {
+        "import_ms": round(import_ms, 1),
+        "slowest_imports_ms": {
+            module: round(total / 1000, 1)
+            for module, total in sorted(
+                imports.items(), key=lambda i: i[1], reverse=True
+            )[1:11]
+        },
+        "eager_imports": eager_imports,
+        **startup
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if eager_imports:
+        failures.append(f"imported at startup: {', '.join(eager_imports)}")
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import took {import_ms:.0f} ms")
+    if startup["live_ms"] > args.startup_budget_ms:
+        failures.append(f"startup took {startup['live_ms']:.0f} ms")
+    if failures:
+        sys.exit("Budget exceeded: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+import asyncio
+from collections import OrderedDict
+import time
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+        # a cancelled caller mustn't cancel the call other callers wait for
+        return await asyncio.shield(call)
+
+
+class Notifier:
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def waiter(self) -> asyncio.Event:
+        # taken before checking for changes, so none is missed until waiting
+        return self._event
+
+    def notify(self) -> None:
+        # waiters hold the old event, so a fresh one needs no clearing
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+
+class ExpiringLRUCache(Generic[T]):
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._items: OrderedDict[Hashable, Tuple[T, float]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[T]:
+        if item := self._items.get(key):
+            value, deadline = item
+            if deadline > time.monotonic():
+                self._items.move_to_end(key)
+                return value
+            del self._items[key]
+        return None
+
+    def put(self, key: Hashable, value: T, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        self._items[key] = (value, time.monotonic() + ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,120 @@
+import asyncio
+import gzip
+import logging
+import os
+from pathlib import Path
+import re
+from typing import Iterable, Optional
+
+from aiohttp import hdrs, web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MIN_COMPRESS_SIZE = 1024
+# smaller bodies compress faster than a hop to a worker thread
+OFFLOAD_COMPRESS_SIZE = 64 * 1024
+BR = "br"
+GZIP = "gzip"
+ENCODINGS = (BR, GZIP) if brotli else (GZIP,)
+STATIC_SUFFIXES = {BR: ".br", GZIP: ".gz"}
+COMPRESSIBLE_TYPES = re.compile(
+    r"text/|application/(json|xml|javascript|(rss|atom)\+xml)|image/svg\+xml"
+)
+STATIC_EXTENSIONS = {
+    ".html", ".js", ".mjs", ".css", ".json", ".map", ".svg", ".txt", ".xml",
+    ".webmanifest"
+}
+
+logger = logging.getLogger(__name__)
+
+
+def accepted_encoding(
+        request: web.Request, encodings: Iterable[str] = ENCODINGS
+) -> Optional[str]:
+    accepted = {}
+    for coding in request.headers.get(hdrs.ACCEPT_ENCODING, "").split(","):
+        name, _, params = coding.strip().lower().partition(";")
+        quality = 1.0
+        if (param := params.strip()).startswith("q="):
+            try:
+                quality = float(param[2:])
+            except ValueError:
+                continue
+        accepted[name.strip()] = quality
+    # encodings go in the order of preference
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    if encoding == BR:
+        return brotli.compress(body, quality=11 if best else 5)
+    return gzip.compress(body, compresslevel=9 if best else 6)
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    if len(body) >= OFFLOAD_COMPRESS_SIZE:
+        return await asyncio.to_thread(compress, body, encoding)
+    return compress(body, encoding)
+
+
+def compression_middleware(min_size: int = MIN_COMPRESS_SIZE):
+    @web.middleware
+    async def middleware(request: web.Request, handler) -> web.StreamResponse:
+        response = await handler(request)
+        # streamed and file responses are compressed on their own
+        if (
+            type(response) is web.Response
+            and isinstance(body := response.body, bytes)
+            and len(body) >= min_size
+            and hdrs.CONTENT_ENCODING not in response.headers
+            and COMPRESSIBLE_TYPES.match(response.content_type)
+        ):
+            if hdrs.ACCEPT_ENCODING not in response.headers.get(hdrs.VARY, ""):
+                response.headers.add(hdrs.VARY, hdrs.ACCEPT_ENCODING)
+            if encoding := accepted_encoding(request):
+                response.body = await compress_async(body, encoding)
+                response.headers[hdrs.CONTENT_ENCODING] = encoding
+        return response
+
+    return middleware
+
+
+async def precompress_static(directory: str) -> None:
+    # FileResponse serves .br/.gz siblings to clients accepting them
+    try:
+        await asyncio.to_thread(_precompress_files, Path(directory))
+    except OSError:
+        logger.warning(
+            "Couldn't precompress static files in %s", directory, exc_info=True
+        )
+
+
+def _precompress_files(directory: Path) -> None:
+    for path in directory.rglob("*"):
+        if path.suffix not in STATIC_EXTENSIONS or not path.is_file():
+            continue
+        stat = path.stat()
+        if stat.st_size < MIN_COMPRESS_SIZE:
+            continue
+        for encoding in ENCODINGS:
+            compressed_path = path.with_name(path.name + STATIC_SUFFIXES[encoding])
+            if (
+                compressed_path.exists()
+                and compressed_path.stat().st_mtime >= stat.st_mtime
+            ):
+                continue
+            body = compress(path.read_bytes(), encoding, best=True)
+            if len(body) < stat.st_size:
+                # worker processes may be writing the same file
+                tmp_path = compressed_path.with_name(
+                    f"{compressed_path.name}.{os.getpid()}.tmp"
+                )
+                tmp_path.write_bytes(body)
+                tmp_path.replace(compressed_path)
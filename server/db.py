@@ -1,17 +1,75 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta, UTC
+from enum import StrEnum
+import fcntl
 from pathlib import Path
+import time
+from typing import Any, AsyncContextManager, Callable, Dict, List
 
-from sqlalchemy import ForeignKey, String, Text, func
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import (
+    JSON, Connection, ForeignKey, Index, String, Text, event, false, func, inspect
+)
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from metrics import Histogram
+
+
+SQLITE_CACHE_SIZE = 16 * 1024 * 1024
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "SQLite statement latency", ["engine", "statement"]
+)
+
+
+def utcnow() -> datetime:
+    # SQLite keeps naive UTC timestamps
+    return datetime.now(UTC).replace(tzinfo=None)
 
 
 class Base(DeclarativeBase):
     pass
 
 
+class CatalogKind(StrEnum):
+    YOUTUBE = "youtube"
+    AUDIOBOOK = "audiobook"
+    CHAPTER = "chapter"
+
+
+class Blob(Base):
+    __tablename__ = "blob"
+
+    # SHA-256 of the content, stored as one object shared by every reference
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    # purged once nothing references it
+    ref_count: Mapped[int] = mapped_column(default=0)
+    # uploaded and probed, the tags are reused instead of probing again
+    ready: Mapped[bool] = mapped_column(server_default=false())
+    title: Mapped[str] = mapped_column(String(255), nullable=True)
+    album: Mapped[str] = mapped_column(String(255), nullable=True)
+    artist: Mapped[str] = mapped_column(String(255), nullable=True)
+    duration: Mapped[int] = mapped_column(nullable=True)
+    audio_size: Mapped[int] = mapped_column(nullable=True)
+    audio_type: Mapped[str] = mapped_column(String(255), nullable=True)
+
+
 class Catalog(Base):
     __tablename__ = "catalog"
+    # ordered like the pages, which are read off the index without sorting
+    __table_args__ = (
+        Index(
+            "ix_catalog_parent_kind_created_id", "parent_id", "kind", "created", "id"
+        ),
+        Index(
+            "ix_catalog_parent_ready_created_id", "parent_id", "ready", "created", "id"
+        ),
+        Index("ix_catalog_parent_filename", "parent_id", "filename"),
+    )
 
     id: Mapped[str] = mapped_column(String(11), primary_key=True)
     parent_id: Mapped[str] = mapped_column(ForeignKey(id), nullable=True, index=True)
@@ -19,22 +77,285 @@ class Catalog(Base):
 
     title: Mapped[str] = mapped_column(String(100), nullable=True)
     description: Mapped[str] = mapped_column(Text, nullable=True)
-    created: Mapped[datetime] = mapped_column(server_default=func.now(), index=True)
+    # written with microseconds like any bound datetime, keyset paging
+    # compares the stored strings
+    created: Mapped[datetime] = mapped_column(
+        default=utcnow, server_default=func.now(), index=True
+    )
     published: Mapped[datetime] = mapped_column(server_default=func.now())
     audio_size: Mapped[int] = mapped_column(nullable=True)
     audio_type: Mapped[str] = mapped_column(String(255), nullable=True)
     duration: Mapped[int] = mapped_column(default=0)
     thumbnail_url: Mapped[str] = mapped_column(String(2083), nullable=True)
+    kind: Mapped[CatalogKind] = mapped_column(
+        String(10), server_default=CatalogKind.YOUTUBE
+    )
+    child_count: Mapped[int] = mapped_column(server_default="0")
+    # fully downloaded/uploaded and tagged
+    ready: Mapped[bool] = mapped_column(server_default=false())
+    # chapters uploaded with a content hash, others are stored by their ids
+    blob_hash: Mapped[str] = mapped_column(
+        ForeignKey(Blob.hash), nullable=True, index=True
+    )
 
     children: Mapped[list["Catalog"]] = relationship(cascade="all, delete-orphan")
 
 
-async def create_session(location: str) -> async_sessionmaker:
+class JobStatus(StrEnum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(Base):
+    __tablename__ = "job"
+
+    id: Mapped[str] = mapped_column(String(11), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20))
+    # what the job works on, e.g. a video or book id
+    key: Mapped[str] = mapped_column(String(255), index=True)
+    payload: Mapped[Dict[str, Any]] = mapped_column(JSON)
+
+    status: Mapped[JobStatus] = mapped_column(String(10), default=JobStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(default=0)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+    run_after: Mapped[datetime] = mapped_column(server_default=func.now(), index=True)
+    # the worker running the job, it renews the lease until the job is over
+    lease_owner: Mapped[str] = mapped_column(String(40), nullable=True)
+    lease_expires: Mapped[datetime] = mapped_column(nullable=True)
+    # reported by the handler while it runs, e.g. downloaded bytes
+    progress: Mapped[Dict[str, Any]] = mapped_column(JSON, nullable=True)
+
+
+class Subscription(Base):
+    __tablename__ = "subscription"
+
+    # a playlist or channel re-checked for new videos
+    id: Mapped[str] = mapped_column(String(11), primary_key=True)
+    url: Mapped[str] = mapped_column(String(2083), unique=True)
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+    synced: Mapped[datetime] = mapped_column(nullable=True)
+
+
+class FeedVersion(Base):
+    __tablename__ = "feed_version"
+
+    # bumped on every change, so each worker process can drop its cached copy
+    feed_id: Mapped[str] = mapped_column(String(11), primary_key=True)
+    version: Mapped[int] = mapped_column(default=1)
+    # feeds render it as their build date, the same in every process
+    updated: Mapped[datetime] = mapped_column(nullable=True)
+
+
+# calling it opens a read-only session, begin() a write transaction
+class SessionFactory:
+    def __init__(self, reader: async_sessionmaker, writer: async_sessionmaker):
+        self.reader = reader
+        self.writer = writer
+
+    def __call__(self) -> AsyncSession:
+        return self.reader()
+
+    def begin(self) -> AsyncContextManager[AsyncSession]:
+        return self.writer.begin()
+
+
+async def create_session(
+        location: str,
+        readers: int = 8,
+        busy_timeout: timedelta = timedelta(seconds=5)
+) -> SessionFactory:
     location = Path(location).resolve()
     location.parent.mkdir(parents=True, exist_ok=True)
-    engine = create_async_engine(f"sqlite+aiosqlite:///{location}")
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(busy_timeout.total_seconds() * 1000)}",
+        "PRAGMA synchronous = NORMAL",
+        f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE // 1024}",
+        f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}"
+    ]
+
+    # SQLite allows one writer at a time, waiting on the pool beats SQLITE_BUSY
+    writer = create_async_engine(
+        f"sqlite+aiosqlite:///{location}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=60
+    )
+    _set_pragmas(writer, ["PRAGMA journal_mode = WAL", *pragmas])
+    _time_queries(writer, "writer")
+    # worker processes start together, only one of them creates the schema
+    with open(location.with_name(f"{location.name}.lock"), "w") as lock:
+        await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+        async with writer.begin() as conn:
+            await conn.run_sync(_create_schema)
+
+    reader = create_async_engine(
+        f"sqlite+aiosqlite:///file:{location}?mode=ro&uri=true",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=readers,
+        max_overflow=0
+    )
+    _set_pragmas(reader, pragmas)
+    _time_queries(reader, "reader")
+
+    return SessionFactory(
+        async_sessionmaker(reader, expire_on_commit=False),
+        async_sessionmaker(writer, expire_on_commit=False)
+    )
+
+
+def _set_pragmas(engine: AsyncEngine, pragmas: List[str]) -> None:
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def _time_queries(engine: AsyncEngine, name: str) -> None:
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def query_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def query_finished(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.observe(
+            time.perf_counter() - started,
+            name,
+            statement.lstrip().split(None, 1)[0].upper()
+        )
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def query_failed(context):
+        if context.connection is not None and (
+            started := context.connection.info.get("query_started")
+        ):
+            started.pop()
+
+
+def _create_schema(conn: Connection) -> None:
+    existing_db = inspect(conn).has_table(Catalog.__tablename__)
+    Base.metadata.create_all(conn)
+    if existing_db:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for migration in MIGRATIONS[version:]:
+            migration(conn)
+    conn.exec_driver_sql(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+
+def _add_catalog_kind(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        "ALTER TABLE catalog ADD COLUMN kind VARCHAR(10) NOT NULL DEFAULT 'youtube'"
+    )
+    conn.exec_driver_sql(
+        "ALTER TABLE catalog ADD COLUMN child_count INTEGER NOT NULL DEFAULT 0"
+    )
+    conn.exec_driver_sql(
+        "ALTER TABLE catalog ADD COLUMN ready BOOLEAN NOT NULL DEFAULT 0"
+    )
+    conn.exec_driver_sql(
+        """
+        UPDATE catalog SET
+            child_count = (
+                SELECT count(*) FROM catalog AS chapter
+                WHERE chapter.parent_id = catalog.id
+            ),
+            ready = title IS NOT NULL
+        """
+    )
+    # books waiting for their first chapter only differ by their thumbnail
+    conn.exec_driver_sql(
+        """
+        UPDATE catalog SET kind = CASE
+            WHEN parent_id IS NOT NULL THEN 'chapter'
+            WHEN child_count > 0 OR thumbnail_url = 'audiobook.jpg' THEN 'audiobook'
+            ELSE 'youtube'
+        END
+        """
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_catalog_parent_kind_created"
+        " ON catalog (parent_id, kind, created)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_catalog_parent_filename"
+        " ON catalog (parent_id, filename)"
+    )
+
+
+def _add_job_lease(conn: Connection) -> None:
+    # databases older than the job table got it with the lease from create_all
+    if "lease_owner" in {c["name"] for c in inspect(conn).get_columns("job")}:
+        return
+    conn.exec_driver_sql("ALTER TABLE job ADD COLUMN lease_owner VARCHAR(40)")
+    conn.exec_driver_sql("ALTER TABLE job ADD COLUMN lease_expires DATETIME")
+
+
+def _add_catalog_blob(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        "ALTER TABLE catalog ADD COLUMN blob_hash VARCHAR(64) REFERENCES blob (hash)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_catalog_blob_hash ON catalog (blob_hash)"
+    )
+
+
+def _add_job_progress(conn: Connection) -> None:
+    if "progress" in {c["name"] for c in inspect(conn).get_columns("job")}:
+        return
+    conn.exec_driver_sql("ALTER TABLE job ADD COLUMN progress JSON")
+
+
+def _normalize_catalog_created(conn: Connection) -> None:
+    # CURRENT_TIMESTAMP has no fraction, bound datetimes have microseconds
+    conn.exec_driver_sql(
+        "UPDATE catalog SET created = created || '.000000'"
+        " WHERE length(created) = 19"
+    )
+
+
+def _add_feed_version_updated(conn: Connection) -> None:
+    if "updated" not in {c["name"] for c in inspect(conn).get_columns("feed_version")}:
+        conn.exec_driver_sql("ALTER TABLE feed_version ADD COLUMN updated DATETIME")
+    conn.exec_driver_sql(
+        "UPDATE feed_version SET updated = CURRENT_TIMESTAMP WHERE updated IS NULL"
+    )
+    # feeds never invalidated yet
+    conn.exec_driver_sql(
+        """
+        INSERT OR IGNORE INTO feed_version (feed_id, version, updated)
+        SELECT 'youtube', 1, CURRENT_TIMESTAMP
+        UNION ALL
+        SELECT id, 1, CURRENT_TIMESTAMP FROM catalog WHERE kind = 'audiobook'
+        """
+    )
+
+
+def _add_catalog_paging_indexes(conn: Connection) -> None:
+    # superseded by the one ending with the id, the tie-breaker of pages
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_catalog_parent_kind_created")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_catalog_parent_kind_created_id"
+        " ON catalog (parent_id, kind, created, id)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_catalog_parent_ready_created_id"
+        " ON catalog (parent_id, ready, created, id)"
+    )
 
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
 
-    return async_sessionmaker(engine, expire_on_commit=False)
+# append only, PRAGMA user_version counts the applied ones
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _add_catalog_kind,
+    _add_job_lease,
+    _add_catalog_blob,
+    _add_job_progress,
+    _normalize_catalog_created,
+    _add_feed_version_updated,
+    _add_catalog_paging_indexes
+]
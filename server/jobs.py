@@ -0,0 +1,347 @@
+import asyncio
+from contextvars import ContextVar
+from datetime import timedelta
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+import nanoid
+from sqlalchemy import and_, event, func, null, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from cache import Notifier
+from db import Job, JobStatus, SessionFactory, utcnow
+from metrics import Gauge, Histogram
+
+
+POLL_INTERVAL = timedelta(seconds=5)
+LEASE_DURATION = timedelta(minutes=1)
+MAX_RETRY_DELAY = timedelta(hours=1)
+# bounds database writes of progress, and how late other processes see it
+PROGRESS_INTERVAL = timedelta(seconds=1)
+
+JOBS_RUNNING = Gauge("jobs_running", "Background jobs in flight", ["kind"])
+JOB_SECONDS = Histogram(
+    "job_duration_seconds", "Background job run time", ["kind", "status"]
+)
+
+# handlers may update the payload before failing to checkpoint progress
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+logger = logging.getLogger(__name__)
+
+# the job a handler runs for, so it can report progress
+_current_job: ContextVar[str] = ContextVar("current_job")
+
+
+class JobQueue:
+    def __init__(
+            self,
+            db_session: SessionFactory,
+            concurrency: Dict[str, int],
+            max_attempts: int = 5,
+            retry_delay: timedelta = timedelta(seconds=30),
+            lease_duration: timedelta = LEASE_DURATION
+    ):
+        self._db_session = db_session
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._lease_duration = lease_duration
+        # tells apart worker processes sharing the database
+        self._owner = f"{os.getpid()}-{nanoid.generate(size=11)}"
+        self._handlers: Dict[str, JobHandler] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._claims: Dict[str, asyncio.Lock] = {}
+        self._workers: Set[asyncio.Task] = set()
+        self._running: Set[asyncio.Task] = set()
+        self._stopping = False
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        self._progress_writes: Dict[str, asyncio.Task] = {}
+        self._updated = Notifier()
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+        self._wakeups[kind] = asyncio.Event()
+        self._claims[kind] = asyncio.Lock()
+
+    async def submit(
+            self,
+            kind: str,
+            key: str,
+            payload: Dict[str, Any],
+            db: AsyncSession | None = None,
+            delay: timedelta | None = None
+    ) -> str:
+        job_id = nanoid.generate(size=11)
+        job = Job(id=job_id, kind=kind, key=key, payload=payload)
+        if delay:
+            job.run_after = utcnow() + delay
+        wakeup = self._wakeups[kind]
+        if db:
+            # becomes visible to workers once the caller commits, a worker
+            # woken earlier wouldn't find it and sleep a whole poll interval
+            db.add(job)
+            event.listen(
+                db.sync_session, "after_commit", lambda _: wakeup.set(), once=True
+            )
+        else:
+            async with self._db_session.begin() as db:
+                db.add(job)
+            wakeup.set()
+        return job_id
+
+    def report_progress(self, progress: Dict[str, Any]) -> None:
+        job_id = _current_job.get()
+        self._progress[job_id] = progress
+        if job_id not in self._progress_writes:
+            self._progress_writes[job_id] = asyncio.create_task(
+                self._write_progress(job_id)
+            )
+
+    async def watch(self, job_id: str) -> AsyncIterator[Job]:
+        # yields the job on every change until it's over
+        seen = None
+        while True:
+            updated = self._updated.waiter()
+            async with self._db_session() as db:
+                job = await db.get(Job, job_id)
+            if not job:
+                return
+            state = (job.status, job.attempts, job.progress, job.error)
+            if state != seen:
+                seen = state
+                yield job
+            if job.status in (JobStatus.DONE, JobStatus.FAILED):
+                return
+            # jobs running in other processes are only seen by polling
+            try:
+                await asyncio.wait_for(
+                    updated.wait(), PROGRESS_INTERVAL.total_seconds()
+                )
+            except TimeoutError:
+                pass
+
+    async def start(self, _=None) -> None:
+        # jobs of a crashed worker are claimed again once their lease expires
+        for kind in self._handlers:
+            for _ in range(self._concurrency.get(kind, 1)):
+                worker = asyncio.create_task(self._work(kind))
+                self._workers.add(worker)
+                worker.add_done_callback(self._workers.discard)
+
+    async def stop(self, _=None) -> None:
+        self._stopping = True
+        # a worker cancelled amid a database call can wedge the connection,
+        # so only the handlers are cancelled and the workers left to return
+        for handler in self._running:
+            handler.cancel()
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        # hands the interrupted jobs over to the other workers right away, a
+        # restart isn't a failed attempt
+        async with self._db_session.begin() as db:
+            await db.execute(
+                update(Job)
+                .where(Job.status == JobStatus.RUNNING)
+                .where(Job.lease_owner == self._owner)
+                .values(
+                    status=JobStatus.PENDING,
+                    attempts=Job.attempts - 1,
+                    lease_owner=None
+                )
+            )
+
+    async def _work(self, kind: str) -> None:
+        wakeup = self._wakeups[kind]
+        while not self._stopping:
+            wakeup.clear()
+            job = await self._claim(kind)
+            if self._stopping:
+                # handed back by stop()
+                return
+            if job:
+                self._updated.notify()
+                await self._run(job)
+            else:
+                try:
+                    await asyncio.wait_for(
+                        wakeup.wait(), POLL_INTERVAL.total_seconds()
+                    )
+                except TimeoutError:
+                    pass
+
+    async def _claim(self, kind: str) -> Optional[Job]:
+        now = utcnow()
+        running = aliased(Job)
+        claimable = (
+            select(Job.id)
+            .where(Job.kind == kind)
+            # the limit holds across worker processes sharing the database
+            .where(
+                select(func.count())
+                .select_from(running)
+                .where(running.kind == kind)
+                .where(running.status == JobStatus.RUNNING)
+                .where(running.lease_expires >= now)
+                .scalar_subquery()
+                < self._concurrency.get(kind, 1)
+            )
+            .where(
+                or_(
+                    and_(
+                        Job.status == JobStatus.PENDING,
+                        Job.run_after <= now
+                    ),
+                    # its worker is gone
+                    and_(
+                        Job.status == JobStatus.RUNNING,
+                        or_(Job.lease_expires == null(), Job.lease_expires < now)
+                    )
+                )
+            )
+            .order_by(Job.run_after)
+            .limit(1)
+        )
+        # one statement, so workers in other processes can't claim it too
+        async with self._claims[kind], self._db_session.begin() as db:
+            return await db.scalar(
+                update(Job)
+                .where(Job.id == claimable.scalar_subquery())
+                .values(
+                    status=JobStatus.RUNNING,
+                    attempts=Job.attempts + 1,
+                    lease_owner=self._owner,
+                    lease_expires=now + self._lease_duration
+                )
+                .returning(Job)
+                .execution_options(synchronize_session=False)
+            )
+
+    async def _run(self, job: Job) -> None:
+        if job.attempts > self._max_attempts:
+            # its workers kept dying, e.g. it exhausts memory
+            await self._finish(
+                job,
+                {
+                    "status": JobStatus.FAILED,
+                    "error": "Job lease expired too many times"
+                }
+            )
+            return
+
+        JOBS_RUNNING.inc(job.kind)
+        started = time.perf_counter()
+        _current_job.set(job.id)
+        handler = asyncio.create_task(self._handlers[job.kind](job.payload))
+        self._running.add(handler)
+        heartbeat = asyncio.create_task(self._heartbeat(job, handler))
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            if self._stopping:
+                return
+            logger.warning(
+                "Job %s (%s '%s') lost its lease", job.id, job.kind, job.key
+            )
+            return
+        except Exception as e:
+            logger.warning(
+                "Job %s (%s '%s') failed, attempt %d",
+                job.id,
+                job.kind,
+                job.key,
+                job.attempts,
+                exc_info=True
+            )
+            if job.attempts < self._max_attempts:
+                retry_delay = min(
+                    self._retry_delay * 2 ** (job.attempts - 1),
+                    MAX_RETRY_DELAY
+                )
+                values = {
+                    "status": JobStatus.PENDING,
+                    "run_after": utcnow() + retry_delay,
+                    "payload": job.payload,
+                    "error": str(e)
+                }
+            else:
+                values = {
+                    "status": JobStatus.FAILED,
+                    "payload": job.payload,
+                    "error": str(e)
+                }
+        else:
+            values = {
+                "status": JobStatus.DONE,
+                "payload": job.payload,
+                "error": None
+            }
+        finally:
+            self._running.discard(handler)
+            heartbeat.cancel()
+            # a write in flight is a no-op once the lease is released
+            progress = self._progress.pop(job.id, None)
+            JOBS_RUNNING.dec(job.kind)
+        if progress is not None:
+            # not yet written, watchers see the job end where it got to
+            values["progress"] = progress
+        JOB_SECONDS.observe(
+            time.perf_counter() - started, job.kind, values["status"]
+        )
+        await self._finish(job, values)
+
+    async def _heartbeat(self, job: Job, handler: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self._lease_duration.total_seconds() / 3)
+            try:
+                async with self._db_session.begin() as db:
+                    renewed = await db.execute(
+                        update(Job)
+                        .where(Job.id == job.id)
+                        .where(Job.lease_owner == self._owner)
+                        .values(lease_expires=utcnow() + self._lease_duration)
+                    )
+            except Exception:
+                logger.warning(
+                    "Couldn't renew lease of job %s", job.id, exc_info=True
+                )
+                continue
+            if renewed.rowcount == 0:
+                # another worker took the job over
+                handler.cancel()
+                return
+
+    async def _finish(self, job: Job, values: Dict[str, Any]) -> None:
+        async with self._db_session.begin() as db:
+            await db.execute(
+                update(Job)
+                .where(Job.id == job.id)
+                .where(Job.lease_owner == self._owner)
+                .values(lease_owner=None, lease_expires=None, **values)
+            )
+        self._updated.notify()
+
+    async def _write_progress(self, job_id: str) -> None:
+        try:
+            while (progress := self._progress.pop(job_id, None)) is not None:
+                async with self._db_session.begin() as db:
+                    await db.execute(
+                        update(Job)
+                        .where(Job.id == job_id)
+                        .where(Job.lease_owner == self._owner)
+                        .values(progress=progress)
+                    )
+                self._updated.notify()
+                await asyncio.sleep(PROGRESS_INTERVAL.total_seconds())
+        except Exception:
+            logger.warning(
+                "Couldn't save progress of job %s", job_id, exc_info=True
+            )
+        finally:
+            del self._progress_writes[job_id]
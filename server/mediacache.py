@@ -0,0 +1,329 @@
+import aiofiles
+import aiofiles.os
+import asyncio
+from datetime import timedelta
+import glob
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import quote, unquote
+
+from aiohttp import ClientError, ClientResponseError, ClientSession, hdrs, web
+import nanoid
+
+from cache import Notifier
+from metrics import Counter
+from objectstore import HTTP_TIMEOUT, ObjectStore
+
+
+MEDIA_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+PART_SUFFIX = ".part"
+# fills flush every chunk, a part file this old belongs to a dead process
+STALE_PART_AGE = timedelta(minutes=10)
+
+MEDIA_CACHE_REQUESTS = Counter(
+    "media_cache_requests_total", "Media requests by cache outcome", ["result"]
+)
+MEDIA_CACHE_FILLED_BYTES = Counter(
+    "media_cache_filled_bytes_total", "Media bytes fetched into the cache"
+)
+MEDIA_CACHE_EVICTIONS = Counter(
+    "media_cache_evictions_total", "Media files evicted from the cache"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    def __init__(
+            self,
+            directory: str,
+            object_store: ObjectStore,
+            max_size: int = MEDIA_CACHE_SIZE,
+            max_idle: timedelta | None = None
+    ):
+        self._directory = Path(directory)
+        self._object_store = object_store
+        self._max_size = max_size
+        self._max_idle = max_idle
+        # worker processes share the directory, the index is a shortcut only
+        self._files: Dict[str, Path] = {}
+        self._fills: Dict[str, _MediaFill] = {}
+        self._eviction: asyncio.Task | None = None
+        self._http: ClientSession | None = None
+
+    async def start(self, _=None) -> None:
+        self._http = ClientSession(timeout=HTTP_TIMEOUT)
+        await aiofiles.os.makedirs(self._directory, exist_ok=True)
+        await self._evict()
+
+    async def close(self, _=None) -> None:
+        for fill in list(self._fills.values()):
+            fill.task.cancel()
+        if self._eviction:
+            self._eviction.cancel()
+        await self._http.close()
+
+    async def respond(
+            self, object_id: str, request: web.Request
+    ) -> web.StreamResponse:
+        if path := await asyncio.to_thread(self._find, object_id):
+            MEDIA_CACHE_REQUESTS.inc("hit")
+            # handles Range and If-Range, sent with sendfile
+            return web.FileResponse(
+                path, headers={hdrs.CONTENT_TYPE: _content_type(path)}
+            )
+
+        if fill := self._fills.get(object_id):
+            MEDIA_CACHE_REQUESTS.inc("filling")
+        else:
+            MEDIA_CACHE_REQUESTS.inc("miss")
+            fill = _MediaFill(
+                self._http,
+                self._object_store,
+                object_id,
+                self._directory / quote(object_id, safe=""),
+                self._max_size
+            )
+            self._fills[object_id] = fill
+            fill.task.add_done_callback(
+                lambda _: self._filled(object_id, fill)
+            )
+        return await fill.stream_to(request)
+
+    def _find(self, object_id: str) -> Path | None:
+        if not (path := self._files.get(object_id)):
+            # might be filled by another worker process
+            name = glob.escape(quote(object_id, safe=""))
+            path = next(
+                (
+                    p for p in self._directory.glob(f"{name}+*")
+                    if p.suffix != PART_SUFFIX
+                ),
+                None
+            )
+            if not path:
+                return None
+        try:
+            # the modification time orders the LRU
+            os.utime(path)
+        except FileNotFoundError:
+            self._files.pop(object_id, None)
+            return None
+        self._files[object_id] = path
+        return path
+
+    def _filled(self, object_id: str, fill: "_MediaFill") -> None:
+        del self._fills[object_id]
+        if fill.task.cancelled():
+            return
+        if error := fill.task.exception():
+            logger.warning("Couldn't cache media %s", object_id, exc_info=error)
+        elif fill.path:
+            self._files[object_id] = fill.path
+            MEDIA_CACHE_FILLED_BYTES.inc(amount=fill.size)
+            # the fill after the running eviction catches up on its own
+            if not self._eviction or self._eviction.done():
+                self._eviction = asyncio.create_task(self._evict())
+
+    async def _evict(self) -> None:
+        try:
+            files = await asyncio.to_thread(self._evict_files)
+        except OSError:
+            logger.warning("Couldn't evict cached media", exc_info=True)
+            return
+        self._files = {
+            unquote(path.name.split("+", 1)[0]): path for path in files
+        }
+
+    def _evict_files(self) -> List[Path]:
+        now = time.time()
+        files = []
+        for path in self._directory.iterdir():
+            stat = path.stat()
+            if path.suffix == PART_SUFFIX:
+                if now - stat.st_mtime > STALE_PART_AGE.total_seconds():
+                    path.unlink(missing_ok=True)
+            elif "+" in path.name:
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort(reverse=True)
+        kept, kept_size = [], 0
+        for mtime, size, path in files:
+            if (
+                kept_size + size <= self._max_size
+                and (
+                    not self._max_idle
+                    or now - mtime <= self._max_idle.total_seconds()
+                )
+            ):
+                kept.append(path)
+                kept_size += size
+            else:
+                # open files are still served until closed
+                path.unlink(missing_ok=True)
+                MEDIA_CACHE_EVICTIONS.inc()
+        return kept
+
+
+class _MediaFill:
+    def __init__(
+            self,
+            http: ClientSession,
+            object_store: ObjectStore,
+            object_id: str,
+            path_prefix: Path,
+            max_size: int
+    ):
+        self.path: Path | None = None
+        self.size = 0
+        self.content_type = ""
+        self.object_url = ""
+        self._written = 0
+        self._part_path: Path | None = None
+        self._max_size = max_size
+        # resolves once the size is known, False for objects not cached
+        self._cacheable = asyncio.get_running_loop().create_future()
+        self._progress = Notifier()
+        self.task = asyncio.create_task(
+            self._fill(http, object_store, object_id, path_prefix)
+        )
+
+    async def stream_to(self, request: web.Request) -> web.StreamResponse:
+        try:
+            cacheable = await asyncio.shield(self._cacheable)
+        except ClientResponseError as e:
+            if e.status == 404:
+                raise web.HTTPNotFound()
+            raise web.HTTPBadGateway()
+        except ClientError:
+            raise web.HTTPBadGateway()
+        if not cacheable:
+            raise web.HTTPPermanentRedirect(self.object_url)
+
+        response = web.StreamResponse(
+            headers={
+                hdrs.ACCEPT_RANGES: "bytes",
+                hdrs.CONTENT_TYPE: self.content_type
+            }
+        )
+        if byte_range := self._range(request):
+            start, stop = byte_range
+            response.set_status(206)
+            response.headers[hdrs.CONTENT_RANGE] = (
+                f"bytes {start}-{stop - 1}/{self.size}"
+            )
+        else:
+            start, stop = 0, self.size
+        response.content_length = stop - start
+        await response.prepare(request)
+        if request.method == hdrs.METH_HEAD:
+            return response
+
+        try:
+            f = await aiofiles.open(self._part_path, "rb")
+        except FileNotFoundError:
+            # filled in the meantime
+            f = await aiofiles.open(self.path, "rb")
+        try:
+            await f.seek(start)
+            position = start
+            while position < stop:
+                progress = self._progress.waiter()
+                if position < self._written:
+                    chunk = await f.read(
+                        min(self._written, stop, position + CHUNK_SIZE)
+                        - position
+                    )
+                    position += len(chunk)
+                    await response.write(chunk)
+                elif self.task.done():
+                    # re-raises a fill error
+                    self.task.result()
+                    raise IOError("Media fill ended early")
+                else:
+                    await progress.wait()
+        finally:
+            await f.close()
+        await response.write_eof()
+        return response
+
+    def _range(self, request: web.Request) -> Tuple[int, int] | None:
+        # no validators are sent while filling, If-Range can't match
+        if hdrs.IF_RANGE in request.headers:
+            return None
+        try:
+            http_range = request.http_range
+        except ValueError:
+            return None
+        start, stop = http_range.start, http_range.stop
+        if start is None:
+            return None
+        if start < 0:
+            start, stop = max(self.size + start, 0), None
+        if start >= self.size:
+            raise web.HTTPRequestRangeNotSatisfiable(
+                headers={hdrs.CONTENT_RANGE: f"bytes */{self.size}"}
+            )
+        return start, min(stop or self.size, self.size)
+
+    async def _fill(
+            self,
+            http: ClientSession,
+            object_store: ObjectStore,
+            object_id: str,
+            path_prefix: Path
+    ) -> None:
+        try:
+            self.object_url = await object_store.get_object_url(object_id)
+            async with http.get(self.object_url) as response:
+                response.raise_for_status()
+                self.size = response.content_length or 0
+                self.content_type = response.content_type
+                if not 0 < self.size <= self._max_size:
+                    self._cacheable.set_result(False)
+                    return
+
+                path = path_prefix.with_name(
+                    f"{path_prefix.name}+{quote(self.content_type, safe='')}"
+                )
+                self._part_path = path.with_name(
+                    f"{path.name}.{nanoid.generate(size=11)}{PART_SUFFIX}"
+                )
+                async with aiofiles.open(self._part_path, "wb") as f:
+                    self._cacheable.set_result(True)
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        await f.write(chunk)
+                        # readers have files of their own
+                        await f.flush()
+                        self._written += len(chunk)
+                        self._progress.notify()
+            if self._written != self.size:
+                raise IOError(f"Got {self._written} of {self.size} bytes")
+            await aiofiles.os.replace(self._part_path, path)
+            self.path = path
+        except asyncio.CancelledError:
+            self._cacheable.cancel()
+            await self._remove_part()
+            raise
+        except Exception as e:
+            if not self._cacheable.done():
+                self._cacheable.set_exception(e)
+            await self._remove_part()
+            raise
+        finally:
+            self._progress.notify()
+
+    async def _remove_part(self) -> None:
+        if self._part_path:
+            try:
+                await aiofiles.os.remove(self._part_path)
+            except FileNotFoundError:
+                pass
+
+
+def _content_type(path: Path) -> str:
+    return unquote(path.name.split("+", 1)[1])
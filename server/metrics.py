@@ -0,0 +1,173 @@
+from bisect import bisect_left
+import functools
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple, TypeVar
+
+from aiohttp import web
+
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+T = TypeVar("T")
+
+REGISTRY: List["Metric"] = []
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}"
+        ]
+        for suffix, names, values, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_labels(names, values)} {_number(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield "", self.labels, label_values, value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            labels: Iterable[str] = (),
+            buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, description, labels)
+        self._buckets = buckets
+        # per bucket counts, the last one is +Inf, then the sum
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        if (counts := self._values.get(label_values)) is None:
+            counts = self._values[label_values] = [0] * (len(self._buckets) + 2)
+        counts[bisect_left(self._buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        bucket_labels = self.labels + ("le",)
+        for label_values, counts in self._values.items():
+            total = 0
+            for le, count in zip((*self._buckets, "+Inf"), counts):
+                total += count
+                yield "_bucket", bucket_labels, label_values + (str(le),), total
+            yield "_sum", self.labels, label_values, counts[-1]
+            yield "_count", self.labels, label_values, total
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["route", "method", "status"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["route", "method"]
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served")
+
+
+def timed(
+        histogram: Histogram, *label_values: str
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        labels = label_values or (fn.__name__,)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs) -> T:
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+
+        return wrapper
+
+    return decorator
+
+
+def metrics_middleware():
+    @web.middleware
+    async def middleware(request: web.Request, handler) -> web.StreamResponse:
+        # the route template, raw paths would explode the label set
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource else "unmatched"
+        status = 500
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, route, request.method
+            )
+            HTTP_REQUESTS.inc(route, request.method, str(status))
+
+    return middleware
+
+
+async def metrics(_: web.Request) -> web.Response:
+    return web.Response(
+        text="\n".join(metric.render() for metric in REGISTRY) + "\n",
+        headers={"Content-Type": CONTENT_TYPE}
+    )
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    labels = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return f"{{{labels}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _number(value: float) -> str:
+    # large counters in exponent notation would lose precision
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
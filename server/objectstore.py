@@ -1,22 +1,100 @@
 import aiofiles
 import aiofiles.ospath
 import asyncio
-import json
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta, UTC
+import functools
+import itertools
+import json
+import logging
 import os
+import random
 import tempfile
-from typing import AsyncIterable, Dict
+import time
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING, Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Deque,
+    Dict, Iterable, List
+)
+
+from aiohttp import (
+    ClientError, ClientResponseError, ClientSession, ClientTimeout, TCPConnector,
+    web
+)
+from aiohttp.hdrs import (
+    CONTENT_LENGTH, CONTENT_TYPE, METH_DELETE, METH_POST, METH_PUT
+)
+from yarl import URL
+
+from cache import ExpiringLRUCache, SingleFlight
+from metrics import Counter, Histogram, timed
+from remotefile import FileInfo, get_file_info
+from ytdlppool import (
+    MAX_PLAYLIST_VIDEOS, YT_DLP_FORMAT, YtDlpPool, YtDlpRun, is_video_entry
+)
 
-from aiohttp import ClientSession
-from aiohttp.hdrs import CONTENT_LENGTH, CONTENT_TYPE
-import oci
-from oci.object_storage.models import CreatePreauthenticatedRequestDetails
+if TYPE_CHECKING:
+    import oci
 
 
 BUCKET_NAME = "stethoscope-2022"
 ONE_DAY = timedelta(days=1)
 ONE_HOUR = timedelta(hours=1)
+# every part but the last one must be at least 10 MiB
+UPLOAD_PART_SIZE = 10 * 1024 * 1024
+OPC_MULTIPART = "opc-multipart"
+HTTP_KEEPALIVE = timedelta(minutes=1)
+HTTP_TIMEOUT = ClientTimeout(total=None, sock_connect=30, sock_read=120)
+HTTP_RETRY_DELAY = timedelta(seconds=1)
+OCI_CREATE_PAR = "create_preauthenticated_request"
+OCI_DELETE_OBJECT = "delete_object"
+OCI_CONCURRENCY = {OCI_CREATE_PAR: 8, OCI_DELETE_OBJECT: 4}
+OCI_RETRY_DELAY = timedelta(seconds=1)
+OCI_MAX_INIT_DELAY = timedelta(minutes=1)
+# requests fail with 503 after this while the OCI client can't be set up
+OCI_INIT_WAIT = timedelta(seconds=10)
+PAR_OBJECT_READ = "ObjectRead"
+PAR_OBJECT_WRITE = "ObjectWrite"
+BLOB_PREFIX = "blobs/"
+YT_DLP = "yt-dlp"
+YT_DLP_ARGS = ["--netrc", "--netrc-location", "/etc/stethoscope/"]
+YT_DLP_INFO = "stethoscope-info "
+YT_DLP_PROGRESS = "stethoscope-progress "
+# one run prints the video info then the download progress as JSON lines
+YT_DLP_REPORT_ARGS = [
+    "--no-simulate",
+    "--progress",
+    "--newline",
+    "--print",
+    f"video:{YT_DLP_INFO}"
+    "%(.{id,title,description,duration,epoch,thumbnail})j",
+    "--progress-template",
+    f"download:{YT_DLP_PROGRESS}"
+    "%(progress.{downloaded_bytes,total_bytes,total_bytes_estimate})j"
+]
+# video descriptions make for long lines
+YT_DLP_LINE_LIMIT = 1024 * 1024
+
+OBJECT_STORE_SECONDS = Histogram(
+    "object_store_call_duration_seconds", "ObjectStore call latency", ["method"]
+)
+OCI_CALL_SECONDS = Histogram(
+    "oci_call_duration_seconds", "OCI SDK call latency", ["operation", "outcome"]
+)
+YT_DLP_SECONDS = Histogram(
+    "yt_dlp_duration_seconds", "yt-dlp run time", ["mode"]
+)
+UPLOADED_BYTES = Counter(
+    "youtube_uploaded_bytes_total", "YouTube audio bytes uploaded", ["mode"]
+)
+
+# downloaded bytes and the total, if known
+ProgressCallback = Callable[[int, int | None], None]
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -32,116 +110,607 @@ class YoutubeAudio:
 
 
 class ObjectStore:
-    def __init__(self, oci_config: Dict[str, str]):
-        self.object_store = oci.object_storage.ObjectStorageClient(oci_config)
-        self.bucket_namespace: str = self.object_store.get_namespace().data
+    def __init__(
+            self,
+            oci_config: Dict[str, str] | str,
+            url_cache_size: int = 1024,
+            url_safety_margin: timedelta = ONE_HOUR,
+            stream_uploads: bool = False,
+            upload_part_size: int = UPLOAD_PART_SIZE,
+            upload_parallelism: int = 3,
+            http_connections: int = 32,
+            http_retries: int = 3,
+            oci_concurrency: Dict[str, int] = OCI_CONCURRENCY,
+            oci_retries: int = 5,
+            oci_endpoint: str | None = None,
+            yt_dlp: str = YT_DLP,
+            yt_dlp_pool: YtDlpPool | None = None
+    ):
+        # a config file path or a loaded config
+        self._oci_config = oci_config
+        self._oci_endpoint = oci_endpoint
+        self._oci: ModuleType | None = None
+        self._oci_init: asyncio.Task | None = None
+        self.object_store: "oci.object_storage.ObjectStorageClient | None" = None
+        self.bucket_namespace: str | None = None
+        self._object_urls = ExpiringLRUCache[str](url_cache_size)
+        self._object_url_requests = SingleFlight()
+        self._url_safety_margin = url_safety_margin
+        self._stream_uploads = stream_uploads
+        self._upload_part_size = upload_part_size
+        self._upload_parallelism = upload_parallelism
+        self._http_connections = http_connections
+        self._http_retries = http_retries
+        self._http: ClientSession | None = None
+        # OCI SDK calls block, keep them off the default executor
+        self._oci_executor = ThreadPoolExecutor(
+            max_workers=sum(oci_concurrency.values()),
+            thread_name_prefix="oci"
+        )
+        self._oci_limits = {
+            operation: asyncio.Semaphore(limit)
+            for operation, limit in oci_concurrency.items()
+        }
+        self._oci_retries = oci_retries
+        self._yt_dlp = [yt_dlp, *YT_DLP_ARGS]
+        # warm worker processes instead of a yt-dlp run per download
+        self._yt_dlp_pool = yt_dlp_pool
 
-    async def save_youtube_audio(self, youtube_url: str) -> YoutubeAudio:
-        yt_dlp = [
-            "yt-dlp", "--netrc", "--netrc-location", "/etc/stethoscope/"
-        ]
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            audiofile = os.path.join(tmp_dir, "audiotrack")
+    async def start(self, _=None) -> None:
+        self._http = ClientSession(
+            connector=TCPConnector(
+                limit=self._http_connections,
+                keepalive_timeout=HTTP_KEEPALIVE.total_seconds()
+            ),
+            timeout=HTTP_TIMEOUT
+        )
+        # the SDK import and namespace lookup are slow, don't hold up startup
+        self._oci_init = asyncio.create_task(self._init_oci())
 
-            youtube_info_proc, youtube_audio_proc = await asyncio.gather(
-                asyncio.create_subprocess_exec(
-                    *yt_dlp,
-                    "--dump-json",
-                    youtube_url,
-                    stdout=asyncio.subprocess.PIPE
-                ),
-                asyncio.create_subprocess_exec(
-                    *yt_dlp,
-                    "--format",
-                    "ba[ext=m4a]",
-                    "--output",
-                    audiofile,
+    @property
+    def ready(self) -> bool:
+        return self._oci_init is not None and self._oci_init.done()
+
+    async def close(self, _=None) -> None:
+        self._oci_init.cancel()
+        await self._http.close()
+        self._oci_executor.shutdown(wait=False, cancel_futures=True)
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def save_youtube_audio(
+            self,
+            youtube_url: str,
+            on_progress: ProgressCallback = lambda downloaded, total: None
+    ) -> YoutubeAudio:
+        # the m4a fixup of yt-dlp needs a file, streamed audio stays fragmented
+        if self._stream_uploads:
+            try:
+                return await self._stream_youtube_audio(youtube_url, on_progress)
+            # a video yt-dlp can't get isn't tried twice
+            except (ClientError, TimeoutError):
+                logger.warning(
+                    "Couldn't stream '%s', retrying via local file",
                     youtube_url,
-                    stdout=asyncio.subprocess.DEVNULL
+                    exc_info=True
                 )
+        return await self._upload_youtube_audio_file(youtube_url, on_progress)
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def list_youtube_videos(self, playlist_url: str) -> List[str]:
+        # a flat extraction, only the playlist or channel pages are fetched
+        if self._yt_dlp_pool:
+            return await self._yt_dlp_pool.list_videos(playlist_url)
+
+        started = time.perf_counter()
+        list_proc = await asyncio.create_subprocess_exec(
+            *self._yt_dlp,
+            "--flat-playlist",
+            "--playlist-end",
+            str(MAX_PLAYLIST_VIDEOS),
+            "--print",
+            "%(ie_key)s %(id)s",
+            playlist_url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await list_proc.communicate()
+        finally:
+            if list_proc.returncode is None:
+                list_proc.kill()
+                await list_proc.wait()
+            YT_DLP_SECONDS.observe(time.perf_counter() - started, "list")
+        if list_proc.returncode != 0:
+            raise IOError(
+                f"yt-dlp exited with {list_proc.returncode}: "
+                f"{stderr.decode(errors='replace').strip()[-1000:]}"
             )
-            (youtube_info_json, _), _ = await asyncio.gather(
-                youtube_info_proc.communicate(), youtube_audio_proc.wait()
+        entries = (line.split(" ", 1) for line in stdout.decode().splitlines())
+        return [
+            entry_id
+            for ie_key, entry_id in entries
+            if is_video_entry(ie_key, entry_id)
+        ]
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def save_book_chapter(self, book_id: str, chapter_id: str) -> str:
+        return await self._create_write_url(
+            chapter_id, f"{book_id}/{chapter_id}"
+        )
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def save_book_chapters(
+            self,
+            book_id: str,
+            chapter_ids: Iterable[str]
+    ) -> Dict[str, str]:
+        chapter_ids = list(chapter_ids)
+        # bounded by the PAR creation concurrency
+        upload_urls = await asyncio.gather(
+            *(
+                self.save_book_chapter(book_id, chapter_id)
+                for chapter_id in chapter_ids
             )
-            youtube_info = json.loads(youtube_info_json)
-            youtube_audio = YoutubeAudio(
-                id=youtube_info["id"],
-                title=youtube_info["title"],
-                description=youtube_info["description"],
-                duration=youtube_info["duration"],
-                size=await aiofiles.ospath.getsize(audiofile),
-                published=datetime.fromtimestamp(youtube_info["epoch"], UTC),
-                thumbnail_url=youtube_info["thumbnail"],
-                mime_type="audio/mp4"
+        )
+        return dict(zip(chapter_ids, upload_urls))
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def save_blobs(self, blob_hashes: Iterable[str]) -> Dict[str, str]:
+        blob_hashes = list(blob_hashes)
+        upload_urls = await asyncio.gather(
+            *(
+                self._create_write_url(blob_hash, blob_object_id(blob_hash))
+                for blob_hash in blob_hashes
             )
+        )
+        return dict(zip(blob_hashes, upload_urls))
 
-            object_write_request = await asyncio.to_thread(
-                self.object_store.create_preauthenticated_request,
-                self.bucket_namespace,
-                BUCKET_NAME,
-                CreatePreauthenticatedRequestDetails(
-                    name=youtube_audio.id,
-                    object_name=youtube_audio.id,
-                    access_type=CreatePreauthenticatedRequestDetails.ACCESS_TYPE_OBJECT_WRITE,
-                    time_expires=datetime.utcnow() + ONE_HOUR
+    @timed(OBJECT_STORE_SECONDS)
+    async def delete_object(self, object_id: str):
+        self._object_urls.pop(object_id)
+        # self._oci is needed for the except clause
+        await self._wait_for_oci()
+        try:
+            await self._oci_call(OCI_DELETE_OBJECT, object_id)
+        except self._oci.exceptions.ServiceError as e:
+            if e.status != 404:
+                raise
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def delete_objects(
+            self,
+            object_ids: Iterable[str]
+    ) -> Dict[str, Exception | None]:
+        results = {}
+        object_ids = list(object_ids)
+        await self._wait_for_oci()
+        for attempt in itertools.count(1):
+            attempt_results = await asyncio.gather(
+                *(self.delete_object(object_id) for object_id in object_ids),
+                return_exceptions=True
+            )
+            results.update(zip(object_ids, attempt_results))
+            object_ids = [
+                object_id
+                for object_id, result in zip(object_ids, attempt_results)
+                if self._is_throttled(result)
+            ]
+            if not object_ids or attempt >= self._oci_retries:
+                break
+            # full jitter keeps retried deletes from arriving in lockstep
+            await asyncio.sleep(
+                random.uniform(
+                    0, OCI_RETRY_DELAY.total_seconds() * 2 ** (attempt - 1)
                 )
             )
-            async with ClientSession() as http:
-                await http.put(
-                    object_write_request.data.full_path,
-                    # TODO stream from yt-dlp stdout
-                    data=self._file_sender(audiofile),
-                    headers={
-                        CONTENT_LENGTH: str(youtube_audio.size),
-                        CONTENT_TYPE: youtube_audio.mime_type
-                    }
+        return results
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def get_object_urls(
+            self,
+            object_ids: Iterable[str]
+    ) -> Dict[str, str | Exception]:
+        object_ids = list(object_ids)
+        results = await asyncio.gather(
+            *(self.get_object_url(object_id) for object_id in object_ids),
+            return_exceptions=True
+        )
+        return dict(zip(object_ids, results))
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def get_file_info(self, object_id: str) -> FileInfo:
+        object_url = await self.get_object_url(object_id)
+        return await get_file_info(self._http, object_url)
+
+    @timed(OBJECT_STORE_SECONDS)
+    async def get_object_url(self, object_id: str) -> str:
+        if object_url := self._object_urls.get(object_id):
+            return object_url
+        return await self._object_url_requests.do(
+            object_id, lambda: self._create_object_url(object_id)
+        )
+
+    async def _create_object_url(self, object_id: str) -> str:
+        time_expires = datetime.utcnow() + ONE_DAY
+        object_url = await self._create_par(
+            object_id, object_id, PAR_OBJECT_READ, time_expires
+        )
+        # re-issue the URL while clients still have time to use it
+        url_ttl = time_expires - datetime.utcnow() - self._url_safety_margin
+        self._object_urls.put(object_id, object_url, url_ttl.total_seconds())
+
+        return object_url
+
+    async def _stream_youtube_audio(
+            self, youtube_url: str, on_progress: ProgressCallback
+    ) -> YoutubeAudio:
+        started = time.perf_counter()
+        try:
+            async with self._run_yt_dlp(youtube_url, None, on_progress) as yt_dlp:
+                youtube_info = await yt_dlp.info
+                object_url = await self._create_write_url(
+                    youtube_info["id"], youtube_info["id"]
                 )
 
+                async with _MultipartUpload(
+                    self._request,
+                    object_url,
+                    "audio/mp4",
+                    self._upload_part_size,
+                    self._upload_parallelism
+                ) as upload:
+                    size = await upload.write(yt_dlp.stdout)
+                    # commit only fully downloaded audio
+                    await yt_dlp.wait()
+        finally:
+            YT_DLP_SECONDS.observe(time.perf_counter() - started, "stream")
+        UPLOADED_BYTES.inc("stream", amount=size)
+
+        return _youtube_audio(youtube_info, size)
+
+    async def _upload_youtube_audio_file(
+            self, youtube_url: str, on_progress: ProgressCallback
+    ) -> YoutubeAudio:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            audiofile = os.path.join(tmp_dir, "audiotrack")
+
+            started = time.perf_counter()
+            try:
+                async with self._run_yt_dlp(
+                    youtube_url, audiofile, on_progress
+                ) as yt_dlp:
+                    youtube_info = await yt_dlp.info
+                    await yt_dlp.wait()
+            finally:
+                YT_DLP_SECONDS.observe(time.perf_counter() - started, "file")
+            youtube_audio = _youtube_audio(
+                youtube_info, await aiofiles.ospath.getsize(audiofile)
+            )
+
+            object_url = await self._create_write_url(
+                youtube_audio.id, youtube_audio.id
+            )
+            await self._request(
+                METH_PUT,
+                object_url,
+                data=lambda: self._file_sender(audiofile),
+                headers={
+                    CONTENT_LENGTH: str(youtube_audio.size),
+                    CONTENT_TYPE: youtube_audio.mime_type
+                }
+            )
+            UPLOADED_BYTES.inc("file", amount=youtube_audio.size)
+
         return youtube_audio
 
-    async def save_book_chapter(self, book_id: str, chapter_id: str) -> str:
-        object_write_request = await asyncio.to_thread(
-            self.object_store.create_preauthenticated_request,
-            self.bucket_namespace,
-            BUCKET_NAME,
-            CreatePreauthenticatedRequestDetails(
-                name=chapter_id,
-                object_name=f"{book_id}/{chapter_id}",
-                access_type=CreatePreauthenticatedRequestDetails.ACCESS_TYPE_OBJECT_WRITE,
-                time_expires=datetime.utcnow() + ONE_HOUR
+    # downloads to output, or to stdout when it's None
+    @asynccontextmanager
+    async def _run_yt_dlp(
+            self, youtube_url: str, output: str | None, on_progress: ProgressCallback
+    ) -> AsyncIterator["_YtDlpProcess | YtDlpRun"]:
+        if self._yt_dlp_pool:
+            async with self._yt_dlp_pool.download(
+                youtube_url, output, on_progress
+            ) as download:
+                yield download
+            return
+
+        youtube_audio_proc = await asyncio.create_subprocess_exec(
+            *self._yt_dlp,
+            *YT_DLP_REPORT_ARGS,
+            "--format",
+            YT_DLP_FORMAT,
+            "--output",
+            output or "-",
+            youtube_url,
+            stdout=asyncio.subprocess.PIPE,
+            # yt-dlp reports to stderr while the audio goes to stdout
+            stderr=asyncio.subprocess.PIPE if output is None else None,
+            limit=YT_DLP_LINE_LIMIT
+        )
+        yt_dlp = _YtDlpProcess(youtube_audio_proc, output is None, on_progress)
+        try:
+            yield yt_dlp
+        finally:
+            if youtube_audio_proc.returncode is None:
+                youtube_audio_proc.kill()
+                await youtube_audio_proc.wait()
+            await yt_dlp.close()
+
+    async def _create_write_url(self, name: str, object_id: str) -> str:
+        return await self._create_par(
+            name, object_id, PAR_OBJECT_WRITE, datetime.utcnow() + ONE_HOUR
+        )
+
+    async def _create_par(
+            self,
+            name: str,
+            object_id: str,
+            access_type: str,
+            time_expires: datetime
+    ) -> str:
+        await self._wait_for_oci()
+        par = await self._oci_call(
+            OCI_CREATE_PAR,
+            self._oci.object_storage.models.CreatePreauthenticatedRequestDetails(
+                name=name,
+                object_name=object_id,
+                access_type=access_type,
+                time_expires=time_expires
             )
         )
-        return object_write_request.data.full_path
+        return par.data.full_path
 
-    async def delete_object(self, object_id: str):
+    async def _init_oci(self) -> None:
+        for attempt in itertools.count(1):
+            try:
+                self._oci, self.object_store, self.bucket_namespace = (
+                    await asyncio.get_running_loop().run_in_executor(
+                        self._oci_executor, self._create_oci_client
+                    )
+                )
+                return
+            except Exception:
+                logger.warning(
+                    "Couldn't set up OCI client, attempt %d",
+                    attempt,
+                    exc_info=True
+                )
+                await asyncio.sleep(
+                    min(
+                        OCI_RETRY_DELAY * 2 ** (attempt - 1),
+                        OCI_MAX_INIT_DELAY
+                    ).total_seconds()
+                )
+
+    async def _wait_for_oci(self) -> None:
+        # waits for the client while the server is starting, not while OCI is down
         try:
-            await asyncio.to_thread(
-                self.object_store.delete_object,
-                self.bucket_namespace,
-                BUCKET_NAME,
-                object_id
+            await asyncio.wait_for(
+                asyncio.shield(self._oci_init), OCI_INIT_WAIT.total_seconds()
             )
-        except oci.exceptions.ServiceError as e:
-            if e.status != 404:
-                raise
+        except TimeoutError:
+            raise web.HTTPServiceUnavailable(text="Object storage not ready")
 
-    async def get_object_url(self, object_id: str) -> str:
-        object_read_request = await asyncio.to_thread(
-            self.object_store.create_preauthenticated_request,
-            self.bucket_namespace,
-            BUCKET_NAME,
-            CreatePreauthenticatedRequestDetails(
-                name=object_id,
-                object_name=object_id,
-                access_type=CreatePreauthenticatedRequestDetails.ACCESS_TYPE_OBJECT_READ,
-                time_expires=datetime.utcnow() + ONE_DAY
-            )
+    def _create_oci_client(
+            self
+    ) -> "tuple[ModuleType, oci.object_storage.ObjectStorageClient, str]":
+        # runs in a worker thread, importing the SDK alone takes a while
+        import oci
+
+        if isinstance(self._oci_config, str):
+            config = oci.config.from_file(self._oci_config)
+        else:
+            config = self._oci_config
+        client = oci.object_storage.ObjectStorageClient(
+            config, service_endpoint=self._oci_endpoint
         )
+        return oci, client, client.get_namespace().data
 
-        return object_read_request.data.full_path
+    async def _oci_call(self, operation: str, *args) -> Any:
+        await self._wait_for_oci()
+        async with self._oci_limits[operation]:
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._oci_executor,
+                    functools.partial(
+                        getattr(self.object_store, operation),
+                        self.bucket_namespace,
+                        BUCKET_NAME,
+                        *args
+                    )
+                )
+                outcome = "ok"
+                return result
+            finally:
+                elapsed = time.perf_counter() - started
+                OCI_CALL_SECONDS.observe(elapsed, operation, outcome)
+                logger.debug("OCI %s took %.3fs", operation, elapsed)
+
+    async def _request(
+            self,
+            method: str,
+            url: str | URL,
+            data: bytes | Callable[[], AsyncIterable[bytes]] | None = None,
+            headers: Dict[str, str] | None = None
+    ) -> bytes:
+        for attempt in itertools.count(1):
+            try:
+                async with self._http.request(
+                    method,
+                    url,
+                    # streamed bodies can't be replayed, so they're recreated
+                    data=data() if callable(data) else data,
+                    headers=headers
+                ) as response:
+                    response.raise_for_status()
+                    return await response.read()
+            except (ClientError, TimeoutError) as e:
+                if attempt >= self._http_retries or not _is_retryable(e):
+                    raise
+                await asyncio.sleep(
+                    HTTP_RETRY_DELAY.total_seconds() * 2 ** (attempt - 1)
+                )
+
+    def _is_throttled(self, result: Any) -> bool:
+        return isinstance(result, self._oci.exceptions.ServiceError) and (
+            result.status == 429 or result.status >= 500
+        )
 
     @staticmethod
     async def _file_sender(file) -> AsyncIterable[bytes]:
         async with aiofiles.open(file, "rb") as f:
             while chunk := await f.read(1024 * 1024):
                 yield chunk
+
+
+class _MultipartUpload:
+    def __init__(
+            self,
+            request: Callable[..., Awaitable[bytes]],
+            object_url: str,
+            content_type: str,
+            part_size: int,
+            parallelism: int
+    ):
+        self._request = request
+        self._object_url = object_url
+        self._content_type = content_type
+        self._part_size = part_size
+        self._parts = asyncio.Semaphore(parallelism)
+        self._upload_url: URL | None = None
+
+    async def __aenter__(self) -> "_MultipartUpload":
+        upload = json.loads(
+            await self._request(
+                METH_PUT,
+                self._object_url,
+                headers={
+                    OPC_MULTIPART: "true",
+                    CONTENT_TYPE: self._content_type
+                }
+            )
+        )
+        self._upload_url = URL(self._object_url).join(URL(upload["accessUri"]))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self._request(METH_POST, self._upload_url)
+        else:
+            try:
+                await self._request(METH_DELETE, self._upload_url)
+            except (ClientError, TimeoutError):
+                logger.warning(
+                    "Couldn't abort upload %s", self._upload_url, exc_info=True
+                )
+
+    async def write(self, stream: asyncio.StreamReader) -> int:
+        size = 0
+        async with asyncio.TaskGroup() as tg:
+            for part_num in itertools.count(1):
+                # bounds the number of buffered parts, read one included
+                await self._parts.acquire()
+                try:
+                    part = await stream.readexactly(self._part_size)
+                except asyncio.IncompleteReadError as e:
+                    part = e.partial
+                if not part and part_num > 1:
+                    self._parts.release()
+                    break
+                tg.create_task(self._write_part(part_num, part))
+                size += len(part)
+                if len(part) < self._part_size:
+                    break
+        return size
+
+    async def _write_part(self, part_num: int, part: bytes) -> None:
+        try:
+            await self._request(
+                METH_PUT, self._upload_url / str(part_num), data=part
+            )
+        finally:
+            self._parts.release()
+
+
+class _YtDlpProcess:
+    def __init__(
+            self,
+            process: asyncio.subprocess.Process,
+            to_stdout: bool,
+            on_progress: ProgressCallback
+    ):
+        self.info: asyncio.Future[Dict] = (
+            asyncio.get_running_loop().create_future()
+        )
+        self.stdout = process.stdout if to_stdout else None
+        self._process = process
+        # the last messages explain a failure
+        self._messages: Deque[str] = deque(maxlen=5)
+        self._task = asyncio.create_task(
+            self._read(process.stderr if to_stdout else process.stdout, on_progress)
+        )
+
+    async def wait(self) -> None:
+        if await self._process.wait() != 0:
+            raise IOError(
+                f"yt-dlp exited with {self._process.returncode}: "
+                f"{' '.join(self._messages)}"
+            )
+
+    async def close(self) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _read(
+            self, stream: asyncio.StreamReader, on_progress: ProgressCallback
+    ) -> None:
+        try:
+            async for line in stream:
+                line = line.decode(errors="replace").rstrip()
+                if line.startswith(YT_DLP_PROGRESS):
+                    progress = json.loads(line.removeprefix(YT_DLP_PROGRESS))
+                    on_progress(
+                        progress.get("downloaded_bytes") or 0,
+                        progress.get("total_bytes")
+                        or progress.get("total_bytes_estimate")
+                    )
+                elif line.startswith(YT_DLP_INFO) and not self.info.done():
+                    self.info.set_result(
+                        json.loads(line.removeprefix(YT_DLP_INFO))
+                    )
+                elif line:
+                    self._messages.append(line)
+        except asyncio.CancelledError:
+            self.info.cancel()
+            raise
+        finally:
+            if not self.info.done():
+                self.info.set_exception(
+                    IOError(f"yt-dlp printed no info: {' '.join(self._messages)}")
+                )
+
+
+def blob_object_id(blob_hash: str) -> str:
+    return f"{BLOB_PREFIX}{blob_hash}"
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return True
+
+
+def _youtube_audio(youtube_info: Dict, size: int) -> YoutubeAudio:
+    return YoutubeAudio(
+        id=youtube_info["id"],
+        title=youtube_info["title"],
+        description=youtube_info["description"],
+        duration=youtube_info["duration"],
+        size=size,
+        published=datetime.fromtimestamp(youtube_info["epoch"], UTC),
+        thumbnail_url=youtube_info["thumbnail"],
+        mime_type="audio/mp4"
+    )
@@ -1,8 +1,33 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http import HTTPStatus
 import io
-from dataclasses import dataclass
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
 
+from aiohttp import ClientSession, hdrs
 import mutagen
-from requests import Session
+
+from metrics import Counter, Histogram
+
+
+BLOCK_SIZE = 64 * 1024
+READAHEAD_BLOCKS = 3
+CACHED_BLOCKS = 64
+
+PROBE_SECONDS = Histogram("probe_duration_seconds", "Remote file probe time")
+PROBE_REQUESTS = Counter("probe_requests_total", "Remote file probe HTTP requests")
+PROBE_BYTES = Counter("probe_bytes_total", "Remote file probe bytes read")
+
+# fetches an inclusive byte range, returns the bytes and the total file size
+RangeFetcher = Callable[[int, int], Tuple[bytes, int]]
+
+
+@dataclass
+class ProbeStats:
+    requests: int = 0
+    bytes: int = 0
 
 
 @dataclass(frozen=True)
@@ -11,30 +36,45 @@ class FileInfo:
     duration: int
     mime_type: str
     tags: mutagen.Tags
-
-
-class _RemoteFile:
-
-    def __init__(self, session: Session, file_url: str):
-        self._file_url = file_url
-        self._session = session
+    probe: ProbeStats = field(default_factory=ProbeStats)
+
+
+class RemoteFile:
+
+    def __init__(
+            self,
+            fetch: RangeFetcher,
+            block_size: int = BLOCK_SIZE,
+            readahead_blocks: int = READAHEAD_BLOCKS,
+            cached_blocks: int = CACHED_BLOCKS
+    ):
+        self._fetch = fetch
+        self._block_size = block_size
+        self._readahead_blocks = readahead_blocks
+        self._cached_blocks = cached_blocks
+        self._blocks: OrderedDict[int, bytes] = OrderedDict()
         self._offset = 0
         self._size = -1
+        self.stats = ProbeStats()
 
     def read(self, count: int = -1) -> bytes:
         if count == 0:
             return b''
         if count < 0:
-            end = self.size() - 1
+            end = self.size()
         else:
-            end = self._offset + count - 1
+            end = min(self._offset + count, self.size())
+        if self._offset >= end:
+            return b''
 
-        request_headers = {"Range": f"bytes={self._offset}-{end}"}
-        response = self._session.get(self._file_url, headers=request_headers)
-        if not response.ok:
-            raise IOError("IO error")
-        self._offset += len(response.content)
-        return response.content
+        first_block = self._offset // self._block_size
+        last_block = (end - 1) // self._block_size
+        blocks = self._load_blocks(first_block, last_block)
+        data = b''.join(blocks[b] for b in range(first_block, last_block + 1))
+        start = self._offset - first_block * self._block_size
+        data = data[start:start + end - self._offset]
+        self._offset += len(data)
+        return data
 
     def tell(self) -> int:
         return self.seek(0, io.SEEK_CUR)
@@ -52,11 +92,8 @@ class _RemoteFile:
 
     def size(self) -> int:
         if self._size < 0:
-            response = self._session.head(self._file_url)
-            if response.ok:
-                self._size = int(response.headers["Content-Length"])
-            else:
-                raise IOError("Couldn't determine size")
+            # the first ranged response tells the size, no need for HEAD
+            self._load_blocks(0, 0)
         return self._size
 
     def write(self, data):
@@ -71,14 +108,102 @@ class _RemoteFile:
     def fileno(self):
         raise NotImplementedError
 
+    def _load_blocks(self, first_block: int, last_block: int) -> Dict[int, bytes]:
+        blocks = {}
+        missing_blocks = []
+        for block in range(first_block, last_block + 1):
+            if (data := self._blocks.get(block)) is not None:
+                self._blocks.move_to_end(block)
+                blocks[block] = data
+            else:
+                missing_blocks.append(block)
+
+        block_runs = _block_runs(missing_blocks)
+        if block_runs:
+            # read ahead past the last requested block
+            run_start, run_end = block_runs[-1]
+            while (
+                run_end - last_block < self._readahead_blocks
+                and run_end + 1 not in self._blocks
+                and (self._size < 0 or (run_end + 1) * self._block_size < self._size)
+            ):
+                run_end += 1
+            block_runs[-1] = (run_start, run_end)
+
+        for run_start, run_end in block_runs:
+            data, self._size = self._fetch(
+                run_start * self._block_size,
+                (run_end + 1) * self._block_size - 1
+            )
+            self.stats.requests += 1
+            self.stats.bytes += len(data)
+            for block in range(run_start, run_end + 1):
+                offset = (block - run_start) * self._block_size
+                if block_data := data[offset:offset + self._block_size]:
+                    blocks[block] = block_data
+                    self._cache_block(block, block_data)
+
+        return blocks
+
+    def _cache_block(self, block: int, data: bytes) -> None:
+        self._blocks[block] = data
+        while len(self._blocks) > self._cached_blocks:
+            self._blocks.popitem(last=False)
+
+
+def _block_runs(blocks: Iterable[int]) -> List[Tuple[int, int]]:
+    runs = []
+    for block in blocks:
+        if runs and runs[-1][1] == block - 1:
+            runs[-1] = (runs[-1][0], block)
+        else:
+            runs.append((block, block))
+    return runs
+
+
+async def _fetch_range(
+        http: ClientSession,
+        file_url: str,
+        start: int,
+        end: int
+) -> Tuple[bytes, int]:
+    async with http.get(
+        file_url, headers={hdrs.RANGE: f"bytes={start}-{end}"}
+    ) as response:
+        if not response.ok:
+            raise IOError("IO error")
+        content = await response.read()
+    if response.status == HTTPStatus.PARTIAL_CONTENT:
+        size = int(response.headers[hdrs.CONTENT_RANGE].rsplit("/", 1)[1])
+        return content, size
+    # the server ignored Range and sent the whole file
+    return content[start:end + 1], len(content)
 
-def get_file_info(file_url: str) -> FileInfo:
-    with Session() as sess:
-        remote_file = _RemoteFile(sess, file_url)
-        mutagen_file = mutagen.File(remote_file, easy=True)
+
+def _get_file_info(fetch: RangeFetcher) -> FileInfo:
+    remote_file = RemoteFile(fetch)
+    mutagen_file = mutagen.File(remote_file, easy=True)
     return FileInfo(
         size=remote_file.size(),
         duration=int(mutagen_file.info.length),
         mime_type=mutagen_file.mime[0],
-        tags=mutagen_file.tags
+        tags=mutagen_file.tags,
+        probe=remote_file.stats
     )
+
+
+async def get_file_info(http: ClientSession, file_url: str) -> FileInfo:
+    loop = asyncio.get_running_loop()
+
+    # mutagen parses in a worker thread, its reads go back to the event loop
+    def fetch(start: int, end: int) -> Tuple[bytes, int]:
+        return asyncio.run_coroutine_threadsafe(
+            _fetch_range(http, file_url, start, end), loop
+        ).result()
+
+    started = time.perf_counter()
+    file_info = await asyncio.to_thread(_get_file_info, fetch)
+    PROBE_SECONDS.observe(time.perf_counter() - started)
+    PROBE_REQUESTS.inc(amount=file_info.probe.requests)
+    PROBE_BYTES.inc(amount=file_info.probe.bytes)
+    return file_info
@@ -0,0 +1,101 @@
+import asyncio
+import sqlite3
+
+from sqlalchemy import inspect, select, text
+
+from db import Catalog, CatalogKind, create_session
+
+
+# the catalog table as created before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE catalog (
+    id VARCHAR(11) NOT NULL,
+    parent_id VARCHAR(11),
+    filename VARCHAR(255) NOT NULL,
+    title VARCHAR(100),
+    description TEXT,
+    created DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL,
+    published DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL,
+    audio_size INTEGER,
+    audio_type VARCHAR(255),
+    duration INTEGER NOT NULL,
+    thumbnail_url VARCHAR(2083),
+    PRIMARY KEY (id),
+    FOREIGN KEY(parent_id) REFERENCES catalog (id)
+);
+CREATE INDEX ix_catalog_parent_id ON catalog (parent_id);
+CREATE INDEX ix_catalog_filename ON catalog (filename);
+CREATE INDEX ix_catalog_created ON catalog (created);
+INSERT INTO catalog (id, filename, title, duration)
+    VALUES ('video000001', 'video000001', 'Video', 60);
+INSERT INTO catalog (id, filename, thumbnail_url, duration)
+    VALUES ('book0000001', 'book0000001', 'audiobook.jpg', 0);
+INSERT INTO catalog (id, parent_id, filename, title, duration)
+    VALUES ('chapter0001', 'book0000001', '01.mp3', 'Chapter', 60);
+"""
+
+
+def test_upgrades_baseline_database(tmp_path):
+    location = tmp_path / "stethoscope.sqlite"
+    with sqlite3.connect(location) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+
+    async def upgrade():
+        db_session = await create_session(str(location))
+        async with db_session() as db:
+            items = {
+                item.id: item
+                for item in await db.scalars(select(Catalog))
+            }
+            indexes = await db.run_sync(
+                lambda session: {
+                    index["name"]
+                    for index in inspect(session.connection()).get_indexes("catalog")
+                }
+            )
+        return items, indexes
+
+    items, indexes = asyncio.run(upgrade())
+
+    assert items["video000001"].kind == CatalogKind.YOUTUBE
+    assert items["book0000001"].kind == CatalogKind.AUDIOBOOK
+    assert items["book0000001"].child_count == 1
+    assert items["chapter0001"].kind == CatalogKind.CHAPTER
+    assert items["chapter0001"].blob_hash is None
+    assert {
+        "ix_catalog_parent_kind_created_id",
+        "ix_catalog_parent_ready_created_id",
+        "ix_catalog_parent_filename",
+        "ix_catalog_blob_hash"
+    } <= indexes
+    assert "ix_catalog_parent_kind_created" not in indexes
+    with sqlite3.connect(location) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] > 0
+        # stored like bound datetimes, which keyset paging compares against
+        assert {
+            length for length, in conn.execute("SELECT length(created) FROM catalog")
+        } == {26}
+
+
+def test_reads_while_writing(tmp_path):
+    async def read_during_write():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            db.add(Catalog(id="video000001", filename="video000001"))
+        async with db_session.begin() as writer:
+            writer.add(Catalog(id="video000002", filename="video000002"))
+            await writer.flush()
+            # well within the busy timeout a blocked reader would wait out
+            async with asyncio.timeout(1), db_session() as reader:
+                during = (await reader.scalars(select(Catalog.id))).all()
+                journal_mode = await reader.scalar(text("PRAGMA journal_mode"))
+        async with db_session() as reader:
+            after = (await reader.scalars(select(Catalog.id))).all()
+        return journal_mode, during, after
+
+    journal_mode, during, after = asyncio.run(read_during_write())
+
+    assert journal_mode == "wal"
+    # the reader sees the last commit, not the open transaction
+    assert during == ["video000001"]
+    assert sorted(after) == ["video000001", "video000002"]
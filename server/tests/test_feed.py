@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime
+from xml.etree import ElementTree
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from db import Catalog, CatalogKind, create_session
+from view import FeedCache, FeedView
+
+
+def feed_app(db_session, feed_cache: FeedCache | None = None) -> web.Application:
+    feed_cache = feed_cache or FeedCache(db_session)
+    feed_view = FeedView(
+        "https://example.com",
+        "https://api.example.com",
+        db_session,
+        None,
+        feed_cache,
+        youtube_feed_limit=2
+    )
+    app = web.Application()
+    app.on_startup.append(feed_cache.start)
+    app.on_cleanup.append(feed_cache.stop)
+    app.router.add_get("/youtube/feed", feed_view.get_youtube_feed)
+    app.router.add_get("/book/{book_id}/feed", feed_view.get_audiobook_feed)
+    return app
+
+
+def test_rejects_invalid_feed_cursor(tmp_path):
+    async def request_feed():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with TestClient(TestServer(feed_app(db_session))) as client:
+            statuses = []
+            for cursor in ["!!!", "Zm9vYmFy"]:
+                async with asyncio.timeout(5):
+                    response = await client.get(
+                        "/youtube/feed", params={"cursor": cursor}
+                    )
+                statuses.append(response.status)
+            return statuses
+
+    assert asyncio.run(request_feed()) == [400, 400]
+
+
+def test_caches_feed_once_for_any_host_and_query(tmp_path):
+    async def request_feed():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            db.add(Catalog(id="video000001", filename="video000001", ready=True))
+        feed_cache = FeedCache(db_session)
+        async with TestClient(TestServer(feed_app(db_session, feed_cache))) as client:
+            bodies = []
+            for i in range(3):
+                response = await client.get(
+                    "/youtube/feed",
+                    params={"bench": str(i)},
+                    headers={"Host": f"host{i}.example.com"}
+                )
+                bodies.append(await response.text())
+            return bodies, len(feed_cache._feeds)
+
+    bodies, cached = asyncio.run(request_feed())
+
+    assert cached == 1
+    assert len(set(bodies)) == 1
+    assert "https://api.example.com/media/video000001" in bodies[0]
+
+
+def test_serves_same_validators_from_every_process(tmp_path):
+    async def request_feed():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            db.add(Catalog(id="video000001", filename="video000001", ready=True))
+        await FeedCache(db_session).invalidate("youtube")
+        validators = []
+        # one feed cache per worker process, rendering a second apart
+        for _ in range(2):
+            async with TestClient(TestServer(feed_app(db_session))) as client:
+                await (await client.get("/youtube/feed")).read()
+                response = await client.get("/youtube/feed")
+                validators.append(
+                    (response.headers["ETag"], response.headers["Last-Modified"])
+                )
+            await asyncio.sleep(1)
+        return validators
+
+    first, second = asyncio.run(request_feed())
+
+    assert first == second
+
+
+def test_cold_cache_answers_conditional_request(tmp_path):
+    async def request_feed():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            db.add(Catalog(id="video000001", filename="video000001", ready=True))
+        statuses = []
+        etag = None
+        # the second worker process hasn't rendered the feed yet
+        for _ in range(2):
+            async with TestClient(TestServer(feed_app(db_session))) as client:
+                response = await client.get(
+                    "/youtube/feed",
+                    headers={"If-None-Match": etag} if etag else None
+                )
+                await response.read()
+                statuses.append(response.status)
+                etag = response.headers["ETag"]
+        return statuses
+
+    assert asyncio.run(request_feed()) == [200, 304]
+
+
+def test_keeps_cached_feed_until_invalidation_commits(tmp_path):
+    async def invalidate():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        feed_cache = FeedCache(db_session)
+        async with db_session.begin() as db:
+            await feed_cache.invalidate("youtube", db)
+            uncommitted = feed_cache._generations["youtube"]
+        return uncommitted, feed_cache._generations["youtube"]
+
+    assert asyncio.run(invalidate()) == (0, 1)
+
+
+def test_lists_chapters_in_order_as_valid_xml(tmp_path):
+    async def request_feed():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            db.add(
+                Catalog(
+                    id="book0000001",
+                    filename="book0000001",
+                    title="Book\x1b[0m",
+                    kind=CatalogKind.AUDIOBOOK,
+                    ready=True
+                )
+            )
+            db.add_all(
+                Catalog(
+                    id=f"chapter000{i}",
+                    parent_id="book0000001",
+                    filename=f"{i:02}.mp3",
+                    title=f"Chapter {i}",
+                    published=datetime(2024, 1, 1),
+                    kind=CatalogKind.CHAPTER,
+                    ready=True
+                )
+                # the child count stays 0, pub dates go by the order alone
+                for i in [2, 1, 3]
+            )
+        async with TestClient(TestServer(feed_app(db_session))) as client:
+            response = await client.get("/book/book0000001/feed")
+            return await response.read()
+
+    channel = ElementTree.fromstring(asyncio.run(request_feed())).find("channel")
+
+    assert channel.findtext("title") == "Book[0m"
+    assert [
+        (item.findtext("title"), item.findtext("pubDate"))
+        for item in channel.iter("item")
+    ] == [
+        ("Chapter 1", "Mon, 01 Jan 2024 00:00:00 +0000"),
+        ("Chapter 2", "Mon, 01 Jan 2024 01:00:00 +0000"),
+        ("Chapter 3", "Mon, 01 Jan 2024 02:00:00 +0000")
+    ]
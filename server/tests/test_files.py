@@ -0,0 +1,190 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer, make_mocked_request
+from sqlalchemy import select
+
+from db import (
+    Blob, Catalog, CatalogKind, FeedVersion, Job, Subscription, create_session
+)
+from jobs import JobQueue
+from objectstore import blob_object_id
+from view import PURGE_JOB, SYNC_JOB, FeedCache, FilesView
+
+
+class ObjectStorage:
+    def __init__(self, rereferenced: str):
+        self.deleted = []
+        self.added_chapters = []
+        self.files_view = None
+        self._rereferenced = rereferenced
+
+    async def delete_objects(self, object_ids):
+        # a book re-uses the content while its object is deleted
+        self.added_chapters += await self.files_view._add_chapters(
+            "book0000001", [("01.mp3", self._rereferenced)]
+        )
+        self.deleted += object_ids
+        return {object_id: None for object_id in object_ids}
+
+    async def save_book_chapters(self, book_id, chapter_ids):
+        return {chapter_id: None for chapter_id in chapter_ids}
+
+    async def save_blobs(self, blob_hashes):
+        return {
+            blob_hash: f"https://upload/{blob_hash}" for blob_hash in blob_hashes
+        }
+
+
+def test_purges_blob_rows_after_their_objects(tmp_path):
+    hashes = [c * 64 for c in "abc"]
+
+    async def purge():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            db.add_all(
+                Blob(hash=blob_hash, ref_count=ref_count, ready=True)
+                for blob_hash, ref_count in zip(hashes, [0, 0, 1])
+            )
+            db.add(
+                Catalog(
+                    id="book0000001",
+                    filename="book0000001",
+                    kind=CatalogKind.AUDIOBOOK
+                )
+            )
+        object_storage = ObjectStorage(rereferenced=hashes[1])
+        files_view = object_storage.files_view = FilesView(
+            db_session,
+            object_storage,
+            FeedCache(db_session),
+            JobQueue(db_session, concurrency={})
+        )
+        await files_view._purge_objects(
+            {"object_ids": [blob_object_id(blob_hash) for blob_hash in hashes]}
+        )
+        async with db_session() as db:
+            blobs = {
+                blob.hash: blob for blob in await db.scalars(select(Blob))
+            }
+        return object_storage, blobs
+
+    object_storage, blobs = asyncio.run(purge())
+
+    # still referenced when the purge started
+    assert object_storage.deleted == [
+        blob_object_id(blob_hash) for blob_hash in hashes[:2]
+    ]
+    assert hashes[0] not in blobs
+    # referenced meanwhile, its content is stored again by the new chapter
+    assert [chapter["url"] for chapter in object_storage.added_chapters] == [
+        f"https://upload/{hashes[1]}"
+    ]
+    assert blobs[hashes[1]].ref_count == 1
+    assert not blobs[hashes[1]].ready
+    assert blobs[hashes[2]].ready
+
+
+def test_deleting_empty_book_invalidates_its_feed(tmp_path):
+    async def delete_book():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            db.add(
+                Catalog(
+                    id="book0000001",
+                    filename="book0000001",
+                    kind=CatalogKind.AUDIOBOOK
+                )
+            )
+        job_queue = JobQueue(db_session, concurrency={})
+        files_view = FilesView(db_session, None, FeedCache(db_session), job_queue)
+        await files_view.delete_file(
+            make_mocked_request(
+                "DELETE",
+                "/files/book0000001",
+                match_info={"file_id": "book0000001"}
+            )
+        )
+        async with db_session() as db:
+            versions = dict(
+                (await db.execute(select(FeedVersion.feed_id, FeedVersion.version)))
+                .all()
+            )
+            purge = await db.scalar(select(Job).where(Job.kind == PURGE_JOB))
+        return versions, purge.payload
+
+    versions, purge = asyncio.run(delete_book())
+
+    assert versions == {"book0000001": 1}
+    # no chapters, nothing stored
+    assert purge == {"object_ids": []}
+
+
+class Playlists:
+    def __init__(self, video_ids):
+        self.listed = []
+        self._video_ids = video_ids
+
+    async def list_youtube_videos(self, playlist_url):
+        self.listed.append(playlist_url)
+        if self._video_ids is None:
+            raise IOError("yt-dlp exited with 1: HTTP Error 503")
+        return self._video_ids
+
+
+def test_adds_playlist_from_channel_videos(tmp_path):
+    async def add_playlists():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        playlists = Playlists(["video000001"])
+        files_view = FilesView(
+            db_session,
+            playlists,
+            FeedCache(db_session),
+            JobQueue(db_session, concurrency={})
+        )
+        app = web.Application()
+        app.router.add_post("/files/youtube/playlist", files_view.add_youtube_playlist)
+        statuses = []
+        async with TestClient(TestServer(app)) as client:
+            for body in [
+                ["https://www.youtube.com/@channel"],
+                {"url": "https://www.youtube.com/@channel/playlists"},
+                {"url": "https://www.youtube.com/@channel"},
+                {"url": "https://www.youtube.com/channel/UC0123456789/streams"}
+            ]:
+                response = await client.post("/files/youtube/playlist", json=body)
+                statuses.append(response.status)
+        return statuses, playlists.listed
+
+    statuses, listed = asyncio.run(add_playlists())
+
+    assert statuses == [400, 400, 202, 202]
+    # a channel page lists its tabs, its videos tab lists the videos
+    assert listed == [
+        "https://www.youtube.com/@channel/videos",
+        "https://www.youtube.com/channel/UC0123456789/streams"
+    ]
+
+
+def test_failed_sync_queues_the_next_one(tmp_path):
+    async def sync():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            db.add(
+                Subscription(
+                    id="subscriptn1", url="https://www.youtube.com/@channel/videos"
+                )
+            )
+        files_view = FilesView(
+            db_session,
+            Playlists(None),
+            FeedCache(db_session),
+            JobQueue(db_session, concurrency={})
+        )
+        await files_view._sync_playlist("subscriptn1")
+        async with db_session() as db:
+            return (
+                await db.scalars(select(Job.key).where(Job.kind == SYNC_JOB))
+            ).all()
+
+    assert asyncio.run(sync()) == ["subscriptn1"]
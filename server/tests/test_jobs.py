@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+from db import Job, JobStatus, create_session
+from jobs import POLL_INTERVAL, JobQueue
+
+
+def test_limits_concurrency_across_queues(tmp_path):
+    async def run_jobs():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        running, peak, done = 0, 0, asyncio.Event()
+        finished = []
+
+        async def handler(payload):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.2)
+            running -= 1
+            finished.append(payload["n"])
+            if len(finished) == 6:
+                done.set()
+
+        # two worker processes sharing the database
+        queues = [
+            JobQueue(db_session, concurrency={"test": 2}) for _ in range(2)
+        ]
+        for queue in queues:
+            queue.register("test", handler)
+        for n in range(6):
+            await queues[0].submit("test", str(n), {"n": n})
+        for queue in queues:
+            await queue.start()
+        try:
+            await asyncio.wait_for(done.wait(), 30)
+        finally:
+            for queue in queues:
+                await queue.stop()
+        return peak, sorted(finished)
+
+    peak, finished = asyncio.run(run_jobs())
+
+    assert peak == 2
+    assert finished == list(range(6))
+
+
+def test_finished_job_has_last_progress(tmp_path):
+    async def run_job():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        queue = JobQueue(db_session, concurrency={"test": 1})
+
+        async def handler(payload):
+            # the second report comes too soon to be written while running
+            queue.report_progress({"downloaded": 1, "total": 2})
+            await asyncio.sleep(0)
+            queue.report_progress({"downloaded": 2, "total": 2})
+
+        queue.register("test", handler)
+        job_id = await queue.submit("test", "job", {})
+        await queue.start()
+        try:
+            async with asyncio.timeout(30):
+                async for job in queue.watch(job_id):
+                    pass
+        finally:
+            await queue.stop()
+        return job
+
+    job = asyncio.run(run_job())
+
+    assert job.status == JobStatus.DONE
+    assert job.progress == {"downloaded": 2, "total": 2}
+
+
+def test_stop_gives_back_the_attempt(tmp_path):
+    async def interrupt_job():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        queue = JobQueue(db_session, concurrency={"test": 1})
+        started = asyncio.Event()
+
+        async def handler(payload):
+            started.set()
+            await asyncio.sleep(60)
+
+        queue.register("test", handler)
+        job_id = await queue.submit("test", "job", {})
+        await queue.start()
+        async with asyncio.timeout(30):
+            await started.wait()
+        await queue.stop()
+        async with db_session() as db:
+            return await db.get(Job, job_id)
+
+    job = asyncio.run(interrupt_job())
+
+    assert job.status == JobStatus.PENDING
+    assert job.attempts == 0
+
+
+def test_job_submitted_in_transaction_starts_on_commit(tmp_path):
+    async def run_job():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        queue = JobQueue(db_session, concurrency={"test": 1})
+        done = asyncio.Event()
+
+        async def handler(payload):
+            done.set()
+
+        queue.register("test", handler)
+        await queue.start()
+        try:
+            # the worker is idle, waiting for a wake-up
+            await asyncio.sleep(0.1)
+            async with db_session.begin() as db:
+                await queue.submit("test", "job", {}, db=db)
+                # let a prematurely woken worker miss the uncommitted job
+                await asyncio.sleep(0.1)
+            started = time.perf_counter()
+            async with asyncio.timeout(30):
+                await done.wait()
+            return time.perf_counter() - started
+        finally:
+            await queue.stop()
+
+    # well within the poll interval
+    assert asyncio.run(run_job()) < POLL_INTERVAL.total_seconds() / 2
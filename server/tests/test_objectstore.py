@@ -0,0 +1,114 @@
+import asyncio
+from datetime import timedelta
+
+from aiohttp import ClientError, ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from bench.fake_oci import FakeObjectStorage
+import objectstore
+from objectstore import ObjectStore, _MultipartUpload
+
+
+OBJECT_PATH = "/p/par/n/bench/b/bucket/o/audio"
+
+
+async def upload(data: bytes, fail: bool = False):
+    storage = FakeObjectStorage()
+    storage._pars["par"] = "audio"
+    part_puts = []
+
+    @web.middleware
+    async def fail_first_put_of_part_2(request, handler):
+        if request.method == "PUT" and request.path.startswith("/u/"):
+            part_num = int(request.match_info["part_num"])
+            part_puts.append(part_num)
+            if part_puts.count(2) == 1 and part_num == 2:
+                raise web.HTTPServiceUnavailable()
+        return await handler(request)
+
+    app = storage.app()
+    app.middlewares.append(fail_first_put_of_part_2)
+    object_store = ObjectStore({}, http_retries=2)
+    async with TestServer(app) as server, ClientSession() as http:
+        object_store._http = http
+        stream = asyncio.StreamReader()
+        stream.feed_data(data)
+        stream.feed_eof()
+        try:
+            async with _MultipartUpload(
+                object_store._request,
+                str(server.make_url(OBJECT_PATH)),
+                "audio/mp4",
+                part_size=4,
+                parallelism=2
+            ) as multipart_upload:
+                size = await multipart_upload.write(stream)
+                if fail:
+                    raise IOError("yt-dlp failed")
+        except IOError:
+            size = None
+    return size, sorted(part_puts), storage
+
+
+def test_uploads_parts_retrying_failed_ones():
+    size, part_puts, storage = asyncio.run(upload(b"0123456789"))
+
+    assert size == 10
+    # the last part is short, part 2 is sent again after a 503
+    assert part_puts == [1, 2, 2, 3]
+    assert storage.objects == {"audio": b"0123456789"}
+    assert not storage._uploads
+
+
+def test_aborts_failed_upload():
+    size, part_puts, storage = asyncio.run(upload(b"0123456789", fail=True))
+
+    assert size is None
+    assert part_puts == [1, 2, 2, 3]
+    assert not storage.objects
+    assert not storage._uploads
+
+
+def test_falls_back_to_file_upload_on_upload_errors_only():
+    downloads = []
+
+    async def save(stream_error):
+        object_store = ObjectStore({}, stream_uploads=True)
+
+        async def stream(youtube_url, on_progress):
+            downloads.append("stream")
+            raise stream_error
+
+        async def upload_file(youtube_url, on_progress):
+            downloads.append("file")
+
+        object_store._stream_youtube_audio = stream
+        object_store._upload_youtube_audio_file = upload_file
+        try:
+            await object_store.save_youtube_audio("https://youtu.be/video000001")
+        except IOError:
+            pass
+
+    asyncio.run(save(ClientError()))
+    # a video yt-dlp can't get isn't downloaded again
+    asyncio.run(save(IOError("yt-dlp failed: Private video")))
+
+    assert downloads == ["stream", "file", "stream"]
+
+
+def test_fails_fast_while_oci_is_unreachable(monkeypatch):
+    monkeypatch.setattr(objectstore, "OCI_INIT_WAIT", timedelta(seconds=0.1))
+
+    async def get_url():
+        object_store = ObjectStore({})
+        # like _init_oci retrying against an unreachable endpoint
+        object_store._oci_init = asyncio.create_task(asyncio.sleep(60))
+        try:
+            async with asyncio.timeout(5):
+                await object_store.get_object_url("video000001")
+        except web.HTTPServiceUnavailable:
+            return True
+        finally:
+            object_store._oci_init.cancel()
+
+    assert asyncio.run(get_url())
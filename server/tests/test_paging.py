@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, null, select
+
+from db import Catalog, CatalogKind, create_session
+from view.paging import encode_cursor, newest_first
+
+
+def test_pages_rows_created_in_one_second(tmp_path):
+    async def page_all():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        async with db_session.begin() as db:
+            # one statement, like a playlist import, so the rows share a second
+            await db.execute(
+                insert(Catalog),
+                [
+                    {"id": f"video{i:06d}", "filename": f"video{i:06d}"}
+                    for i in range(7)
+                ]
+            )
+        async with db_session() as db:
+            pages, cursor = [], None
+            while True:
+                page = (
+                    await db.scalars(newest_first(select(Catalog), cursor).limit(3))
+                ).all()
+                if not page:
+                    return pages
+                pages.append([item.id for item in page])
+                cursor = encode_cursor(page[-1])
+                assert len(pages) < 10, "paging doesn't advance"
+
+    pages = asyncio.run(page_all())
+
+    ids = [item_id for page in pages for item_id in page]
+    assert sorted(ids) == [f"video{i:06d}" for i in range(7)]
+    assert len(ids) == len(set(ids))
+    assert [len(page) for page in pages] == [3, 3, 1]
+
+
+@pytest.mark.parametrize("kind", [None, CatalogKind.YOUTUBE])
+def test_pages_are_read_off_an_index(tmp_path, kind):
+    # like the files list, and the YouTube feed
+    query = select(Catalog).where(Catalog.parent_id == null()).where(Catalog.ready)
+    if kind:
+        query = query.where(Catalog.kind == kind)
+    cursor = encode_cursor(Catalog(id="video000001", created=datetime(2024, 1, 1)))
+
+    async def explain():
+        db_session = await create_session(str(tmp_path / "stethoscope.sqlite"))
+        plans = []
+        async with db_session() as db:
+            conn = await db.connection()
+            for page_cursor in [None, cursor]:
+                statement = newest_first(query, page_cursor).limit(3).compile(
+                    dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+                )
+                plan = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}")
+                plans.append(" ".join(row[-1] for row in plan))
+        return plans
+
+    for plan in asyncio.run(explain()):
+        assert "USING INDEX" in plan
+        assert "TEMP B-TREE" not in plan
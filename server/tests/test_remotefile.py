@@ -0,0 +1,95 @@
+import asyncio
+import struct
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+import mutagen
+from mutagen.easyid3 import EasyID3
+from mutagen.mp4 import MP4
+
+from remotefile import get_file_info
+
+
+# MPEG-1 layer III, 128 kbps, 44.1 kHz, 417 bytes a frame
+MP3_FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+# the start of the file, then the metadata further on
+MAX_PROBE_REQUESTS = 3
+
+
+def box(name: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload) + 8) + name + payload
+
+
+def write_mp3(path) -> None:
+    path.write_bytes(MP3_FRAME * 5000)
+    tags = EasyID3()
+    tags.update({"title": "Chapter 1", "album": "Book", "artist": "Author"})
+    tags.save(path)
+
+
+def write_m4a(path) -> None:
+    full = b"\x00\x00\x00\x00"
+    # 130 seconds at a 44.1 kHz timescale
+    mdhd = box(
+        b"mdhd", full + struct.pack(">4I2H", 0, 0, 44100, 44100 * 130, 0, 0)
+    )
+    hdlr = box(b"hdlr", full + bytes(4) + b"soun" + bytes(13))
+    path.write_bytes(
+        box(b"ftyp", b"M4A \x00\x00\x02\x00isomM4A ")
+        # the moov box after the audio, probing has to skip past it
+        + box(b"mdat", bytes(2 * 1024 * 1024))
+        + box(b"moov", box(b"trak", box(b"mdia", mdhd + hdlr)))
+    )
+    tags = MP4(path)
+    tags.add_tags()
+    tags.update({"\xa9nam": "Chapter 1", "\xa9alb": "Book", "\xa9ART": "Author"})
+    tags.save()
+
+
+def probe(path, ranges: bool = True):
+    async def get_info():
+        async def get_file(request):
+            if ranges:
+                return web.FileResponse(path)
+            return web.Response(body=path.read_bytes())
+
+        app = web.Application()
+        app.router.add_get("/audio", get_file)
+        async with TestServer(app) as server, ClientSession() as http:
+            return await get_file_info(http, str(server.make_url("/audio")))
+
+    return asyncio.run(get_info())
+
+
+def assert_probed(file_info, path):
+    local_file = mutagen.File(path, easy=True)
+    assert file_info.size == path.stat().st_size
+    assert file_info.duration == int(local_file.info.length) == 130
+    assert file_info.mime_type == local_file.mime[0]
+    assert file_info.tags["title"] == ["Chapter 1"]
+
+
+def test_probes_mp3_in_few_requests(tmp_path):
+    write_mp3(path := tmp_path / "chapter.mp3")
+
+    file_info = probe(path)
+
+    assert_probed(file_info, path)
+    assert file_info.probe.requests <= MAX_PROBE_REQUESTS
+
+
+def test_probes_m4a_in_few_requests(tmp_path):
+    write_m4a(path := tmp_path / "chapter.m4a")
+
+    file_info = probe(path)
+
+    assert_probed(file_info, path)
+    assert file_info.probe.requests <= MAX_PROBE_REQUESTS
+
+
+def test_probes_file_from_server_ignoring_range(tmp_path):
+    write_m4a(path := tmp_path / "chapter.m4a")
+
+    file_info = probe(path, ranges=False)
+
+    assert_probed(file_info, path)
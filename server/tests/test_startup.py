@@ -0,0 +1,25 @@
+import asyncio
+import os
+from unittest import mock
+
+from bench.startup import LAZY_IMPORTS, import_times, startup_times
+
+
+# the defaults of bench.startup
+IMPORT_BUDGET_MS = 1000
+STARTUP_BUDGET_MS = 1000
+
+
+def test_import_stays_lazy_and_within_budget():
+    imports = import_times()
+
+    assert not LAZY_IMPORTS & imports.keys()
+    assert imports["app"] / 1000 < IMPORT_BUDGET_MS
+
+
+def test_starts_within_budget():
+    # the benchmark points the app at its own database and object storage
+    with mock.patch.dict(os.environ):
+        startup = asyncio.run(startup_times())
+
+    assert startup["live_ms"] < STARTUP_BUDGET_MS
@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, UTC
+
+from aiohttp.test_utils import TestServer
+
+from bench.fake_oci import FakeObjectStorage
+from bench.fake_yt_dlp import playlist_video_ids, synthetic_m4a
+from objectstore import YoutubeAudio, _youtube_audio
+from ytdlppool import YtDlpPool
+
+
+EXTRACTOR = "bench.fake_extractor:FakeYoutubeIE"
+PLAYLIST_URL = "https://www.youtube.com/playlist?list=PL0123456789"
+AUDIO_SIZE = 256 * 1024
+
+
+def worker_pids(pool: YtDlpPool):
+    return {worker._process.pid for worker in pool._workers}
+
+
+async def wait_for_workers(pool: YtDlpPool, count: int = 1):
+    # started in the background, they take a while to import yt-dlp
+    async with asyncio.timeout(60):
+        while len(pool._workers) < count:
+            await asyncio.sleep(0.1)
+
+
+def test_recycles_worker_after_max_jobs():
+    async def list_videos():
+        pool = YtDlpPool(1, {}, extractor=EXTRACTOR, max_jobs=2)
+        await pool.start()
+        pids = []
+        try:
+            for _ in range(3):
+                await wait_for_workers(pool)
+                pids.append(worker_pids(pool))
+                video_ids = await pool.list_videos(PLAYLIST_URL)
+        finally:
+            await pool.close()
+        return pids, video_ids
+
+    pids, video_ids = asyncio.run(list_videos())
+
+    assert pids[0] == pids[1] != pids[2]
+    assert video_ids == playlist_video_ids(PLAYLIST_URL)
+
+
+def test_replaces_crashed_worker():
+    async def list_videos():
+        pool = YtDlpPool(1, {}, extractor=EXTRACTOR)
+        await pool.start()
+        try:
+            await wait_for_workers(pool)
+            crashed = worker_pids(pool)
+            for worker in pool._workers:
+                worker._process.kill()
+                worker._process.join()
+            try:
+                await pool.list_videos(PLAYLIST_URL)
+            except OSError:
+                pass
+            await wait_for_workers(pool)
+            video_ids = await pool.list_videos(PLAYLIST_URL)
+            return crashed, worker_pids(pool), video_ids
+        finally:
+            await pool.close()
+
+    crashed, replaced, video_ids = asyncio.run(list_videos())
+
+    assert crashed != replaced
+    assert video_ids == playlist_video_ids(PLAYLIST_URL)
+
+
+def test_downloads_youtube_audio(monkeypatch):
+    monkeypatch.setenv("FAKE_YT_DLP_SIZE", str(AUDIO_SIZE))
+
+    async def download():
+        async with TestServer(FakeObjectStorage().app()) as server:
+            # the workers get the environment at spawn
+            monkeypatch.setenv("FAKE_YT_DLP_URL", str(server.make_url("")))
+            pool = YtDlpPool(1, {}, extractor=EXTRACTOR)
+            await pool.start()
+            progress = []
+            try:
+                async with pool.download(
+                    "https://youtu.be/video000001",
+                    None,
+                    lambda downloaded, total: progress.append(downloaded)
+                ) as run:
+                    info = await run.info
+                    audio = await run.stdout.read()
+                    await run.wait()
+            finally:
+                await pool.close()
+        return info, audio, progress
+
+    info, audio, progress = asyncio.run(download())
+
+    assert audio == synthetic_m4a(AUDIO_SIZE)
+    assert progress[-1] == AUDIO_SIZE
+    assert _youtube_audio(info, len(audio)) == YoutubeAudio(
+        id="video000001",
+        title="Video video000001",
+        description="Synthetic video video000001",
+        duration=600,
+        size=AUDIO_SIZE,
+        published=datetime.fromtimestamp(info["epoch"], UTC),
+        thumbnail_url="https://i.ytimg.com/vi/video000001/hqdefault.jpg",
+        mime_type="audio/mp4"
+    )
@@ -1,2 +1,3 @@
 from .feed import FeedView
-from .files import FilesView
+from .feedcache import FeedCache
+from .files import BOOK_JOB, PURGE_JOB, SYNC_JOB, YOUTUBE_JOB, FilesView
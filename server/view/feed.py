@@ -1,72 +1,139 @@
 from datetime import datetime, timedelta, timezone
-from typing import AsyncIterable, Callable
+from typing import AsyncIterable, AsyncIterator, Callable
 from urllib.parse import quote
 
 from aiohttp import web
-from feedgen.feed import FeedGenerator
+from yarl import URL
 from sqlalchemy import null, select
-from sqlalchemy.ext.asyncio import async_sessionmaker
 
-from db import Catalog
-from objectstore import ObjectStore
+from db import Catalog, CatalogKind, SessionFactory
+from mediacache import MediaCache
+from objectstore import ObjectStore, blob_object_id
+from .feedcache import YOUTUBE_FEED, FeedCache
+from .paging import decode_cursor, encode_cursor, newest_first
+from .rss import rss_channel, rss_end, rss_item
+
+
+FEED_CHUNK_SIZE = 16 * 1024
 
 
 class FeedView:
     def __init__(
         self,
         website: str,
-        db_session: async_sessionmaker,
-        object_store: ObjectStore
+        api_url: str,
+        db_session: SessionFactory,
+        object_store: ObjectStore,
+        feed_cache: FeedCache,
+        youtube_feed_limit: int = 100,
+        media_cache: MediaCache | None = None
     ):
         self._website = website
+        # links don't depend on the request, so one cached feed serves all
+        self._api_url = URL(api_url)
         self._db_session = db_session
         self._object_store = object_store
+        self._feed_cache = feed_cache
+        self._youtube_feed_limit = youtube_feed_limit
+        self._media_cache = media_cache
+
+    async def get_youtube_feed(
+            self, request: web.Request
+    ) -> web.StreamResponse:
+        cursor = request.query.get("cursor")
+        return await self._feed_cache.respond(
+            YOUTUBE_FEED,
+            request,
+            lambda last_build: self._render_youtube_feed(cursor, last_build),
+            variant=decode_cursor(cursor) if cursor else None
+        )
+
+    async def get_audiobook_feed(
+            self, request: web.Request
+    ) -> web.StreamResponse:
+        book_id = request.match_info["book_id"]
+        return await self._feed_cache.respond(
+            book_id,
+            request,
+            lambda last_build: self._render_audiobook_feed(book_id, last_build)
+        )
+
+    async def get_media_url(self, request: web.Request):
+        episode_id = request.match_info["episode_id"]
+        if self._media_cache:
+            return await self._media_cache.respond(episode_id, request)
+        media_link = await self._object_store.get_object_url(episode_id)
 
-    async def get_youtube_feed(self, request: web.Request) -> web.Response:
+        raise web.HTTPPermanentRedirect(media_link)
+
+    async def _render_youtube_feed(
+            self, cursor: str | None, last_build: datetime
+    ) -> AsyncIterator[bytes]:
         def media_link(episode):
-            return str(
-                request.url
-                .with_scheme("https")
-                .with_path(f"/media/{episode.id}")
-            )
+            return str(self._api_url.with_path(f"/media/{episode.id}"))
 
         def pub_date(_, episode):
             return episode.published.replace(
                 tzinfo=timezone.utc
             )
 
-        podcast = FeedGenerator()
-        podcast.load_extension("podcast")
-        podcast.link(href=self._website, rel="self")
-        podcast.title("Leonid's Stethoscope")
-        podcast.description("Turns Youtube videos into podcast")
-        podcast.logo(f"{self._website}/logo.jpg")
-
-        async with self._db_session() as db:
-            items = await db.stream_scalars(
+        async def first_page(
+                items: AsyncIterable[Catalog]
+        ) -> AsyncIterator[Catalog]:
+            nonlocal next_link
+            count, last_item = 0, None
+            async for item in items:
+                if count == self._youtube_feed_limit:
+                    next_link = str(
+                        self._api_url
+                        .with_path("/youtube/feed")
+                        .with_query(cursor=encode_cursor(last_item))
+                    )
+                    return
+                yield item
+                count, last_item = count + 1, item
+
+        next_link = None
+        # a bad cursor fails the request before the response is prepared
+        query = (
+            newest_first(
                 select(Catalog)
                 .where(Catalog.parent_id == null())
-                .where(~Catalog.children.any())
-                .order_by(Catalog.created)
+                .where(Catalog.kind == CatalogKind.YOUTUBE)
+                .where(Catalog.ready),
+                cursor
             )
-            await self._add_episodes(
-                podcast, items, pub_date, media_link
-            )
-
-        return web.Response(
-            body=podcast.rss_str(),
-            content_type="application/rss+xml"
+            # one more item tells whether there's a next page
+            .limit(self._youtube_feed_limit + 1)
         )
+        yield rss_channel(
+            title="Leonid's Stethoscope",
+            description="Turns Youtube videos into podcast",
+            link=self._website,
+            logo=f"{self._website}/logo.jpg",
+            last_build=last_build
+        )
+
+        async with self._db_session() as db:
+            items = await db.stream_scalars(query)
+            async for chunk in _render_episodes(
+                first_page(items), pub_date, media_link
+            ):
+                yield chunk
 
-    async def get_audiobook_feed(self, request: web.Request) -> web.Response:
+        yield rss_end(next_link)
+
+    async def _render_audiobook_feed(
+            self, book_id: str, last_build: datetime
+    ) -> AsyncIterator[bytes]:
         def media_link(episode):
-            media_id = quote(
-                f"{episode.parent_id}/{episode.id}", safe=""
-            )
+            if episode.blob_hash:
+                object_id = blob_object_id(episode.blob_hash)
+            else:
+                object_id = f"{episode.parent_id}/{episode.id}"
+            media_id = quote(object_id, safe="")
             return str(
-                request.url
-                .with_scheme("https")
-                .with_path(f"/media/{media_id}", encoded=True)
+                self._api_url.with_path(f"/media/{media_id}", encoded=True)
             )
 
         def pub_date(idx, episode):
@@ -75,54 +142,51 @@ class FeedView:
             )
             return published + timedelta(hours=idx)
 
-        book_id = request.match_info["book_id"]
         async with self._db_session() as db:
             book = await db.get(Catalog, book_id)
-            podcast = FeedGenerator()
-            podcast.load_extension("podcast")
-            podcast.link(href=self._website, rel="self")
-            podcast.title(book.title)
-            podcast.description(book.description)
+            if not book:
+                raise web.HTTPNotFound(text=f"Book '{book_id}' not found")
+            yield rss_channel(
+                title=book.title,
+                description=book.description,
+                link=self._website,
+                last_build=last_build
+            )
             items = await db.stream_scalars(
                 select(Catalog)
                 .where(Catalog.parent_id == book_id)
                 .order_by(Catalog.filename)
             )
-            await self._add_episodes(
-                podcast, items, pub_date, media_link
-            )
-
-        return web.Response(
-            body=podcast.rss_str(),
-            content_type="application/rss+xml"
+            async for chunk in _render_episodes(items, pub_date, media_link):
+                yield chunk
+
+        yield rss_end()
+
+
+async def _render_episodes(
+        items: AsyncIterable[Catalog],
+        pub_date_maker: Callable[[int, Catalog], datetime],
+        media_link_maker: Callable[[Catalog], str]
+) -> AsyncIterator[bytes]:
+    chunk = bytearray()
+    idx = 0
+    async for i in items:
+        chunk += rss_item(
+            guid=i.id,
+            title=i.title,
+            description=i.description,
+            published=pub_date_maker(idx, i),
+            media_link=media_link_maker(i),
+            media_size=i.audio_size,
+            media_type=i.audio_type,
+            duration=i.duration
         )
-
-    async def get_media_url(self, request: web.Request):
-        episode_id = request.match_info["episode_id"]
-        media_link = await self._object_store.get_object_url(episode_id)
-
-        raise web.HTTPPermanentRedirect(media_link)
-
-    @staticmethod
-    async def _add_episodes(
-            podcast: FeedGenerator,
-            items: AsyncIterable[Catalog],
-            pub_date_maker: Callable[[int, Catalog], datetime],
-            media_link_maker: Callable[[Catalog], str]
-    ):
-        idx = 0
-        async for i in items:
-            episode = podcast.add_entry()
-            episode.id(i.id)
-            episode.title(i.title)
-            episode.description(i.description)
-            episode.published(pub_date_maker(idx, i))
-            episode.enclosure(
-                url=media_link_maker(i),
-                length=i.audio_size,
-                type=i.audio_type
-            )
-            episode.podcast.itunes_duration(i.duration)
-            # TODO episode.podcast.itunes_image(i.thumbnail_url)
-
-            idx += 1
+        # TODO itunes:image from i.thumbnail_url
+        # a write per item would be too chatty
+        if len(chunk) >= FEED_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+
+        idx += 1
+    if chunk:
+        yield bytes(chunk)
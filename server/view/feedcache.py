@@ -0,0 +1,284 @@
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, UTC
+import hashlib
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Tuple
+from wsgiref.handlers import format_date_time
+
+from aiohttp import hdrs, web
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import ExpiringLRUCache, Notifier
+from compression import (
+    GZIP, MIN_COMPRESS_SIZE, accepted_encoding, compress_async
+)
+from db import FeedVersion, SessionFactory, utcnow
+
+
+YOUTUBE_FEED = "youtube"
+VERSION_POLL_INTERVAL = timedelta(seconds=1)
+FEED_CACHE_SIZE = 256
+# feeds change through invalidation, this only ages out unpopular pages
+FEED_TTL = timedelta(days=1)
+
+# renders the feed as last changed at the given time
+FeedRenderer = Callable[[datetime], AsyncIterator[bytes]]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachedFeed:
+    body: bytes
+    etag: str
+    last_modified: datetime
+    # compressed once, then served to every client accepting the encoding
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    async def encode(self, encoding: str) -> bytes:
+        if (body := self.encoded.get(encoding)) is None:
+            body = self.encoded[encoding] = await compress_async(
+                self.body, encoding
+            )
+        return body
+
+
+class FeedCache:
+    def __init__(
+            self,
+            db_session: SessionFactory,
+            poll_interval: timedelta = VERSION_POLL_INTERVAL,
+            max_size: int = FEED_CACHE_SIZE
+    ):
+        self._db_session = db_session
+        self._poll_interval = poll_interval
+        # keyed by feed, generation and variant, older generations age out
+        self._feeds = ExpiringLRUCache[CachedFeed](max_size)
+        self._generations: Dict[str, int] = defaultdict(int)
+        self._renders: Dict[Tuple[str, int, Hashable], _FeedRender] = {}
+        # last seen database versions, other worker processes bump them too
+        self._versions: Dict[str, int] = {}
+        self._poller: asyncio.Task | None = None
+
+    async def start(self, _=None) -> None:
+        await self._sync_versions()
+        self._poller = asyncio.create_task(self._poll_versions())
+
+    async def stop(self, _=None) -> None:
+        self._poller.cancel()
+
+    async def respond(
+            self,
+            feed_id: str,
+            request: web.Request,
+            render: FeedRenderer,
+            variant: Hashable = None
+    ) -> web.StreamResponse:
+        # the variant tells apart renders of one feed, e.g. its pages
+        key = (feed_id, self._generations[feed_id], variant)
+        if feed := self._feeds.get(key):
+            return await feed_response(request, feed)
+
+        if not (feed_render := self._renders.get(key)):
+            feed_render = _FeedRender(self._validators(feed_id, variant), render)
+            self._renders[key] = feed_render
+            feed_render.task.add_done_callback(
+                lambda _: self._rendered(key, feed_render)
+            )
+        # concurrent requests for the same feed stream the one render
+        return await feed_render.stream_to(request)
+
+    async def invalidate(
+            self, feed_id: str, db: AsyncSession | None = None
+    ) -> None:
+        if not db:
+            async with self._db_session.begin() as db:
+                await self.invalidate(feed_id, db)
+            return
+
+        version = await db.scalar(
+            insert(FeedVersion)
+            .values(feed_id=feed_id, version=1, updated=utcnow())
+            .on_conflict_do_update(
+                index_elements=[FeedVersion.feed_id],
+                set_={"version": FeedVersion.version + 1, "updated": utcnow()}
+            )
+            .returning(FeedVersion.version)
+        )
+
+        def invalidated(_) -> None:
+            self._versions[feed_id] = version
+            self._drop(feed_id)
+
+        # dropped once the change is visible, a render started earlier would
+        # cache the old feed under the new generation
+        event.listen(db.sync_session, "after_commit", invalidated, once=True)
+
+    def _drop(self, feed_id: str) -> None:
+        self._generations[feed_id] += 1
+
+    async def _validators(
+            self, feed_id: str, variant: Hashable
+    ) -> Tuple[str, datetime]:
+        # shared by the worker processes, so they send the same validators,
+        # known before the feed is rendered
+        async with self._db_session() as db:
+            feed_version = await db.get(FeedVersion, feed_id)
+        # feeds never written to
+        version, updated = (
+            (feed_version.version, feed_version.updated)
+            if feed_version else (0, datetime(1970, 1, 1))
+        )
+        etag = hashlib.blake2b(
+            repr((feed_id, version, variant)).encode(), digest_size=16
+        ).hexdigest()
+        return etag, updated.replace(tzinfo=UTC, microsecond=0)
+
+    async def _poll_versions(self) -> None:
+        while True:
+            await asyncio.sleep(self._poll_interval.total_seconds())
+            try:
+                await self._sync_versions()
+            except Exception:
+                logger.warning("Couldn't poll feed versions", exc_info=True)
+
+    async def _sync_versions(self) -> None:
+        async with self._db_session() as db:
+            versions = (
+                await db.execute(select(FeedVersion.feed_id, FeedVersion.version))
+            ).all()
+        for feed_id, version in versions:
+            # the first sync, before polling starts, only learns the versions
+            if self._poller and self._versions.get(feed_id) != version:
+                self._drop(feed_id)
+            self._versions[feed_id] = version
+
+    def _rendered(
+            self, key: Tuple[str, int, Hashable], feed_render: "_FeedRender"
+    ) -> None:
+        del self._renders[key]
+        if feed_render.task.cancelled() or feed_render.task.exception():
+            return
+        feed_id, generation, _ = key
+        # don't store a feed rendered from data changed in the meantime
+        if self._generations[feed_id] == generation:
+            self._feeds.put(
+                key,
+                CachedFeed(
+                    body=b"".join(feed_render.chunks),
+                    etag=feed_render.etag,
+                    last_modified=feed_render.last_modified
+                ),
+                FEED_TTL.total_seconds()
+            )
+
+
+class _FeedRender:
+    def __init__(
+            self,
+            validators: Awaitable[Tuple[str, datetime]],
+            render: FeedRenderer
+    ):
+        self.chunks: List[bytes] = []
+        # known once the first chunk is out
+        self.etag: str | None = None
+        self.last_modified: datetime | None = None
+        self._progress = Notifier()
+        self.task = asyncio.create_task(self._render(validators, render))
+
+    async def stream_to(self, request: web.Request) -> web.StreamResponse:
+        chunks = self._stream()
+        # errors raised before the first chunk, e.g. 404, are still sent as is
+        first_chunk = await anext(chunks, b"")
+
+        encoding = accepted_encoding(request, [GZIP])
+        etag = f"{self.etag}-{encoding}" if encoding else self.etag
+        _check_not_modified(request, etag, self.last_modified)
+
+        response = web.StreamResponse(headers={hdrs.VARY: hdrs.ACCEPT_ENCODING})
+        response.content_type = "application/rss+xml"
+        response.etag = etag
+        response.last_modified = self.last_modified
+        # compressed on the fly, chunk by chunk
+        if encoding:
+            response.enable_compression(web.ContentCoding.gzip)
+        await response.prepare(request)
+        await response.write(first_chunk)
+        async for chunk in chunks:
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def _render(
+            self,
+            validators: Awaitable[Tuple[str, datetime]],
+            render: FeedRenderer
+    ) -> None:
+        try:
+            self.etag, self.last_modified = await validators
+            async for chunk in render(self.last_modified):
+                self.chunks.append(chunk)
+                self._progress.notify()
+        finally:
+            self._progress.notify()
+
+    async def _stream(self) -> AsyncIterator[bytes]:
+        sent = 0
+        while True:
+            progress = self._progress.waiter()
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.task.done():
+                if sent == len(self.chunks):
+                    # re-raises a render error
+                    self.task.result()
+                    return
+            else:
+                await progress.wait()
+
+
+async def feed_response(
+        request: web.Request, feed: CachedFeed
+) -> web.Response:
+    encoding = None
+    if len(feed.body) >= MIN_COMPRESS_SIZE:
+        encoding = accepted_encoding(request)
+    # each encoding is a representation of its own
+    etag = f"{feed.etag}-{encoding}" if encoding else feed.etag
+    _check_not_modified(request, etag, feed.last_modified)
+
+    response = web.Response(
+        body=await feed.encode(encoding) if encoding else feed.body,
+        content_type="application/rss+xml",
+        headers={hdrs.VARY: hdrs.ACCEPT_ENCODING}
+    )
+    if encoding:
+        response.headers[hdrs.CONTENT_ENCODING] = encoding
+    response.etag = etag
+    response.last_modified = feed.last_modified
+    return response
+
+
+def _check_not_modified(
+        request: web.Request, etag: str, last_modified: datetime
+) -> None:
+    if (if_none_match := request.if_none_match) is not None:
+        not_modified = any(e.value in (etag, "*") for e in if_none_match)
+    elif (if_modified_since := request.if_modified_since) is not None:
+        not_modified = last_modified <= if_modified_since
+    else:
+        not_modified = False
+
+    if not_modified:
+        raise web.HTTPNotModified(
+            headers={
+                hdrs.ETAG: f'"{etag}"',
+                hdrs.VARY: hdrs.ACCEPT_ENCODING,
+                hdrs.LAST_MODIFIED: format_date_time(last_modified.timestamp())
+            }
+        )
@@ -1,58 +1,108 @@
 import asyncio
+from collections import Counter
+from datetime import timedelta
 from http import HTTPStatus
+import json
+import logging
 import re
+from typing import Any, Dict, Iterable, List, Tuple
 
-from aiohttp import web
+from aiohttp import hdrs, web
 import nanoid
-from sqlalchemy import desc, func, null, select
-from sqlalchemy.orm import aliased, joinedload
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy import bindparam, delete, null, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
-from db import Catalog
-from objectstore import ObjectStore
-from remotefile import get_file_info
+from db import (
+    Blob, Catalog, CatalogKind, Job, JobStatus, SessionFactory, Subscription,
+    utcnow
+)
+from jobs import JobQueue
+from objectstore import BLOB_PREFIX, ObjectStore, blob_object_id
+from remotefile import FileInfo
+from .feedcache import YOUTUBE_FEED, FeedCache
+from .paging import encode_cursor, newest_first, page_size
 
 
 YOUTUBE_REGEX = re.compile(r"(?:v=|/)([0-9A-Za-z_-]{11}).*")
+YOUTUBE_PLAYLIST_REGEX = re.compile(
+    r"https://(?:www\.|m\.)?youtube\.com/"
+    r"(?:playlist\?list=[0-9A-Za-z_-]+"
+    r"|(?P<channel>(?:@|channel/|c/|user/)[^/?#\s]+)(?P<tab>/videos|/streams)?/?)"
+)
+BLOB_HASH_REGEX = re.compile(r"[0-9a-f]{64}")
+YOUTUBE_JOB = "youtube"
+BOOK_JOB = "book"
+PURGE_JOB = "purge"
+SYNC_JOB = "sync"
+MAX_CHAPTERS_PER_REQUEST = 1000
+
+logger = logging.getLogger(__name__)
 
 
 class FilesView:
     def __init__(
             self,
-            db_session: async_sessionmaker,
-            object_store: ObjectStore
+            db_session: SessionFactory,
+            object_store: ObjectStore,
+            feed_cache: FeedCache,
+            job_queue: JobQueue,
+            probe_concurrency: int = 8,
+            sync_interval: timedelta = timedelta(hours=1)
     ):
         self._db_session = db_session
         self._object_store = object_store
+        self._feed_cache = feed_cache
+        self._job_queue = job_queue
+        self._probe_concurrency = probe_concurrency
+        self._sync_interval = sync_interval
+        job_queue.register(
+            YOUTUBE_JOB, lambda job: self._save_youtube_audio(job["url"])
+        )
+        job_queue.register(
+            BOOK_JOB, lambda job: self._tag_book(job["book_id"])
+        )
+        job_queue.register(PURGE_JOB, self._purge_objects)
+        job_queue.register(
+            SYNC_JOB, lambda job: self._sync_playlist(job["subscription_id"])
+        )
 
     async def list_files(self, request: web.Request) -> web.Response:
+        limit = page_size(request)
         async with self._db_session() as db:
-            catalog_parent = aliased(Catalog, name="catalog_parent")
-            catalog_items = (
-                select(catalog_parent, func.count(Catalog.id) == 0)
-                .outerjoin(Catalog, catalog_parent.id == Catalog.parent_id)
+            catalog_items = newest_first(
+                select(Catalog)
                 # exclude book chapters
-                .where(catalog_parent.parent_id == null())
+                .where(Catalog.parent_id == null())
                 # exclude not fully downloaded/uploaded files
-                .where(catalog_parent.title != null())
-                .group_by(catalog_parent.id)
-                .order_by(desc(catalog_parent.created))
+                .where(Catalog.ready),
+                request.query.get("cursor")
             )
             if ids := request.query.getall("id", []):
-                catalog_items = catalog_items.having(catalog_parent.id.in_(ids))
-            files = [
-                {
-                    "id": item.id,
-                    "title": item.title,
-                    "description": item.description,
-                    "thumbnail": item.thumbnail_url,
-                    "duration": item.duration,
-                    "type": "youtube" if is_youtube else "audiobook"
-                }
-                async for item, is_youtube in await db.stream(catalog_items)
-            ]
+                catalog_items = catalog_items.where(Catalog.id.in_(ids))
+            if limit:
+                # one more item tells whether there's a next page
+                catalog_items = catalog_items.limit(limit + 1)
+            items = (await db.scalars(catalog_items)).all()
+
+        next_cursor = None
+        if limit and len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(items[-1])
+        files = [
+            {
+                "id": item.id,
+                "title": item.title,
+                "description": item.description,
+                "thumbnail": item.thumbnail_url,
+                "duration": item.duration,
+                "type": item.kind
+            }
+            for item in items
+        ]
 
-        return web.json_response({"files": files})
+        return web.json_response({"files": files, "next": next_cursor})
 
     async def delete_file(self, request: web.Request) -> web.Response:
         parent_id = request.match_info["file_id"]
@@ -62,43 +112,51 @@ class FilesView:
                 parent_id,
                 options=[joinedload(Catalog.children)]
             )
+            if not parent:
+                raise web.HTTPNotFound(text=f"File '{parent_id}' not found")
 
-            async with asyncio.TaskGroup() as tg:
-                if parent.children:
-                    for child in parent.children:
-                        tg.create_task(
-                            self._object_store.delete_object(
-                                f"{parent_id}/{child.id}"
-                            )
-                        )
-                else:
-                    tg.create_task(
-                        self._object_store.delete_object(parent_id)
+            # a book may have no chapters yet
+            if parent.kind == CatalogKind.AUDIOBOOK:
+                object_ids = [
+                    f"{parent_id}/{child.id}"
+                    for child in parent.children
+                    if not child.blob_hash
+                ]
+                blob_refs = Counter(
+                    child.blob_hash
+                    for child in parent.children
+                    if child.blob_hash
+                )
+                if blob_refs:
+                    blobs = Blob.__table__
+                    await db.execute(
+                        update(blobs)
+                        .where(blobs.c.hash == bindparam("blob_hash"))
+                        .values(ref_count=blobs.c.ref_count - bindparam("refs"))
+                        .execution_options(synchronize_session=False),
+                        [
+                            {"blob_hash": blob_hash, "refs": refs}
+                            for blob_hash, refs in blob_refs.items()
+                        ]
                     )
+                    # purged once no other book references them
+                    object_ids += map(blob_object_id, blob_refs)
+            else:
+                object_ids = [parent_id]
             await db.delete(parent)
+            # objects are purged in the background, the job keeps leftovers
+            await self._job_queue.submit(
+                PURGE_JOB, parent_id, {"object_ids": object_ids}, db=db
+            )
+            await self._feed_cache.invalidate(
+                parent_id
+                if parent.kind == CatalogKind.AUDIOBOOK else YOUTUBE_FEED,
+                db
+            )
 
         return web.json_response({"id": parent_id})
 
     async def add_youtube(self, request: web.Request) -> web.Response:
-        async def save_audio() -> None:
-            yt_audio = await self._object_store.save_youtube_audio(
-                youtube_url
-            )
-
-            video = Catalog(
-                id=yt_audio.id,
-                title=yt_audio.title,
-                description=yt_audio.description,
-                filename=yt_audio.id,
-                published=yt_audio.published,
-                duration=yt_audio.duration,
-                thumbnail_url=yt_audio.thumbnail_url,
-                audio_size=yt_audio.size,
-                audio_type=yt_audio.mime_type
-            )
-            async with self._db_session.begin() as db:
-                db.add(video)
-
         youtube_url = (await request.json())["url"]
         if video_id := re.search(YOUTUBE_REGEX, youtube_url):
             video_id = video_id[1]
@@ -107,15 +165,76 @@ class FilesView:
 
         async with self._db_session() as db:
             existing_video = await db.get(Catalog, video_id)
+            queued_video = await db.scalar(
+                select(Job.id)
+                .where(Job.kind == YOUTUBE_JOB)
+                .where(Job.key == video_id)
+                .where(Job.status.in_([JobStatus.PENDING, JobStatus.RUNNING]))
+            )
         if existing_video:
             raise web.HTTPConflict(text="Link already downloaded")
+        if queued_video:
+            raise web.HTTPConflict(text="Link already queued")
 
-        asyncio.create_task(save_audio())
+        job_id = await self._job_queue.submit(
+            YOUTUBE_JOB, video_id, {"url": youtube_url}
+        )
         return web.json_response(
-            {"id": video_id, "type": "youtube"},
+            {"id": video_id, "type": "youtube", "job": job_id},
             status=HTTPStatus.ACCEPTED
         )
 
+    async def add_youtube_playlist(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="Expected a JSON object")
+        playlist_url = body.get("url")
+        if not isinstance(playlist_url, str) or not (
+            match := re.fullmatch(YOUTUBE_PLAYLIST_REGEX, playlist_url)
+        ):
+            raise web.HTTPBadRequest(text="Invalid YouTube playlist or channel link")
+        if match["channel"] and not match["tab"]:
+            # the channel page itself lists its tabs, not its videos
+            playlist_url = f"https://www.youtube.com/{match['channel']}/videos"
+        try:
+            video_ids = await self._object_store.list_youtube_videos(playlist_url)
+        except IOError:
+            raise web.HTTPBadRequest(text="Couldn't list the playlist")
+
+        subscription_id = None
+        async with self._db_session.begin() as db:
+            accepted, skipped = await self._submit_videos(
+                db, video_ids, [JobStatus.PENDING, JobStatus.RUNNING]
+            )
+            if body.get("sync"):
+                subscription_id = await self._subscribe(db, playlist_url)
+
+        # the downloads are bounded by the YOUTUBE_JOBS workers
+        return web.json_response(
+            {
+                "accepted": [
+                    {"id": video_id, "job": job_id}
+                    for video_id, job_id in accepted.items()
+                ],
+                "skipped": skipped,
+                "subscription": subscription_id
+            },
+            status=HTTPStatus.ACCEPTED
+        )
+
+    async def delete_subscription(self, request: web.Request) -> web.Response:
+        subscription_id = request.match_info["subscription_id"]
+        async with self._db_session.begin() as db:
+            deleted = await db.execute(
+                delete(Subscription).where(Subscription.id == subscription_id)
+            )
+        if deleted.rowcount == 0:
+            raise web.HTTPNotFound(
+                text=f"Subscription '{subscription_id}' not found"
+            )
+        # its pending sync finds nothing to do
+        return web.json_response({"id": subscription_id})
+
     async def start_book_upload(self, _: web.Request) -> web.Response:
         book_id = nanoid.generate(size=11)
         async with self._db_session.begin() as db:
@@ -123,7 +242,8 @@ class FilesView:
                 Catalog(
                     id=book_id,
                     filename=book_id,
-                    thumbnail_url="audiobook.jpg"
+                    thumbnail_url="audiobook.jpg",
+                    kind=CatalogKind.AUDIOBOOK
                 )
             )
 
@@ -134,45 +254,59 @@ class FilesView:
 
     async def upload_book_chapter(self, request: web.Request) -> web.Response:
         book_id = request.match_info["book_id"]
-        async with self._db_session.begin() as db:
-            book = await db.get(
-                Catalog,
-                book_id,
-                options=[joinedload(Catalog.children)]
-            )
-            if not book:
-                raise web.HTTPBadRequest(text=f"Book '{book_id}' not found")
-            chapter_id = nanoid.generate(size=11)
-            chapter_filename = (await request.json())["filename"]
-            book_part = Catalog(
-                id=chapter_id,
-                parent_id=book_id,
-                filename=chapter_filename
-            )
-            db.add(book_part)
-            book.children.append(book_part)
-            await db.merge(book)
-
-        upload_url = await self._object_store.save_book_chapter(
-            book_id, chapter_id
+        chapter = _chapter(await request.json())
+        [chapter] = await self._add_chapters(book_id, [chapter])
+        # no URL when the content is already stored
+        return web.json_response(
+            {"id": chapter["id"], "url": chapter["url"]},
+            status=HTTPStatus.CREATED
         )
+
+    async def upload_book_chapters(self, request: web.Request) -> web.Response:
+        book_id = request.match_info["book_id"]
+        body = await request.json()
+        chapters = body.get("chapters")
+        if chapters is None and isinstance(body.get("filenames"), list):
+            chapters = [{"filename": filename} for filename in body["filenames"]]
+        if not isinstance(chapters, list) or not chapters:
+            raise web.HTTPBadRequest(text="Expected a list of chapters")
+        if len(chapters) > MAX_CHAPTERS_PER_REQUEST:
+            raise web.HTTPBadRequest(
+                text=f"At most {MAX_CHAPTERS_PER_REQUEST} chapters per request"
+            )
+        chapters = [_chapter(chapter) for chapter in chapters]
         return web.json_response(
-            {"id": chapter_id, "url": upload_url},
+            {"chapters": await self._add_chapters(book_id, chapters)},
             status=HTTPStatus.CREATED
         )
 
+    async def check_blobs(self, request: web.Request) -> web.Response:
+        blob_hashes = (await request.json()).get("hashes")
+        if (
+            not isinstance(blob_hashes, list)
+            or not all(isinstance(h, str) for h in blob_hashes)
+        ):
+            raise web.HTTPBadRequest(text="Expected a list of hashes")
+        if len(blob_hashes) > MAX_CHAPTERS_PER_REQUEST:
+            raise web.HTTPBadRequest(
+                text=f"At most {MAX_CHAPTERS_PER_REQUEST} hashes per request"
+            )
+        async with self._db_session() as db:
+            stored = (
+                await db.scalars(
+                    select(Blob.hash)
+                    .where(Blob.hash.in_([h.lower() for h in blob_hashes]))
+                    .where(Blob.ready)
+                )
+            ).all()
+        return web.json_response({"stored": stored})
+
     async def complete_book_upload(self, request: web.Request) -> web.Response:
         book_id = request.match_info["book_id"]
         async with self._db_session.begin() as db:
             book = await db.get(Catalog, book_id)
             if book:
-                chapters_count = await db.scalar(
-                    select(func.count(Catalog.id))
-                    .where(Catalog.parent_id == book_id)
-                )
-                if chapters_count > 0:
-                    asyncio.create_task(self._tag_book(book_id))
-                else:
+                if book.child_count == 0:
                     await db.delete(book)
                     raise web.HTTPBadRequest(
                         text=f"Book '{book_id}' has no chapters"
@@ -180,40 +314,417 @@ class FilesView:
             else:
                 raise web.HTTPBadRequest(text=f"Book '{book_id}' not found")
 
+        job_id = await self._job_queue.submit(
+            BOOK_JOB, book_id, {"book_id": book_id}
+        )
         return web.json_response(
-            {"id": book_id, "type": "audiobook"},
+            {"id": book_id, "type": "audiobook", "job": job_id},
             status=HTTPStatus.ACCEPTED
         )
 
+    async def get_job(self, request: web.Request) -> web.Response:
+        job_id = request.match_info["job_id"]
+        async with self._db_session() as db:
+            job = await db.get(Job, job_id)
+        if not job:
+            raise web.HTTPNotFound(text=f"Job '{job_id}' not found")
+
+        return web.json_response(_job_json(job))
+
+    async def get_job_events(self, request: web.Request) -> web.StreamResponse:
+        job_id = request.match_info["job_id"]
+        jobs = self._job_queue.watch(job_id)
+        if not (job := await anext(jobs, None)):
+            raise web.HTTPNotFound(text=f"Job '{job_id}' not found")
+
+        # server-sent events, the stream ends with the job
+        response = web.StreamResponse(
+            headers={hdrs.CACHE_CONTROL: "no-cache"}
+        )
+        response.content_type = "text/event-stream"
+        await response.prepare(request)
+        try:
+            while job:
+                if job.status in (JobStatus.DONE, JobStatus.FAILED):
+                    event = job.status
+                else:
+                    event = "progress"
+                await response.write(
+                    f"event: {event}\ndata: {json.dumps(_job_json(job))}\n\n"
+                    .encode()
+                )
+                job = await anext(jobs, None)
+        finally:
+            await jobs.aclose()
+        await response.write_eof()
+        return response
+
+    async def _add_chapters(
+            self, book_id: str, chapters: List[Tuple[str, str | None]]
+    ) -> List[Dict[str, str | None]]:
+        chapters = [
+            {
+                "id": nanoid.generate(size=11),
+                "parent_id": book_id,
+                "filename": filename,
+                "kind": CatalogKind.CHAPTER,
+                "blob_hash": blob_hash
+            }
+            for filename, blob_hash in chapters
+        ]
+        blob_refs = Counter(c["blob_hash"] for c in chapters if c["blob_hash"])
+        stored_blobs = set()
+        async with self._db_session.begin() as db:
+            # counted in the database, concurrent uploads add up
+            if not await db.scalar(
+                update(Catalog)
+                .where(Catalog.id == book_id)
+                .where(Catalog.kind == CatalogKind.AUDIOBOOK)
+                .values(child_count=Catalog.child_count + len(chapters))
+                .returning(Catalog.id)
+            ):
+                raise web.HTTPBadRequest(text=f"Book '{book_id}' not found")
+            if blob_refs:
+                add_blobs = insert(Blob).values(
+                    [
+                        {"hash": blob_hash, "ref_count": refs}
+                        for blob_hash, refs in blob_refs.items()
+                    ]
+                )
+                blobs = await db.execute(
+                    add_blobs.on_conflict_do_update(
+                        index_elements=[Blob.hash],
+                        set_={
+                            "ref_count": Blob.ref_count
+                            + add_blobs.excluded.ref_count
+                        }
+                    )
+                    .returning(Blob.hash, Blob.ready)
+                )
+                stored_blobs = {blob_hash for blob_hash, ready in blobs if ready}
+            await db.execute(insert(Catalog), chapters)
+            await self._feed_cache.invalidate(book_id, db)
+
+        upload_urls, blob_upload_urls = await asyncio.gather(
+            self._object_store.save_book_chapters(
+                book_id,
+                [chapter["id"] for chapter in chapters if not chapter["blob_hash"]]
+            ),
+            self._object_store.save_blobs(blob_refs.keys() - stored_blobs)
+        )
+        results = []
+        for chapter in chapters:
+            if blob_hash := chapter["blob_hash"]:
+                # content repeated within the request is uploaded once
+                upload_url = blob_upload_urls.pop(blob_hash, None)
+            else:
+                upload_url = upload_urls[chapter["id"]]
+            results.append(
+                {
+                    "id": chapter["id"],
+                    "filename": chapter["filename"],
+                    "hash": blob_hash,
+                    "url": upload_url
+                }
+            )
+        return results
+
+    async def _purge_objects(self, job: Dict[str, Any]) -> None:
+        if blob_hashes := _blob_hashes(job["object_ids"]):
+            async with self._db_session.begin() as db:
+                # not stored from now on, so a book referencing one of them
+                # meanwhile gets to upload its content again
+                unreferenced = await db.scalars(
+                    update(Blob)
+                    .where(Blob.hash.in_(blob_hashes))
+                    .where(Blob.ref_count <= 0)
+                    .values(ready=False)
+                    .returning(Blob.hash)
+                )
+                # referenced again since, e.g. by a re-upload of the book
+                kept = set(map(blob_object_id, blob_hashes)) - set(
+                    map(blob_object_id, unreferenced)
+                )
+            job["object_ids"] = [
+                object_id for object_id in job["object_ids"]
+                if object_id not in kept
+            ]
+        results = await self._object_store.delete_objects(job["object_ids"])
+        # a blob row outlives its object, else an upload in between would
+        # store the content anew only for it to be deleted here
+        if blob_hashes := _blob_hashes(
+            object_id for object_id, error in results.items() if not error
+        ):
+            async with self._db_session.begin() as db:
+                await db.execute(
+                    delete(Blob)
+                    .where(Blob.hash.in_(blob_hashes))
+                    .where(Blob.ref_count <= 0)
+                )
+        job["object_ids"] = [
+            object_id for object_id, error in results.items() if error
+        ]
+        if job["object_ids"]:
+            raise IOError(f"Couldn't delete {len(job['object_ids'])} objects")
+
+    async def _save_youtube_audio(self, youtube_url: str) -> None:
+        yt_audio = await self._object_store.save_youtube_audio(
+            youtube_url,
+            lambda downloaded, total: self._job_queue.report_progress(
+                {"downloaded": downloaded, "total": total}
+            )
+        )
+
+        video = Catalog(
+            id=yt_audio.id,
+            title=yt_audio.title,
+            description=yt_audio.description,
+            filename=yt_audio.id,
+            published=yt_audio.published,
+            duration=yt_audio.duration,
+            thumbnail_url=yt_audio.thumbnail_url,
+            audio_size=yt_audio.size,
+            audio_type=yt_audio.mime_type,
+            kind=CatalogKind.YOUTUBE,
+            ready=True
+        )
+        async with self._db_session.begin() as db:
+            db.add(video)
+            await self._feed_cache.invalidate(YOUTUBE_FEED, db)
+
+    async def _sync_playlist(self, subscription_id: str) -> None:
+        async with self._db_session() as db:
+            subscription = await db.get(Subscription, subscription_id)
+        if not subscription:
+            return
+        try:
+            video_ids = await self._object_store.list_youtube_videos(
+                subscription.url
+            )
+        except IOError:
+            # the next sync retries, an outage mustn't end the subscription
+            logger.warning(
+                "Couldn't sync subscription %s (%s)",
+                subscription_id,
+                subscription.url,
+                exc_info=True
+            )
+            video_ids = None
+
+        async with self._db_session.begin() as db:
+            # deleted meanwhile
+            if not (subscription := await db.get(Subscription, subscription_id)):
+                return
+            if video_ids is not None:
+                subscription.synced = utcnow()
+                # deleted and failed videos aren't pulled again
+                await self._submit_videos(db, video_ids, list(JobStatus))
+            await self._job_queue.submit(
+                SYNC_JOB,
+                subscription_id,
+                {"subscription_id": subscription_id},
+                db=db,
+                delay=self._sync_interval
+            )
+
+    async def _submit_videos(
+            self,
+            db: AsyncSession,
+            video_ids: List[str],
+            job_statuses: List[JobStatus]
+    ) -> Tuple[Dict[str, str], List[str]]:
+        video_ids = list(dict.fromkeys(video_ids))
+        known = set(
+            await db.scalars(
+                select(Catalog.id)
+                .where(Catalog.id.in_(video_ids))
+                .union(
+                    select(Job.key)
+                    .where(Job.kind == YOUTUBE_JOB)
+                    .where(Job.key.in_(video_ids))
+                    .where(Job.status.in_(job_statuses))
+                )
+            )
+        )
+        accepted = {}
+        for video_id in video_ids:
+            if video_id not in known:
+                accepted[video_id] = await self._job_queue.submit(
+                    YOUTUBE_JOB,
+                    video_id,
+                    {"url": f"https://youtu.be/{video_id}"},
+                    db=db
+                )
+        return accepted, [video_id for video_id in video_ids if video_id in known]
+
+    async def _subscribe(self, db: AsyncSession, playlist_url: str) -> str:
+        subscription_id = await db.scalar(
+            insert(Subscription)
+            .values(id=nanoid.generate(size=11), url=playlist_url)
+            .on_conflict_do_update(
+                index_elements=[Subscription.url],
+                set_={"url": insert(Subscription).excluded.url}
+            )
+            .returning(Subscription.id)
+        )
+        sync_queued = await db.scalar(
+            select(Job.id)
+            .where(Job.kind == SYNC_JOB)
+            .where(Job.key == subscription_id)
+            .where(Job.status.in_([JobStatus.PENDING, JobStatus.RUNNING]))
+        )
+        if not sync_queued:
+            await self._job_queue.submit(
+                SYNC_JOB,
+                subscription_id,
+                {"subscription_id": subscription_id},
+                db=db,
+                delay=self._sync_interval
+            )
+        return subscription_id
+
     async def _tag_book(self, book_id: str) -> None:
+        async def probe_chapter(object_id: str) -> FileInfo:
+            async with probes:
+                return await self._object_store.get_file_info(object_id)
+
+        async with self._db_session() as db:
+            chapters = (
+                await db.execute(
+                    select(Catalog.id, Catalog.blob_hash, Blob)
+                    .outerjoin(Blob)
+                    .where(Catalog.parent_id == book_id)
+                    .order_by(Catalog.filename)
+                )
+            ).all()
+        chapter_ids = [chapter_id for chapter_id, _, _ in chapters]
+
+        probes = asyncio.Semaphore(self._probe_concurrency)
+        probe_tasks: Dict[str, asyncio.Task] = {}
+        async with asyncio.TaskGroup() as tg:
+            for chapter_id, blob_hash, blob in chapters:
+                # stored content was probed when it was first uploaded
+                if blob and blob.ready:
+                    continue
+                object_id = _chapter_object_id(book_id, chapter_id, blob_hash)
+                if object_id not in probe_tasks:
+                    probe_tasks[object_id] = tg.create_task(
+                        probe_chapter(object_id)
+                    )
+        file_infos = [
+            _stored_file_info(blob) if blob and blob.ready
+            else probe_tasks[
+                _chapter_object_id(book_id, chapter_id, blob_hash)
+            ].result()
+            for chapter_id, blob_hash, blob in chapters
+        ]
+        probed_blobs = {
+            blob_hash: file_info
+            for (_, blob_hash, blob), file_info in zip(chapters, file_infos)
+            if blob and not blob.ready
+        }
+
+        book_title = _most_common_tag(file_infos, "album")
+        book_author = _most_common_tag(file_infos, "artist")
         async with self._db_session.begin() as db:
-            book = await db.get(
-                Catalog, book_id, options=[joinedload(Catalog.children)]
-            )
-            book_duration = 0
-            book_title = None
-            book_author = None
-            for chapter in book.children:
-                chapter_url = await self._object_store.get_object_url(
-                    f"{book_id}/{chapter.id}"
+            await db.execute(
+                update(Catalog),
+                [
+                    {
+                        "id": chapter_id,
+                        "title": file_info.tags["title"][0],
+                        "description": f"{book_author}. {book_title}",
+                        "duration": file_info.duration,
+                        "audio_size": file_info.size,
+                        "audio_type": file_info.mime_type,
+                        "ready": True
+                    }
+                    for chapter_id, file_info in zip(chapter_ids, file_infos)
+                ]
+            )
+            if probed_blobs:
+                await db.execute(
+                    update(Blob),
+                    [
+                        {
+                            "hash": blob_hash,
+                            "title": file_info.tags["title"][0],
+                            "album": file_info.tags["album"][0],
+                            "artist": file_info.tags["artist"][0],
+                            "duration": file_info.duration,
+                            "audio_size": file_info.size,
+                            "audio_type": file_info.mime_type,
+                            "ready": True
+                        }
+                        for blob_hash, file_info in probed_blobs.items()
+                    ]
                 )
-                file_info = await asyncio.to_thread(
-                    get_file_info, chapter_url
+            await db.execute(
+                update(Catalog)
+                .where(Catalog.id == book_id)
+                .values(
+                    title=book_title,
+                    description=book_author,
+                    duration=sum(i.duration for i in file_infos),
+                    ready=True
                 )
+            )
+            await self._feed_cache.invalidate(book_id, db)
+
+
+def _blob_hashes(object_ids: Iterable[str]) -> List[str]:
+    return [
+        object_id.removeprefix(BLOB_PREFIX)
+        for object_id in object_ids
+        if object_id.startswith(BLOB_PREFIX)
+    ]
+
+
+def _job_json(job: Job) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "key": job.key,
+        "status": job.status,
+        "attempts": job.attempts,
+        "progress": job.progress,
+        "error": job.error
+    }
+
+
+def _chapter(chapter: Any) -> Tuple[str, str | None]:
+    if not isinstance(chapter, dict) or not isinstance(
+        filename := chapter.get("filename"), str
+    ):
+        raise web.HTTPBadRequest(text="Expected a chapter filename")
+    if (blob_hash := chapter.get("hash")) is not None:
+        if not isinstance(blob_hash, str) or not BLOB_HASH_REGEX.fullmatch(
+            blob_hash := blob_hash.lower()
+        ):
+            raise web.HTTPBadRequest(text="Expected a SHA-256 hex digest")
+    return filename, blob_hash
+
+
+def _chapter_object_id(
+        book_id: str, chapter_id: str, blob_hash: str | None
+) -> str:
+    return blob_object_id(blob_hash) if blob_hash else f"{book_id}/{chapter_id}"
 
-                book_duration += file_info.duration
-                book_title = file_info.tags["album"][0]
-                book_author = file_info.tags["artist"][0]
 
-                chapter.title = file_info.tags["title"][0]
-                chapter.description = f"{book_author}. {book_title}"
-                chapter.duration = file_info.duration
-                chapter.audio_size = file_info.size
-                chapter.audio_type = file_info.mime_type
-                await db.merge(chapter)
+def _stored_file_info(blob: Blob) -> FileInfo:
+    return FileInfo(
+        size=blob.audio_size,
+        duration=blob.duration,
+        mime_type=blob.audio_type,
+        tags={
+            "title": [blob.title],
+            "album": [blob.album],
+            "artist": [blob.artist]
+        }
+    )
 
-            book.title = book_title
-            book.description = book_author
-            book.duration = book_duration
 
-        await db.merge(book)
+def _most_common_tag(file_infos: Iterable[FileInfo], tag: str) -> str:
+    # ties go to the earliest chapter
+    tags = Counter(i.tags[tag][0] for i in file_infos)
+    return tags.most_common(1)[0][0]
@@ -0,0 +1,52 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import Optional, Tuple
+
+from aiohttp import web
+from sqlalchemy import Select, desc, tuple_
+
+from db import Catalog
+
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(item: Catalog) -> str:
+    cursor = f"{item.created.isoformat()}|{item.id}"
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created, item_id = (
+            base64.urlsafe_b64decode(cursor).decode().split("|", 1)
+        )
+        return datetime.fromisoformat(created), item_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise web.HTTPBadRequest(text=f"Invalid cursor '{cursor}'")
+
+
+def newest_first(query: Select, cursor: Optional[str]) -> Select:
+    query = query.order_by(desc(Catalog.created), desc(Catalog.id))
+    if cursor:
+        # (created, id) is unique, so no item is skipped or repeated
+        query = query.where(
+            tuple_(Catalog.created, Catalog.id) < tuple_(*decode_cursor(cursor))
+        )
+    return query
+
+
+def page_size(request: web.Request) -> Optional[int]:
+    if (limit := request.query.get("limit")) is None:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"Invalid limit '{limit}'")
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise web.HTTPBadRequest(
+            text=f"Limit must be between 1 and {MAX_PAGE_SIZE}"
+        )
+    return limit
+
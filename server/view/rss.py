@@ -0,0 +1,94 @@
+from datetime import datetime, UTC
+from email.utils import format_datetime
+import re
+from typing import Optional
+from xml.sax.saxutils import escape
+
+
+RSS_HEADER = (
+    "<?xml version='1.0' encoding='UTF-8'?>\n"
+    '<rss xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd"'
+    ' xmlns:atom="http://www.w3.org/2005/Atom"'
+    ' xmlns:content="http://purl.org/rss/1.0/modules/content/"'
+    ' version="2.0">'
+)
+# not allowed in XML 1.0 even as character references
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def rss_channel(
+        title: str,
+        description: str,
+        link: str,
+        logo: Optional[str] = None,
+        last_build: Optional[datetime] = None
+) -> bytes:
+    channel = [
+        RSS_HEADER,
+        "<channel>",
+        _element("title", title),
+        _element("link", link),
+        _element("description", description),
+        f'<atom:link href={_attr(link)} rel="self"/>',
+        "<docs>http://www.rssboard.org/rss-specification</docs>",
+        "<generator>stethoscope</generator>"
+    ]
+    if logo:
+        channel += [
+            "<image>",
+            _element("url", logo),
+            _element("title", title),
+            _element("link", link),
+            "</image>"
+        ]
+    channel.append(
+        _element("lastBuildDate", format_datetime(last_build or datetime.now(UTC)))
+    )
+    return "".join(channel).encode()
+
+
+def rss_item(
+        guid: str,
+        title: str,
+        description: str,
+        published: datetime,
+        media_link: str,
+        media_size: int,
+        media_type: str,
+        duration: int
+) -> bytes:
+    return "".join([
+        "<item>",
+        _element("title", title),
+        _element("description", description),
+        f'<guid isPermaLink="false">{_text(guid)}</guid>',
+        f"<enclosure url={_attr(media_link)}"
+        f" length={_attr(str(media_size))}"
+        f" type={_attr(media_type)}/>",
+        _element("pubDate", format_datetime(published)),
+        _element("itunes:duration", str(duration)),
+        "</item>"
+    ]).encode()
+
+
+def rss_end(next_link: Optional[str] = None) -> bytes:
+    # items are streamed, so whether there's a next page is known only here
+    end = f'<atom:link href={_attr(next_link)} rel="next"/>' if next_link else ""
+    return f"{end}</channel></rss>".encode()
+
+
+def _element(name: str, text: Optional[str]) -> str:
+    return f"<{name}>{_text(text)}</{name}>"
+
+
+def _attr(value: Optional[str]) -> str:
+    return '"' + escape(_valid_chars(value), {'"': "&quot;"}) + '"'
+
+
+def _text(text: Optional[str]) -> str:
+    return escape(_valid_chars(text))
+
+
+def _valid_chars(text: Optional[str]) -> str:
+    # e.g. a video description with a stray escape code
+    return INVALID_XML_CHARS.sub("", text or "")
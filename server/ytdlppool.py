@@ -0,0 +1,425 @@
+import asyncio
+from contextlib import asynccontextmanager
+import importlib
+import itertools
+import logging
+import multiprocessing
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+import os
+import re
+import resource
+import sys
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Set, Tuple
+
+from metrics import Counter
+
+
+YT_DLP_FORMAT = "ba[ext=m4a]"
+YT_DLP_PARAMS = {"usenetrc": True, "netrc_location": "/etc/stethoscope/"}
+YT_DLP_INFO_FIELDS = ("id", "title", "description", "duration", "epoch", "thumbnail")
+# entries listed per playlist or channel, newest first for channels
+MAX_PLAYLIST_VIDEOS = 5000
+YOUTUBE_VIDEO_ID_REGEX = re.compile(r"[0-9A-Za-z_-]{11}")
+MAX_JOBS = 50
+MAX_RSS_MB = 512
+PROGRESS_INTERVAL = 0.5
+SPAWN_RETRY_DELAY = 5
+
+YT_DLP_WORKER_EXITS = Counter(
+    "yt_dlp_worker_exits_total", "yt-dlp worker processes replaced", ["reason"]
+)
+
+logger = logging.getLogger(__name__)
+
+
+class YtDlpPool:
+    def __init__(
+            self,
+            size: int,
+            params: Dict[str, Any] = YT_DLP_PARAMS,
+            extractor: str | None = None,
+            max_jobs: int = MAX_JOBS,
+            max_rss_mb: int = MAX_RSS_MB
+    ):
+        self._size = size
+        # "module:Class" of the only extractor to use, e.g. a stub for tests
+        self._worker_args = (params, extractor, max_jobs, max_rss_mb)
+        # a forked worker would inherit the event loop and the server socket
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: asyncio.Queue[_Worker] = asyncio.Queue()
+        self._workers: Set[_Worker] = set()
+        self._spawns: Set[asyncio.Task] = set()
+
+    async def start(self, _=None) -> None:
+        # workers take a while to import yt-dlp, don't hold up startup
+        for _ in range(self._size):
+            self._spawn()
+
+    async def close(self, _=None) -> None:
+        for spawn in self._spawns:
+            spawn.cancel()
+        await asyncio.gather(*self._spawns, return_exceptions=True)
+        for worker in self._workers:
+            worker.stop()
+        self._workers.clear()
+
+    @asynccontextmanager
+    async def download(
+            self,
+            url: str,
+            output: str | None,
+            on_progress: Callable[[int, int | None], None]
+    ) -> AsyncIterator["YtDlpRun"]:
+        async with self._run(
+            ("download", url, output), output is None, on_progress
+        ) as run:
+            yield run
+
+    async def list_videos(self, url: str) -> List[str]:
+        async with self._run(("list", url), False, lambda *_: None) as run:
+            video_ids = await run.info
+            await run.wait()
+        return video_ids
+
+    @asynccontextmanager
+    async def _run(
+            self,
+            message: Tuple,
+            to_stdout: bool,
+            on_progress: Callable[[int, int | None], None]
+    ) -> AsyncIterator["YtDlpRun"]:
+        worker = await self._idle.get()
+        try:
+            run = YtDlpRun(worker, message, to_stdout, on_progress)
+        except OSError:
+            # died while idle
+            self._replace(worker, "crashed")
+            raise
+        try:
+            if to_stdout:
+                await run.open_stdout()
+            yield run
+        finally:
+            await run.close()
+            if not run.done.done():
+                # still running, nothing else can use it
+                self._replace(worker, "cancelled")
+            elif run.done.exception():
+                self._replace(worker, "crashed")
+            elif run.done.result():
+                self._replace(worker, "recycled")
+            else:
+                self._idle.put_nowait(worker)
+
+    def _replace(self, worker: "_Worker", reason: str) -> None:
+        YT_DLP_WORKER_EXITS.inc(reason)
+        self._workers.discard(worker)
+        worker.stop()
+        self._spawn()
+
+    def _spawn(self) -> None:
+        spawn = asyncio.create_task(self._start_worker())
+        self._spawns.add(spawn)
+        spawn.add_done_callback(self._spawns.discard)
+
+    async def _start_worker(self) -> None:
+        while True:
+            worker = None
+            try:
+                worker = _Worker(self._context, self._worker_args)
+                if await worker.recv() == ("ready",):
+                    break
+            except (EOFError, OSError):
+                pass
+            finally:
+                if worker and not worker.ready:
+                    worker.stop()
+            logger.warning("yt-dlp worker didn't start, retrying")
+            await asyncio.sleep(SPAWN_RETRY_DELAY)
+        self._workers.add(worker)
+        self._idle.put_nowait(worker)
+
+
+class YtDlpRun:
+    def __init__(
+            self,
+            worker: "_Worker",
+            message: Tuple,
+            to_stdout: bool,
+            on_progress: Callable[[int, int | None], None]
+    ):
+        loop = asyncio.get_running_loop()
+        # the video info of a download, the video ids of a listing
+        self.info: asyncio.Future[Any] = loop.create_future()
+        # resolves to whether the worker asks to be recycled, fails if it died
+        self.done: asyncio.Future[bool] = loop.create_future()
+        self.stdout: asyncio.StreamReader | None = None
+        self._error: str | None = None
+        self._stdout_fd: int | None = None
+        self._stdout_transport: asyncio.ReadTransport | None = None
+        self._worker = worker
+        if to_stdout:
+            # the worker writes the audio to the pipe in place of its stdout
+            self._stdout_fd, write_fd = os.pipe()
+            try:
+                worker.send(message, write_fd)
+            except OSError:
+                os.close(self._stdout_fd)
+                raise
+            finally:
+                os.close(write_fd)
+        else:
+            worker.send(message)
+        self._task = asyncio.create_task(self._read(on_progress))
+
+    async def open_stdout(self) -> None:
+        self.stdout = asyncio.StreamReader()
+        self._stdout_transport, _ = (
+            await asyncio.get_running_loop().connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(self.stdout),
+                os.fdopen(self._stdout_fd, "rb", 0)
+            )
+        )
+        self._stdout_fd = None
+
+    async def wait(self) -> None:
+        await asyncio.shield(self.done)
+        if self._error is not None:
+            raise IOError(f"yt-dlp failed: {self._error}")
+
+    async def close(self) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        if self._stdout_transport:
+            self._stdout_transport.close()
+        if self._stdout_fd is not None:
+            os.close(self._stdout_fd)
+
+    async def _read(self, on_progress: Callable[[int, int | None], None]) -> None:
+        try:
+            while True:
+                match await self._worker.recv():
+                    case ("info", info):
+                        self.info.set_result(info)
+                    case ("progress", downloaded, total):
+                        on_progress(downloaded, total)
+                    case ("done", error, recycle):
+                        self._error = error
+                        self.done.set_result(recycle)
+                        return
+        except (EOFError, OSError) as e:
+            self.done.set_exception(IOError(f"yt-dlp worker died: {e!r}"))
+        finally:
+            if not self.info.done():
+                if self._error is not None:
+                    self.info.set_exception(IOError(f"yt-dlp failed: {self._error}"))
+                elif self.done.done():
+                    self.info.set_exception(
+                        self.done.exception() or IOError("yt-dlp sent no info")
+                    )
+                else:
+                    self.info.cancel()
+            # retrieved by the pool, not worth a warning when nobody waits
+            if self.done.done() and not self.done.cancelled():
+                self.done.exception()
+
+
+class _Worker:
+    def __init__(self, context, worker_args: Tuple):
+        self.ready = False
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_work,
+            args=(child_conn, *worker_args),
+            name="yt-dlp",
+            daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+
+    def send(self, message: Tuple, fd: int | None = None) -> None:
+        self._conn.send(message)
+        if fd is not None:
+            reduction.send_handle(self._conn, fd, self._process.pid)
+
+    async def recv(self) -> Any:
+        # messages are small, only waiting for them would block the loop
+        loop = asyncio.get_running_loop()
+        while not self._conn.poll():
+            readable = loop.create_future()
+            loop.add_reader(
+                self._conn.fileno(),
+                lambda: readable.done() or readable.set_result(None)
+            )
+            try:
+                await readable
+            finally:
+                loop.remove_reader(self._conn.fileno())
+        message = self._conn.recv()
+        self.ready = self.ready or message == ("ready",)
+        return message
+
+    def stop(self) -> None:
+        self._process.kill()
+        self._process.join()
+        self._conn.close()
+
+
+def _work(
+        conn: Connection,
+        params: Dict[str, Any],
+        extractor: str | None,
+        max_jobs: int,
+        max_rss_mb: int
+) -> None:
+    import yt_dlp
+
+    extractor_class = None
+    if extractor:
+        module, _, name = extractor.partition(":")
+        extractor_class = getattr(importlib.import_module(module), name)
+    else:
+        # loads the extractors ahead of the first download
+        yt_dlp.YoutubeDL({"quiet": True}).get_info_extractor("Youtube")
+    conn.send(("ready",))
+
+    for jobs in itertools.count(1):
+        try:
+            message = conn.recv()
+            if message[0] == "download" and message[2] is None:
+                stdout_fd = reduction.recv_handle(conn)
+            else:
+                stdout_fd = None
+        except EOFError:
+            return
+        try:
+            match message:
+                case ("download", url, output):
+                    _download(
+                        conn, yt_dlp, params, extractor_class, url, output, stdout_fd
+                    )
+                case ("list", url):
+                    _list(conn, yt_dlp, params, extractor_class, url)
+            error = None
+        except Exception as e:
+            error = str(e)
+        recycle = jobs >= max_jobs or _rss_mb() > max_rss_mb
+        conn.send(("done", error, recycle))
+        if recycle:
+            return
+
+
+def _rss_mb() -> float:
+    # the current size, the peak in ru_maxrss never goes down once a big
+    # video is done
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def _list(
+        conn: Connection,
+        yt_dlp,
+        params: Dict[str, Any],
+        extractor_class,
+        url: str
+) -> None:
+    with yt_dlp.YoutubeDL(
+        {
+            **params,
+            # the entries' own pages aren't fetched
+            "extract_flat": "in_playlist",
+            "playlistend": MAX_PLAYLIST_VIDEOS,
+            "quiet": True
+        },
+        auto_init=not extractor_class
+    ) as ydl:
+        if extractor_class:
+            ydl.add_info_extractor(extractor_class())
+        playlist = ydl.extract_info(url, download=False)
+    conn.send(
+        (
+            "info",
+            [
+                entry["id"]
+                for entry in playlist.get("entries") or []
+                if entry
+                and entry.get("id")
+                and is_video_entry(entry.get("ie_key"), entry["id"])
+            ]
+        )
+    )
+
+
+def is_video_entry(ie_key: str | None, entry_id: str) -> bool:
+    # channel pages also list their tabs and playlists
+    return ie_key == "Youtube" or bool(YOUTUBE_VIDEO_ID_REGEX.fullmatch(entry_id))
+
+
+def _download(
+        conn: Connection,
+        yt_dlp,
+        params: Dict[str, Any],
+        extractor_class,
+        url: str,
+        output: str | None,
+        stdout_fd: int | None
+) -> None:
+    class SendInfo(yt_dlp.postprocessor.PostProcessor):
+        def run(self, info):
+            conn.send(
+                ("info", {field: info.get(field) for field in YT_DLP_INFO_FIELDS})
+            )
+            return [], info
+
+    reported = 0.0
+
+    def send_progress(progress):
+        nonlocal reported
+        if (
+            progress["status"] == "finished"
+            or time.monotonic() - reported >= PROGRESS_INTERVAL
+        ):
+            reported = time.monotonic()
+            conn.send(
+                (
+                    "progress",
+                    progress.get("downloaded_bytes") or 0,
+                    progress.get("total_bytes")
+                    or progress.get("total_bytes_estimate")
+                )
+            )
+
+    saved_stdout = None
+    if stdout_fd is not None:
+        # yt-dlp writes "-" to stdout
+        sys.stdout.flush()
+        saved_stdout = os.dup(1)
+        os.dup2(stdout_fd, 1)
+        os.close(stdout_fd)
+    try:
+        with yt_dlp.YoutubeDL(
+            {
+                **params,
+                "format": YT_DLP_FORMAT,
+                "outtmpl": output or "-",
+                "quiet": True,
+                "noprogress": True,
+                "logtostderr": True,
+                "progress_hooks": [send_progress]
+            },
+            auto_init=not extractor_class
+        ) as ydl:
+            if extractor_class:
+                ydl.add_info_extractor(extractor_class())
+            # runs after the format is picked, like --print video:
+            ydl.add_post_processor(SendInfo(), when="video")
+            if ydl.download([url]) != 0:
+                raise IOError(f"Couldn't download '{url}'")
+    finally:
+        if saved_stdout is not None:
+            sys.stdout.flush()
+            # drops the last reference to the pipe, the parent reads to its end
+            os.dup2(saved_stdout, 1)
+            os.close(saved_stdout)